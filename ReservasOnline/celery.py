@@ -17,11 +17,19 @@ app.autodiscover_tasks()
 app.conf.beat_schedule = {
     'enviar-lembretes-diarios': {
         'task': 'notificacoes.tasks.enviar_lembretes_reservas',
-        'schedule': crontab(hour=9, minute=0),  # Executa todos os dias às 9h
+        'schedule': crontab(hour=9, minute=0),  # Prepara às 9h e envia em ondas ao longo de REMINDER_WINDOW_MINUTES
+    },
+    'processar-transicoes-vencidas': {
+        'task': 'reservas.tasks.processar_transicoes_vencidas',
+        'schedule': crontab(),  # Executa a cada minuto
     },
     'verificar-confirmacoes-reservas': {
         'task': 'reservas.tasks.verificar_confirmacoes_reservas',
-        'schedule': crontab(hour='*/1'),  # Executa a cada hora
+        'schedule': crontab(minute=0, hour='*/6'),  # Varredura de segurança a cada 6 horas
+    },
+    'verificar-reservas-concluidas': {
+        'task': 'reservas.tasks.verificar_reservas_concluidas',
+        'schedule': crontab(minute=10, hour='*/6'),  # Varredura de segurança a cada 6 horas
     },
     'enviar-relatorio-semanal': {
         'task': 'admin_dashboard.tasks.enviar_relatorio_semanal',
@@ -29,7 +37,23 @@ app.conf.beat_schedule = {
     },
     'arquivar-reservas-antigas': {
         'task': 'reservas.tasks.arquivar_reservas_antigas',
-        'schedule': crontab(day_of_month=1, hour=0, minute=0),  # Primeiro dia do mês
+        'schedule': crontab(hour=3, minute=30),  # Executa todos os dias às 3h30
+    },
+    'avancar-horizonte-slots': {
+        'task': 'reservas.tasks.avancar_horizonte_slots',
+        'schedule': crontab(hour=0, minute=30),  # Executa todos os dias às 0h30
+    },
+    'recalcular-disponibilidade-em-massa': {
+        'task': 'reservas.tasks.recalcular_disponibilidade_em_massa',
+        'schedule': crontab(hour=2, minute=0),  # Executa todos os dias às 2h
+    },
+    'auditar-conflitos-reservas': {
+        'task': 'reservas.tasks.auditar_conflitos_reservas',
+        'schedule': crontab(hour=4, minute=0),  # Executa todos os dias às 4h
+    },
+    'reconciliar-capacidade-diaria': {
+        'task': 'reservas.tasks.reconciliar_capacidade_diaria',
+        'schedule': crontab(minute=15),  # Executa a cada hora
     },
 }
 
@@ -170,6 +170,25 @@ EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = env('EMAIL_HOST_USER')
 
+# Janela (minutos) em que os lembretes diários são enviados, em ondas igualmente espaçadas
+REMINDER_WINDOW_MINUTES = env.int('REMINDER_WINDOW_MINUTES', default=180)
+
+# Quantidade de lembretes por onda de envio
+REMINDER_WAVE_SIZE = env.int('REMINDER_WAVE_SIZE', default=100)
+
+# Limite de emails enviados por segundo, somando todos os workers, e rajada máxima após ociosidade
+EMAIL_RATE_LIMIT_PER_SECOND = env.float('EMAIL_RATE_LIMIT_PER_SECOND', default=10)
+EMAIL_RATE_LIMIT_BURST = env.int('EMAIL_RATE_LIMIT_BURST', default=10)
+
+# Falhas consecutivas do servidor SMTP que pausam o envio e duração (segundos) da pausa
+EMAIL_CIRCUIT_BREAKER_FAILURES = env.int('EMAIL_CIRCUIT_BREAKER_FAILURES', default=5)
+EMAIL_CIRCUIT_BREAKER_PAUSE_SECONDS = env.int('EMAIL_CIRCUIT_BREAKER_PAUSE_SECONDS', default=60)
+
+# Tentativas de envio por notificação e espera (segundos) entre elas, dobrada a cada falha
+EMAIL_MAX_SEND_ATTEMPTS = env.int('EMAIL_MAX_SEND_ATTEMPTS', default=5)
+EMAIL_RETRY_BASE_SECONDS = env.int('EMAIL_RETRY_BASE_SECONDS', default=60)
+EMAIL_RETRY_MAX_SECONDS = env.int('EMAIL_RETRY_MAX_SECONDS', default=3600)
+
 # Configurações do Celery
 CELERY_BROKER_URL = env('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = env('CELERY_RESULT_BACKEND')
@@ -178,6 +197,25 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Cache (Redis)
+REDIS_CACHE_URL = env('REDIS_CACHE_URL', default='redis://redis:6379/1')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_CACHE_URL,
+        'KEY_PREFIX': 'reservas',
+    }
+}
+
+# Tempo (segundos) que os horários calculados de um prestador/dia ficam em cache
+AVAILABILITY_CACHE_TIMEOUT = env.int('AVAILABILITY_CACHE_TIMEOUT', default=60 * 60 * 24)
+
+# Número de dias à frente materializados em ProviderSlot para prestadores de alto volume
+SLOT_MATERIALIZATION_DAYS = env.int('SLOT_MATERIALIZATION_DAYS', default=60)
+
+# Tempo (segundos) que um horário fica retido durante o checkout
+SLOT_HOLD_SECONDS = env.int('SLOT_HOLD_SECONDS', default=300)
+
 # Configurações de segurança
 SECURE_CONTENT_TYPE_NOSNIFF = True
 SECURE_BROWSER_XSS_FILTER = True
@@ -151,6 +151,10 @@ def update_user_preferences(request, data: UserPreferenceUpdateSchema):
         preferences.receive_reminders = data.receive_reminders
     if data.report_frequency is not None:
         preferences.report_frequency = data.report_frequency
+    if data.digest_mode is not None:
+        preferences.digest_mode = data.digest_mode
+    if data.digest_window_minutes is not None:
+        preferences.digest_window_minutes = data.digest_window_minutes
     
     preferences.save()
     return preferences
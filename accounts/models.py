@@ -93,6 +93,8 @@ class UserPreference(models.Model):
     notification_type = models.CharField(_('tipo de notificação'), max_length=10, choices=NOTIFICATION_TYPE_CHOICES, default='html')
     receive_reminders = models.BooleanField(_('receber lembretes'), default=True)
     report_frequency = models.CharField(_('frequência de relatórios'), max_length=10, choices=REPORT_FREQUENCY_CHOICES, default='weekly')
+    digest_mode = models.BooleanField(_('receber resumo de notificações'), default=False)
+    digest_window_minutes = models.PositiveIntegerField(_('janela do resumo (minutos)'), default=60)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -75,11 +75,15 @@ class UserPreferenceSchema(Schema):
     notification_type: str = Field(pattern="^(html|text)$")
     receive_reminders: bool
     report_frequency: str = Field(pattern="^(never|daily|weekly|monthly)$")
+    digest_mode: bool
+    digest_window_minutes: int
 
 class UserPreferenceUpdateSchema(Schema):
     notification_type: Optional[str] = Field(default=None, pattern="^(html|text)$")
     receive_reminders: Optional[bool] = None
     report_frequency: Optional[str] = Field(default=None, pattern="^(never|daily|weekly|monthly)$")
+    digest_mode: Optional[bool] = None
+    digest_window_minutes: Optional[int] = Field(default=None, ge=5, le=1440)
 
 class UserOutSchema(Schema):
     id: int
@@ -0,0 +1,29 @@
+from ninja import Router
+from django.core.cache import cache
+from typing import Dict, Any
+from core.auth import JWTAuth, admin_required
+from core.coalescencia import agendar_coalescido
+from core.metricas import obter_metricas
+from .tasks import gerar_estatisticas_dashboard, CHAVE_ESTATISTICAS
+
+router = Router()
+
+# Janela (segundos) em que pedidos de atualização do dashboard são agrupados
+JANELA_ESTATISTICAS = 60
+
+@router.get("/dashboard", auth=JWTAuth(), response=Dict[str, Any])
+@admin_required
+def get_dashboard_stats(request):
+    """Retorna as estatísticas do dashboard e agenda uma atualização (agrupada) em segundo plano."""
+    estatisticas = cache.get(CHAVE_ESTATISTICAS)
+    if estatisticas is None:
+        return gerar_estatisticas_dashboard()
+
+    agendar_coalescido(gerar_estatisticas_dashboard, 'global', janela=JANELA_ESTATISTICAS)
+    return estatisticas
+
+@router.get("/metricas", auth=JWTAuth(), response=Dict[str, float])
+@admin_required
+def get_metrics(request):
+    """Retorna as métricas operacionais (tarefas agrupadas, auditorias etc.)."""
+    return obter_metricas()
@@ -1,7 +1,9 @@
 from celery import shared_task
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Avg, Sum, Q, F
+from django.core.cache import cache
+from django.db.models import Count, Sum, Q, F
+from collections import Counter, defaultdict
 from datetime import timedelta, datetime
 import logging
 import io
@@ -10,15 +12,18 @@ from openpyxl.chart import BarChart, Reference, PieChart
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, Alignment, PatternFill
 
-from reservas.models import Booking, Provider
+from core.coalescencia import consumir_itens
+from core.travas import execucao_unica
+from reservas.models import Booking, BookingArchive, Provider
 from avaliacoes.models import Review
-from notificacoes.tasks import criar_e_enviar_notificacao
+from notificacoes.tasks import criar_e_enviar_notificacoes_lote
 from .models import Report
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 @shared_task
+@execucao_unica(intervalo_minimo=3600)
 def enviar_relatorio_semanal():
     """Gera e envia um relatório semanal para administradores."""
     agora = timezone.now()
@@ -27,6 +32,7 @@ def enviar_relatorio_semanal():
     # Busca usuários administradores
     admins = User.objects.filter(user_type='admin', is_active=True)
     
+    notificacoes = []
     for admin in admins:
         try:
             # Verifica a frequência de relatórios preferida
@@ -40,24 +46,27 @@ def enviar_relatorio_semanal():
             titulo = f"Relatório Semanal - {inicio_semana.strftime('%d/%m/%Y')} a {agora.strftime('%d/%m/%Y')}"
             relatorio = gerar_relatorio_semanal(admin.id, inicio_semana, agora, titulo)
             
-            # Envia notificação com o relatório
-            criar_e_enviar_notificacao.delay(
-                recipient_id=admin.id,
-                notification_type='report',
-                object_id=str(relatorio.id),
-                entity_type='Report',
-                context={
+            notificacoes.append({
+                'recipient': admin,
+                'notification_type': 'report',
+                'object_id': str(relatorio.id),
+                'entity_type': 'Report',
+                'content_object': relatorio,
+                'context': {
                     'report': {
                         'title': titulo,
                         'start_date': inicio_semana.strftime('%d/%m/%Y'),
                         'end_date': agora.strftime('%d/%m/%Y')
                     }
                 }
-            )
+            })
             
         except Exception as e:
             logger.error(f"Erro ao gerar relatório para {admin.email}: {str(e)}")
     
+    # Envia as notificações com os relatórios em lote
+    criar_e_enviar_notificacoes_lote(notificacoes)
+    
     return f"Processo de geração de relatórios semanais concluído para {admins.count()} administradores."
 
 @shared_task
@@ -86,14 +95,20 @@ def gerar_relatorio_semanal(admin_id, inicio, fim, titulo):
                          .values('data', 'total')
                          .order_by('data'))
         
-        # Avaliações
+        # Avaliações, incluindo as das reservas já movidas para o arquivo
         avaliacoes = Review.objects.filter(
             created_at__gte=inicio,
             created_at__lte=fim
-        )
+        ).aggregate(total=Count('id'), soma=Sum('rating'))
+        arquivadas = BookingArchive.objects.filter(
+            review_rating__isnull=False,
+            review_created_at__gte=inicio,
+            review_created_at__lte=fim
+        ).aggregate(total=Count('id'), soma=Sum('review_rating'))
         
-        total_avaliacoes = avaliacoes.count()
-        media_avaliacoes = avaliacoes.aggregate(Avg('rating'))['rating__avg'] or 0
+        total_avaliacoes = avaliacoes['total'] + arquivadas['total']
+        soma_avaliacoes = (avaliacoes['soma'] or 0) + (arquivadas['soma'] or 0)
+        media_avaliacoes = soma_avaliacoes / total_avaliacoes if total_avaliacoes else 0
         
         # Gera um relatório em Excel
         report_file = _gerar_excel_relatorio(
@@ -259,9 +274,15 @@ def _gerar_excel_relatorio(titulo, inicio, fim, total_reservas, reservas_por_sta
     
     return output
 
+# Chave do cache com as últimas estatísticas do dashboard
+CHAVE_ESTATISTICAS = 'admin_dashboard:estatisticas'
+
 @shared_task
-def gerar_estatisticas_dashboard():
-    """Gera estatísticas para o dashboard administrativo."""
+def gerar_estatisticas_dashboard(chave_coalescencia=None):
+    """Gera estatísticas para o dashboard administrativo e as guarda em cache."""
+    if chave_coalescencia is not None:
+        consumir_itens(gerar_estatisticas_dashboard, chave_coalescencia)
+    
     try:
         # Período para estatísticas
         agora = timezone.now()
@@ -298,17 +319,39 @@ def gerar_estatisticas_dashboard():
                         .annotate(total=Count('id'))
                         .order_by('-total')[:5])
         
-        # Prestadores melhor avaliados
-        top_avaliados = list(Review.objects.filter(created_at__gte=inicio_mes)
-                      .values('booking__provider__id', 'booking__provider__user__first_name', 'booking__provider__user__last_name')
-                      .annotate(media=Avg('rating'), total=Count('id'))
-                      .filter(total__gte=5)  # Pelo menos 5 avaliações
-                      .order_by('-media')[:5])
+        # Prestadores melhor avaliados, somando as avaliações ativas e as arquivadas
+        ativas = (Review.objects.filter(created_at__gte=inicio_mes)
+                  .values_list('booking__provider__id', 'booking__provider__user__first_name', 'booking__provider__user__last_name')
+                  .annotate(soma=Sum('rating'), total=Count('id')))
+        arquivadas = (BookingArchive.objects.filter(review_rating__isnull=False, review_created_at__gte=inicio_mes)
+                      .values_list('provider__id', 'provider__user__first_name', 'provider__user__last_name')
+                      .annotate(soma=Sum('review_rating'), total=Count('id')))
+        notas_prestadores = defaultdict(lambda: [0, 0])
+        for provider_id, nome, sobrenome, soma, total in list(ativas) + list(arquivadas):
+            notas_prestadores[(provider_id, nome, sobrenome)][0] += soma
+            notas_prestadores[(provider_id, nome, sobrenome)][1] += total
+        top_avaliados = sorted(
+            [
+                {
+                    'booking__provider__id': provider_id,
+                    'booking__provider__user__first_name': nome,
+                    'booking__provider__user__last_name': sobrenome,
+                    'media': soma / total,
+                    'total': total
+                }
+                for (provider_id, nome, sobrenome), (soma, total) in notas_prestadores.items()
+                if total >= 5  # Pelo menos 5 avaliações
+            ],
+            key=lambda linha: -linha['media']
+        )[:5]
         
-        # Distribuição de avaliações
-        distribuicao_avaliacoes = dict(Review.objects.values('rating').annotate(total=Count('id')).values_list('rating', 'total'))
+        # Distribuição de avaliações, incluindo as arquivadas
+        distribuicao_avaliacoes = Counter(dict(Review.objects.values_list('rating').annotate(total=Count('id'))))
+        distribuicao_avaliacoes.update(dict(BookingArchive.objects.filter(review_rating__isnull=False)
+                                            .values_list('review_rating').annotate(total=Count('id'))))
+        distribuicao_avaliacoes = dict(distribuicao_avaliacoes)
         
-        return {
+        estatisticas = {
             'total_usuarios': total_usuarios,
             'total_prestadores': total_prestadores,
             'total_reservas': total_reservas,
@@ -325,6 +368,9 @@ def gerar_estatisticas_dashboard():
                 'fim': agora.isoformat()
             }
         }
+        cache.set(CHAVE_ESTATISTICAS, estatisticas, timeout=None)
+        
+        return estatisticas
     
     except Exception as e:
         logger.error(f"Erro ao gerar estatísticas do dashboard: {str(e)}")
@@ -0,0 +1,65 @@
+import json
+from typing import Any, Iterable, List
+
+from .redis import get_redis_client
+from . import metricas
+
+PREFIXO = 'coalescencia'
+
+# Lê e remove atomicamente os itens acumulados e libera a janela, para que
+# disparos seguintes agendem uma nova execução
+_SCRIPT_CONSUMIR = """
+local itens = redis.call('SMEMBERS', KEYS[1])
+redis.call('DEL', KEYS[1], KEYS[2])
+return itens
+"""
+
+def _chaves(tarefa, chave):
+    base = f'{PREFIXO}:{tarefa.name}:{chave}'
+    return f'{base}:itens', f'{base}:agendada'
+
+def agendar_coalescido(tarefa, chave: str, itens: Iterable[Any] = (), janela: int = 30, agendar=None) -> bool:
+    """
+    Agenda `tarefa` para daqui a `janela` segundos, agrupando disparos com a mesma chave.
+
+    Os itens (serializáveis em JSON) de todos os disparos da janela são
+    acumulados em um conjunto no Redis; apenas o primeiro disparo enfileira a
+    tarefa, que recebe `chave_coalescencia` e lê a união dos itens com
+    consumir_itens(). Retorna True se a tarefa foi enfileirada e False se o
+    disparo foi agrupado a uma execução já agendada.
+
+    `agendar(tarefa, kwargs, atraso)` substitui o apply_async com countdown,
+    por exemplo para adiar a execução pela caixa de saída em janelas mais
+    longas que o visibility_timeout do broker.
+    """
+    chave_itens, chave_agendada = _chaves(tarefa, chave)
+    itens = [json.dumps(item, sort_keys=True) for item in itens]
+
+    pipe = get_redis_client().pipeline()
+    if itens:
+        pipe.sadd(chave_itens, *itens)
+        # Os itens sobrevivem à janela caso a execução atrase na fila
+        pipe.expire(chave_itens, janela * 20)
+    pipe.set(chave_agendada, 1, nx=True, ex=janela * 10)
+    agendada = pipe.execute()[-1]
+
+    if not agendada:
+        metricas.incrementar(f'coalescencia.suprimidas.{tarefa.name}')
+        return False
+
+    try:
+        if agendar:
+            agendar(tarefa, {'chave_coalescencia': chave}, janela)
+        else:
+            tarefa.apply_async(kwargs={'chave_coalescencia': chave}, countdown=janela)
+    except Exception:
+        # Sem a execução enfileirada, a marca suprimiria todos os disparos até expirar
+        get_redis_client().delete(chave_agendada)
+        raise
+    metricas.incrementar(f'coalescencia.execucoes.{tarefa.name}')
+    return True
+
+def consumir_itens(tarefa, chave: str) -> List[Any]:
+    """Retorna e remove os itens acumulados para a chave, liberando um novo agendamento."""
+    chave_itens, chave_agendada = _chaves(tarefa, chave)
+    return [json.loads(item) for item in get_redis_client().eval(_SCRIPT_CONSUMIR, 2, chave_itens, chave_agendada)]
@@ -0,0 +1,41 @@
+from .redis import get_redis_client
+from . import metricas
+
+PREFIXO = 'disjuntor'
+
+# Conta a falha e abre o disjuntor ao atingir o limite. Ao abrir, a contagem
+# fica em limite - 1: passada a pausa, uma única falha reabre o disjuntor
+# (meio-aberto) e um sucesso zera a contagem.
+_SCRIPT_FALHA = """
+local falhas = redis.call('INCR', KEYS[1])
+if falhas >= tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[2])
+    redis.call('SET', KEYS[1], tonumber(ARGV[1]) - 1)
+    return 1
+end
+return 0
+"""
+
+def _chaves(nome):
+    return f'{PREFIXO}:{nome}:falhas', f'{PREFIXO}:{nome}:aberto'
+
+def restante(nome: str) -> float:
+    """Segundos até o disjuntor `nome` fechar novamente, ou 0 se estiver fechado."""
+    pttl = get_redis_client().pttl(_chaves(nome)[1])
+    return pttl / 1000 if pttl > 0 else 0
+
+def registrar_sucesso(nome: str) -> None:
+    """Zera a contagem de falhas consecutivas."""
+    get_redis_client().delete(_chaves(nome)[0])
+
+def registrar_falha(nome: str, limite: int, pausa: int) -> bool:
+    """
+    Conta uma falha consecutiva e abre o disjuntor por `pausa` segundos ao atingir `limite`.
+
+    Retorna True se esta falha abriu o disjuntor.
+    """
+    chave_falhas, chave_aberto = _chaves(nome)
+    abriu = bool(get_redis_client().eval(_SCRIPT_FALHA, 2, chave_falhas, chave_aberto, limite, pausa))
+    if abriu:
+        metricas.incrementar(f'disjuntor.aberturas.{nome}')
+    return abriu
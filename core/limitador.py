@@ -0,0 +1,53 @@
+import time
+
+from .redis import get_redis_client
+
+PREFIXO = 'limitador'
+
+# Balde de fichas: repõe `taxa` fichas por segundo até `capacidade` e consome
+# uma ficha se houver. Usa o relógio do Redis para que todos os workers
+# compartilhem o mesmo ritmo. Retorna a espera (segundos) até haver uma ficha,
+# ou 0 se a ficha foi consumida.
+_SCRIPT_CONSUMIR = """
+local taxa = tonumber(ARGV[1])
+local capacidade = tonumber(ARGV[2])
+local relogio = redis.call('TIME')
+local agora = tonumber(relogio[1]) + tonumber(relogio[2]) / 1000000
+
+local estado = redis.call('HMGET', KEYS[1], 'fichas', 'instante')
+local fichas = tonumber(estado[1]) or capacidade
+local instante = tonumber(estado[2]) or agora
+fichas = math.min(capacidade, fichas + math.max(agora - instante, 0) * taxa)
+
+local espera = 0
+if fichas >= 1 then
+    fichas = fichas - 1
+else
+    espera = (1 - fichas) / taxa
+end
+
+redis.call('HSET', KEYS[1], 'fichas', tostring(fichas), 'instante', tostring(agora))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacidade / taxa) + 1)
+return tostring(espera)
+"""
+
+def consumir(nome: str, taxa: float, capacidade: float = None) -> float:
+    """
+    Tenta consumir uma ficha do balde `nome`, compartilhado por todos os processos.
+
+    Retorna 0 se a ficha foi consumida ou, caso contrário, quantos segundos
+    esperar antes de tentar novamente. `capacidade` (padrão: `taxa`) limita a
+    rajada permitida após um período ocioso.
+    """
+    capacidade = max(capacidade or taxa, 1)
+    return float(get_redis_client().eval(_SCRIPT_CONSUMIR, 1, f'{PREFIXO}:{nome}', taxa, capacidade))
+
+def aguardar(nome: str, taxa: float, capacidade: float = None) -> float:
+    """Bloqueia até consumir uma ficha do balde `nome`. Retorna o tempo esperado em segundos."""
+    esperado = 0.0
+    while True:
+        espera = consumir(nome, taxa, capacidade)
+        if espera <= 0:
+            return esperado
+        time.sleep(espera)
+        esperado += espera
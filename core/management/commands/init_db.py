@@ -342,6 +342,35 @@ Equipe Reservas Online""",
     <p><a href="https://{{ site_url }}/avaliacoes/nova?booking={{ booking.id }}">Clique aqui para avaliar</a></p>
     <p>Sua opinião é muito importante para continuarmos melhorando nossos serviços.</p>
 </body>
+</html>"""
+            },
+            {
+                'name': 'Resumo de Notificações',
+                'notification_type': 'digest',
+                'subject': 'Resumo: você tem {{ total }} novas notificações',
+                'body_text': """Olá {{ user.first_name }},
+
+Estas são as suas notificações do período:
+{% for item in notificacoes %}
+- {{ item.tipo }}: {% if item.booking %}{{ item.booking.service_name }} com {{ item.booking.provider_name }} em {{ item.booking.date }} às {{ item.booking.time }} (código {{ item.booking.code }}){% elif item.waiting_list %}vaga disponível em {{ item.waiting_list.service_name }} com {{ item.waiting_list.provider_name }} em {{ item.waiting_list.date }}{% endif %}{% endfor %}
+
+Atenciosamente,
+Equipe Reservas Online""",
+                'body_html': """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Resumo de notificações</title>
+</head>
+<body>
+    <h1>Você tem {{ total }} novas notificações</h1>
+    <p>Olá {{ user.first_name }},</p>
+    <ul>
+    {% for item in notificacoes %}
+        <li><strong>{{ item.tipo }}</strong>: {% if item.booking %}{{ item.booking.service_name }} com {{ item.booking.provider_name }} em {{ item.booking.date }} às {{ item.booking.time }} (código {{ item.booking.code }}){% elif item.waiting_list %}vaga disponível em {{ item.waiting_list.service_name }} com {{ item.waiting_list.provider_name }} em {{ item.waiting_list.date }}{% endif %}</li>
+    {% endfor %}
+    </ul>
+</body>
 </html>"""
             }
         ]
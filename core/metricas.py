@@ -0,0 +1,18 @@
+from typing import Dict, Union
+from .redis import get_redis_client
+
+# Hash do Redis com as métricas operacionais compartilhadas pelos processos
+CHAVE_METRICAS = 'metricas'
+
+def incrementar(nome: str, quantidade: int = 1) -> None:
+    """Incrementa um contador de métrica."""
+    get_redis_client().hincrby(CHAVE_METRICAS, nome, quantidade)
+
+def definir(valores: Dict[str, Union[int, float]]) -> None:
+    """Define o valor atual de uma ou mais métricas (medidores)."""
+    if valores:
+        get_redis_client().hset(CHAVE_METRICAS, mapping=valores)
+
+def obter_metricas() -> Dict[str, float]:
+    """Retorna todas as métricas registradas."""
+    return {nome: float(valor) for nome, valor in get_redis_client().hgetall(CHAVE_METRICAS).items()}
@@ -0,0 +1,11 @@
+import redis
+from django.conf import settings
+
+_cliente = None
+
+def get_redis_client() -> redis.Redis:
+    """Retorna um cliente Redis compartilhado pelo processo (para estruturas que o cache do Django não oferece)."""
+    global _cliente
+    if _cliente is None:
+        _cliente = redis.Redis.from_url(settings.REDIS_CACHE_URL, decode_responses=True)
+    return _cliente
\ No newline at end of file
@@ -0,0 +1,44 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from .redis import get_redis_client
+
+# Cache do Django local a cada processo de teste
+CACHE_LOCAL = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+class RedisIsoladoMixin:
+    """
+    Isola dos demais dados os testes que usam o Redis de REDIS_CACHE_URL.
+
+    As chaves dos módulos em `modulos_redis` ficam sob 'teste:' e as
+    métricas desses módulos são substituídas por um mock. As chaves de teste
+    são removidas antes e depois de cada teste, sem tocar nas demais, e o
+    cache do Django é trocado por um cache local vazio.
+    """
+
+    modulos_redis = ()
+
+    def setUp(self):
+        super().setUp()
+        ajuste = override_settings(CACHES=CACHE_LOCAL)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        cache.clear()
+
+        for modulo in self.modulos_redis:
+            patchers = [mock.patch.object(modulo, 'PREFIXO', f'teste:{modulo.PREFIXO}')]
+            if hasattr(modulo, 'metricas'):
+                patchers.append(mock.patch.object(modulo, 'metricas'))
+            for patcher in patchers:
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        self._limpar_redis()
+        self.addCleanup(self._limpar_redis)
+
+    def _limpar_redis(self):
+        cliente = get_redis_client()
+        chaves = list(cliente.scan_iter(match='teste:*'))
+        if chaves:
+            cliente.delete(*chaves)
@@ -1,3 +1,106 @@
+from unittest import mock
+import time
+
 from django.test import TestCase
 
-# Create your tests here.
+from . import coalescencia, travas
+from .redis import get_redis_client
+from .suporte_testes import RedisIsoladoMixin
+
+class CoalescenciaTest(RedisIsoladoMixin, TestCase):
+    """Testes do agrupamento de disparos de uma tarefa em uma execução por janela."""
+
+    modulos_redis = (coalescencia,)
+
+    def setUp(self):
+        super().setUp()
+        self.tarefa = mock.Mock()
+        self.tarefa.name = 'teste.tarefa'
+
+    def test_disparos_da_janela_agrupados_em_uma_execucao(self):
+        self.assertTrue(coalescencia.agendar_coalescido(self.tarefa, '1', [[1, 'a']], janela=30))
+        self.assertFalse(coalescencia.agendar_coalescido(self.tarefa, '1', [[1, 'b'], [1, 'a']], janela=30))
+        # Outra chave tem a sua própria janela
+        self.assertTrue(coalescencia.agendar_coalescido(self.tarefa, '2', [[2, 'a']], janela=30))
+
+        self.tarefa.apply_async.assert_has_calls([
+            mock.call(kwargs={'chave_coalescencia': '1'}, countdown=30),
+            mock.call(kwargs={'chave_coalescencia': '2'}, countdown=30),
+        ])
+        self.assertEqual(sorted(coalescencia.consumir_itens(self.tarefa, '1')), [[1, 'a'], [1, 'b']])
+
+    def test_consumir_libera_nova_janela(self):
+        coalescencia.agendar_coalescido(self.tarefa, '1', [[1, 'a']])
+        coalescencia.consumir_itens(self.tarefa, '1')
+
+        self.assertEqual(coalescencia.consumir_itens(self.tarefa, '1'), [])
+        self.assertTrue(coalescencia.agendar_coalescido(self.tarefa, '1', [[1, 'b']]))
+        self.assertEqual(coalescencia.consumir_itens(self.tarefa, '1'), [[1, 'b']])
+
+    def test_falha_ao_enfileirar_libera_a_janela(self):
+        self.tarefa.apply_async.side_effect = ConnectionError('broker indisponível')
+
+        with self.assertRaises(ConnectionError):
+            coalescencia.agendar_coalescido(self.tarefa, '1', [[1, 'a']])
+
+        self.tarefa.apply_async.side_effect = None
+        self.assertTrue(coalescencia.agendar_coalescido(self.tarefa, '1', [[1, 'b']]))
+        self.assertEqual(sorted(coalescencia.consumir_itens(self.tarefa, '1')), [[1, 'a'], [1, 'b']])
+
+    def test_agendamento_alternativo(self):
+        agendar = mock.Mock()
+
+        coalescencia.agendar_coalescido(self.tarefa, '1', [[1, 'a']], janela=600, agendar=agendar)
+
+        agendar.assert_called_once_with(self.tarefa, {'chave_coalescencia': '1'}, 600)
+        self.tarefa.apply_async.assert_not_called()
+
+class ExecucaoUnicaTest(RedisIsoladoMixin, TestCase):
+    """Testes da trava que impede execuções simultâneas de uma tarefa periódica."""
+
+    modulos_redis = (travas,)
+
+    def _chave(self, tarefa):
+        return f'{travas.PREFIXO}:{tarefa.__module__}.{tarefa.__name__}'
+
+    def test_execucao_simultanea_ignorada(self):
+        @travas.execucao_unica()
+        def tarefa():
+            # Um segundo disparo enquanto a primeira execução está em andamento
+            return tarefa()
+
+        self.assertIn('ignorada', tarefa())
+        travas.metricas.incrementar.assert_called_once()
+
+        # Liberada ao terminar
+        self.assertFalse(get_redis_client().exists(self._chave(tarefa)))
+
+    def test_liberada_apos_erro(self):
+        @travas.execucao_unica()
+        def tarefa():
+            raise RuntimeError('falha')
+
+        with self.assertRaises(RuntimeError):
+            tarefa()
+        self.assertFalse(get_redis_client().exists(self._chave(tarefa)))
+
+    def test_intervalo_minimo_descarta_disparo_duplicado(self):
+        execucoes = []
+
+        @travas.execucao_unica(intervalo_minimo=300)
+        def tarefa():
+            execucoes.append(1)
+
+        tarefa()
+        tarefa()
+
+        self.assertEqual(len(execucoes), 1)
+        self.assertGreater(get_redis_client().ttl(self._chave(tarefa)), 200)
+
+    def test_prazo_renovado_durante_a_execucao(self):
+        @travas.execucao_unica(prazo=1)
+        def tarefa():
+            time.sleep(1.5)
+            return get_redis_client().exists(self._chave(tarefa))
+
+        self.assertTrue(tarefa())
@@ -0,0 +1,99 @@
+from functools import wraps
+import logging
+import secrets
+import threading
+import time
+
+from .redis import get_redis_client
+from . import metricas
+
+logger = logging.getLogger(__name__)
+
+PREFIXO = 'trava'
+
+# Renova o prazo apenas se a trava ainda pertence a esta execução
+_SCRIPT_RENOVAR = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Libera a trava apenas se ela ainda pertence a esta execução
+_SCRIPT_LIBERAR = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class _Renovador(threading.Thread):
+    """Thread que renova o prazo da trava enquanto a tarefa executa."""
+
+    def __init__(self, chave, token, prazo, duracao_maxima):
+        super().__init__(daemon=True)
+        self.chave = chave
+        self.token = token
+        self.prazo = prazo
+        self.limite = time.monotonic() + duracao_maxima
+        self.parar = threading.Event()
+
+    def run(self):
+        # Renova a cada terço do prazo; se o processo morrer, a trava expira sozinha
+        while not self.parar.wait(self.prazo / 3):
+            if time.monotonic() > self.limite:
+                logger.error(f"Trava {self.chave} excedeu a duração máxima e não será mais renovada.")
+                return
+            try:
+                if not get_redis_client().eval(_SCRIPT_RENOVAR, 1, self.chave, self.token, int(self.prazo * 1000)):
+                    logger.error(f"Trava {self.chave} perdida durante a execução.")
+                    return
+            except Exception as e:
+                logger.error(f"Erro ao renovar trava {self.chave}: {str(e)}")
+
+def execucao_unica(prazo=60, duracao_maxima=6 * 3600, intervalo_minimo=0):
+    """
+    Garante que apenas uma execução da tarefa rode por vez entre todos os workers.
+
+    A trava é um SET NX com prazo de `prazo` segundos, renovado em segundo
+    plano enquanto a tarefa executa (até `duracao_maxima`). Se o worker
+    morrer, a trava expira após `prazo`. Execuções que encontram a trava
+    ocupada são ignoradas e contadas em `travas.ignoradas.<tarefa>`. Com
+    `intervalo_minimo`, a trava é mantida até esse tempo após o início, o que
+    descarta disparos duplicados de duas instâncias do beat.
+
+    Deve ser aplicado abaixo de @shared_task.
+    """
+    def decorator(func):
+        nome = f"{func.__module__}.{func.__name__}"
+        chave = f"{PREFIXO}:{nome}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cliente = get_redis_client()
+            token = secrets.token_hex(16)
+            inicio = time.monotonic()
+
+            if not cliente.set(chave, token, nx=True, ex=max(prazo, intervalo_minimo)):
+                metricas.incrementar(f"travas.ignoradas.{nome}")
+                logger.info(f"Execução de {nome} ignorada: outra execução está em andamento.")
+                return f"Execução de {nome} ignorada: outra execução está em andamento."
+
+            renovador = _Renovador(chave, token, prazo, duracao_maxima)
+            renovador.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                renovador.parar.set()
+                renovador.join()
+                restante = intervalo_minimo - (time.monotonic() - inicio)
+                try:
+                    if restante > 0:
+                        cliente.eval(_SCRIPT_RENOVAR, 1, chave, token, int(restante * 1000))
+                    else:
+                        cliente.eval(_SCRIPT_LIBERAR, 1, chave, token)
+                except Exception as e:
+                    logger.error(f"Erro ao liberar trava {chave}: {str(e)}")
+
+        return wrapper
+    return decorator
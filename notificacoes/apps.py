@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class NotificacoesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notificacoes'
+
+    def ready(self):
+        # Registra a invalidação e o aquecimento dos templates compilados
+        from . import signals  # noqa: F401
@@ -0,0 +1,215 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from collections import defaultdict
+import logging
+import random
+import smtplib
+
+from core import disjuntor, limitador, metricas
+from .models import Notification
+from . import outbox
+
+logger = logging.getLogger(__name__)
+
+# Emails enviados entre duas gravações de status
+TAMANHO_MICROLOTE = 25
+
+# Nome do balde de fichas e do disjuntor do servidor SMTP
+NOME_SMTP = 'smtp'
+
+def _mensagem(notification, conexao):
+    email = EmailMultiAlternatives(
+        subject=notification.email_subject,
+        body=notification.email_body,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[notification.recipient.email],
+        connection=conexao
+    )
+
+    # Adiciona a versão HTML se disponível
+    if notification.email_html:
+        email.attach_alternative(notification.email_html, "text/html")
+
+    return email
+
+def _falha_de_conexao(erro):
+    # Exceções SMTP também são OSError; apenas a desconexão indica problema na conexão
+    if isinstance(erro, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(erro, OSError) and not isinstance(erro, smtplib.SMTPException)
+
+def _falha_definitiva(erro):
+    # Destinatário recusado não melhora com novas tentativas nem indica problema no servidor
+    return isinstance(erro, smtplib.SMTPRecipientsRefused)
+
+def atraso_retentativa(tentativas):
+    """
+    Segundos até a próxima tentativa de uma notificação que já falhou `tentativas` vezes.
+
+    Cresce exponencialmente a partir de EMAIL_RETRY_BASE_SECONDS, limitado a
+    EMAIL_RETRY_MAX_SECONDS, com jitter entre metade e o total do atraso para
+    que as retentativas não voltem todas juntas.
+    """
+    atraso = min(
+        settings.EMAIL_RETRY_BASE_SECONDS * 2 ** max(tentativas - 1, 0),
+        settings.EMAIL_RETRY_MAX_SECONDS
+    )
+    return random.uniform(atraso / 2, atraso)
+
+def _disjuntor_restante():
+    try:
+        return disjuntor.restante(NOME_SMTP)
+    except Exception as e:
+        logger.error(f"Erro ao consultar o disjuntor de email: {str(e)}")
+        return 0
+
+def _registrar_falha_servidor():
+    try:
+        if disjuntor.registrar_falha(
+            NOME_SMTP,
+            settings.EMAIL_CIRCUIT_BREAKER_FAILURES,
+            settings.EMAIL_CIRCUIT_BREAKER_PAUSE_SECONDS
+        ):
+            logger.error(f"Envio de emails pausado por {settings.EMAIL_CIRCUIT_BREAKER_PAUSE_SECONDS}s após falhas consecutivas.")
+    except Exception as e:
+        logger.error(f"Erro ao registrar falha no disjuntor de email: {str(e)}")
+
+def _registrar_sucesso_servidor():
+    try:
+        disjuntor.registrar_sucesso(NOME_SMTP)
+    except Exception as e:
+        logger.error(f"Erro ao registrar sucesso no disjuntor de email: {str(e)}")
+
+def _aguardar_vez():
+    # Sem o Redis, o envio segue sem limitação em vez de parar
+    try:
+        limitador.aguardar(NOME_SMTP, settings.EMAIL_RATE_LIMIT_PER_SECOND, settings.EMAIL_RATE_LIMIT_BURST)
+    except Exception as e:
+        logger.error(f"Erro ao consultar o limite de envio de emails: {str(e)}")
+
+def _agendar_retentativas(notificacoes, falhas, definitivas, adiadas):
+    """
+    Reagenda as falhas temporárias com backoff e as notificações adiadas pelo disjuntor.
+
+    As retentativas passam pela caixa de saída com atraso, como os resumos:
+    um countdown de até EMAIL_RETRY_MAX_SECONDS no broker alcança o
+    visibility timeout do Redis, e a tarefa seria entregue (e o email
+    enviado) de novo.
+    """
+    from .tasks import enviar_emails_lote
+
+    grupos = defaultdict(list)
+    for notification in notificacoes:
+        if notification.id not in falhas or notification.id in definitivas:
+            continue
+        tentativas = notification.send_attempts + 1
+        if tentativas < settings.EMAIL_MAX_SEND_ATTEMPTS:
+            grupos[tentativas].append(notification.id)
+
+    for tentativas, ids in grupos.items():
+        outbox.enfileirar(enviar_emails_lote, [ids], atraso=int(atraso_retentativa(tentativas)))
+
+    if adiadas:
+        # Retomadas após a pausa, espalhadas para não reabrir o disjuntor com uma rajada
+        espera = _disjuntor_restante() + random.uniform(0, settings.EMAIL_CIRCUIT_BREAKER_PAUSE_SECONDS)
+        outbox.enfileirar(enviar_emails_lote, [adiadas], atraso=int(espera))
+        metricas.incrementar('email.adiadas', len(adiadas))
+
+def _enviar(conexao, mensagem):
+    """Envia pela conexão aberta, reabrindo-a uma vez se ela tiver caído."""
+    try:
+        conexao.send_messages([mensagem])
+    except Exception as e:
+        if not _falha_de_conexao(e):
+            raise
+        logger.info(f"Conexão SMTP perdida, reconectando: {str(e)}")
+        conexao.close()
+        conexao.open()
+        conexao.send_messages([mensagem])
+
+def registrar_resultados(enviadas, falhas):
+    """Grava o resultado de um microlote (ids enviados e {id: erro}) em um único UPDATE."""
+    ids = list(enviadas) + list(falhas)
+    if not ids:
+        return
+
+    agora = timezone.now()
+    Notification.objects.filter(id__in=ids).update(
+        status=Case(When(id__in=enviadas, then=Value('sent')), default=Value('failed')),
+        sent_at=Case(When(id__in=enviadas, then=Value(agora)), default=F('sent_at')),
+        error_message=Case(
+            *[When(id=notification_id, then=Value(erro)) for notification_id, erro in falhas.items()],
+            default=Value('')
+        ),
+        send_attempts=F('send_attempts') + 1,
+        updated_at=agora
+    )
+
+def enviar_notificacoes(notificacoes):
+    """
+    Envia as notificações por uma única conexão SMTP mantida aberta.
+
+    Cada email aguarda uma ficha do balde compartilhado por todos os workers
+    (EMAIL_RATE_LIMIT_PER_SECOND). Falhas do servidor contam para o
+    disjuntor; aberto, ele interrompe o envio e as notificações restantes
+    são reagendadas para depois da pausa. Falhas temporárias são reagendadas
+    com backoff exponencial até EMAIL_MAX_SEND_ATTEMPTS tentativas.
+
+    O status é gravado a cada TAMANHO_MICROLOTE emails com um UPDATE. Se a
+    conexão cair, ela é reaberta e o email é reenviado uma vez. As
+    notificações devem vir com o destinatário carregado. Retorna
+    (ids enviados, {id: erro}).
+    """
+    enviadas, falhas, definitivas = [], {}, set()
+    if not notificacoes:
+        return enviadas, falhas
+
+    if _disjuntor_restante():
+        _agendar_retentativas(notificacoes, falhas, definitivas, [notification.id for notification in notificacoes])
+        return enviadas, falhas
+
+    conexao = get_connection()
+    try:
+        conexao.open()
+    except Exception as e:
+        logger.error(f"Erro ao abrir conexão SMTP: {str(e)}")
+        _registrar_falha_servidor()
+        falhas = {notification.id: str(e) for notification in notificacoes}
+        registrar_resultados([], falhas)
+        _agendar_retentativas(notificacoes, falhas, definitivas, [])
+        return enviadas, falhas
+
+    adiadas = []
+    try:
+        for inicio in range(0, len(notificacoes), TAMANHO_MICROLOTE):
+            lote_enviadas, lote_falhas = [], {}
+            for indice, notification in enumerate(notificacoes[inicio:inicio + TAMANHO_MICROLOTE], start=inicio):
+                if _disjuntor_restante():
+                    adiadas = [pendente.id for pendente in notificacoes[indice:]]
+                    break
+
+                _aguardar_vez()
+                try:
+                    _enviar(conexao, _mensagem(notification, conexao))
+                    lote_enviadas.append(notification.id)
+                    _registrar_sucesso_servidor()
+                except Exception as e:
+                    logger.error(f"Erro ao enviar email para notificação {notification.id}: {str(e)}")
+                    lote_falhas[notification.id] = str(e)
+                    if _falha_definitiva(e):
+                        definitivas.add(notification.id)
+                    else:
+                        _registrar_falha_servidor()
+
+            registrar_resultados(lote_enviadas, lote_falhas)
+            enviadas.extend(lote_enviadas)
+            falhas.update(lote_falhas)
+            if adiadas:
+                break
+    finally:
+        conexao.close()
+
+    _agendar_retentativas(notificacoes, falhas, definitivas, adiadas)
+    return enviadas, falhas
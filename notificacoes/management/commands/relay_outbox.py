@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import time
+
+from notificacoes import outbox
+
+class Command(BaseCommand):
+    help = 'Publica continuamente no broker as tarefas gravadas na caixa de saída'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=outbox.TAMANHO_LOTE,
+            help='Mensagens reivindicadas por transação'
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=1.0,
+            help='Segundos de espera quando a caixa de saída está vazia'
+        )
+        parser.add_argument(
+            '--uma-vez',
+            action='store_true',
+            help='Drena a caixa de saída uma vez e encerra'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Relay da caixa de saída iniciado.'))
+
+        while True:
+            try:
+                close_old_connections()
+                publicadas = outbox.drenar(options['lote'])
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Erro ao drenar a caixa de saída: {str(e)}'))
+                publicadas = 0
+
+            if options['uma_vez']:
+                self.stdout.write(f'{publicadas} mensagens publicadas.')
+                return
+
+            # Lote cheio indica que há mais mensagens; drena de novo sem esperar
+            if publicadas < options['lote']:
+                time.sleep(options['intervalo'])
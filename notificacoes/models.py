@@ -14,6 +14,7 @@ class Notification(models.Model):
         ('report', _('Relatório')),
         ('cancellation', _('Cancelamento')),
         ('waiting_list', _('Lista de Espera')),
+        ('digest', _('Resumo')),
     ]
     
     STATUS_CHOICES = [
@@ -49,6 +50,9 @@ class Notification(models.Model):
     send_attempts = models.IntegerField(_('tentativas de envio'), default=0)
     error_message = models.TextField(_('mensagem de erro'), blank=True)
     
+    # Identifica as notificações inseridas juntas por bulk_create
+    batch_id = models.UUIDField(_('lote'), null=True, blank=True, db_index=True)
+    
     class Meta:
         verbose_name = _('notificação')
         verbose_name_plural = _('notificações')
@@ -57,6 +61,27 @@ class Notification(models.Model):
     def __str__(self):
         return f"{self.get_notification_type_display()} para {self.recipient.email} - {self.get_status_display()}"
 
+class OutboxMessage(models.Model):
+    """Tarefa a publicar gravada na mesma transação que a originou (transactional outbox)."""
+    
+    task_name = models.CharField(_('tarefa'), max_length=255)
+    args = models.JSONField(_('argumentos'), default=list, blank=True)
+    kwargs = models.JSONField(_('argumentos nomeados'), default=dict, blank=True)
+    available_at = models.DateTimeField(_('disponível em'))
+    attempts = models.IntegerField(_('tentativas de publicação'), default=0)
+    error_message = models.TextField(_('mensagem de erro'), blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('mensagem de saída')
+        verbose_name_plural = _('mensagens de saída')
+        indexes = [
+            models.Index(fields=['available_at', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.task_name} ({self.available_at.strftime('%d/%m/%Y %H:%M:%S')})"
+
 class EmailTemplate(models.Model):
     """Modelo para templates de e-mail utilizados nas notificações."""
     
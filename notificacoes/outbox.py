@@ -0,0 +1,85 @@
+from celery import current_app
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+import logging
+
+from core import metricas
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Mensagens reivindicadas por transação do relay
+TAMANHO_LOTE = 500
+
+# Espera máxima (segundos) entre tentativas de publicar uma mensagem
+ATRASO_MAXIMO = 300
+
+def _mensagem(tarefa, args=(), kwargs=None, atraso=0, agora=None):
+    return OutboxMessage(
+        task_name=getattr(tarefa, 'name', tarefa),
+        args=list(args),
+        kwargs=kwargs or {},
+        available_at=(agora or timezone.now()) + timedelta(seconds=atraso)
+    )
+
+def enfileirar(tarefa, args=(), kwargs=None, atraso=0):
+    """
+    Grava a execução de `tarefa` na caixa de saída, na transação corrente.
+
+    A tarefa só é publicada pelo relay depois do commit, e não é publicada
+    se a transação for desfeita. `atraso` (segundos) adia a publicação,
+    como o countdown do Celery. Os argumentos devem ser serializáveis em JSON.
+    """
+    return _mensagem(tarefa, args, kwargs, atraso).save()
+
+def enfileirar_lote(tarefa, lista_args, atraso=0):
+    """Grava várias execuções de `tarefa`, uma por tupla de argumentos, com um único INSERT."""
+    agora = timezone.now()
+    OutboxMessage.objects.bulk_create(
+        [_mensagem(tarefa, args, atraso=atraso, agora=agora) for args in lista_args],
+        batch_size=TAMANHO_LOTE
+    )
+
+def drenar(limite=TAMANHO_LOTE):
+    """
+    Publica no broker as mensagens disponíveis da caixa de saída.
+
+    Reivindica até `limite` mensagens com SELECT ... FOR UPDATE SKIP LOCKED,
+    então vários relays podem drenar em paralelo sem publicar a mesma
+    mensagem. As publicadas são apagadas com um único DELETE na mesma
+    transação. Uma falha de publicação interrompe o lote e a mensagem volta
+    para a fila com espera crescente. Se o processo cair entre publicar e o
+    commit, a mensagem é publicada de novo (entrega ao menos uma vez), por
+    isso as tarefas devem tolerar repetição. Retorna a quantidade de
+    mensagens publicadas.
+    """
+    agora = timezone.now()
+    with transaction.atomic():
+        mensagens = list(OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+            available_at__lte=agora
+        ).order_by('available_at', 'id')[:limite])
+
+        publicadas = []
+        for mensagem in mensagens:
+            try:
+                current_app.send_task(mensagem.task_name, args=mensagem.args, kwargs=mensagem.kwargs)
+                publicadas.append(mensagem.id)
+            except Exception as e:
+                logger.error(f"Erro ao publicar mensagem {mensagem.id} ({mensagem.task_name}): {str(e)}")
+                atraso = min(2 ** mensagem.attempts, ATRASO_MAXIMO)
+                OutboxMessage.objects.filter(id=mensagem.id).update(
+                    attempts=F('attempts') + 1,
+                    available_at=agora + timedelta(seconds=atraso),
+                    error_message=str(e)
+                )
+                # Com o broker indisponível, as demais ficam para a próxima drenagem
+                break
+
+        if publicadas:
+            OutboxMessage.objects.filter(id__in=publicadas).delete()
+
+    if mensagens:
+        metricas.incrementar('outbox.publicadas', len(publicadas))
+    return len(publicadas)
@@ -0,0 +1,114 @@
+from django.template import Template, Context
+import logging
+
+from core.redis import get_redis_client
+from .models import EmailTemplate
+
+logger = logging.getLogger(__name__)
+
+# Contador no Redis incrementado a cada alteração de EmailTemplate
+CHAVE_VERSAO = 'notificacoes:templates:versao'
+
+# Idioma usado quando não há template no idioma do usuário
+IDIOMA_PADRAO = 'pt-br'
+
+class TemplateCompilado:
+    """Template de email com assunto e corpos já compilados."""
+
+    def __init__(self, template):
+        self.id = template.id
+        self.updated_at = template.updated_at
+        self.subject = Template(template.subject)
+        self.body_text = Template(template.body_text)
+        self.body_html = Template(template.body_html)
+
+    def renderizar(self, context):
+        """Retorna (assunto, corpo em texto, corpo em HTML) renderizados com o contexto."""
+        template_context = Context(context)
+        return (
+            self.subject.render(template_context),
+            self.body_text.render(template_context),
+            self.body_html.render(template_context)
+        )
+
+# Estado do processo, compartilhado por todas as tarefas executadas pelo worker
+_resolvidos = {}  # (notification_type, language) -> TemplateCompilado, ou None se não houver template
+_compilados = {}  # EmailTemplate.id -> TemplateCompilado
+_versao = None
+
+def _validar_versao():
+    """Descarta a resolução por (tipo, idioma) se algum template foi alterado desde a última verificação."""
+    global _versao
+    try:
+        versao = get_redis_client().get(CHAVE_VERSAO)
+    except Exception as e:
+        # Sem como saber se houve alteração, resolve novamente a partir do banco
+        logger.error(f"Erro ao verificar a versão dos templates de email: {str(e)}")
+        _resolvidos.clear()
+        return
+
+    if versao != _versao:
+        _resolvidos.clear()
+        _versao = versao
+
+def _compilar(template):
+    # Templates cujo updated_at não mudou reaproveitam a compilação anterior
+    compilado = _compilados.get(template.id)
+    if compilado is None or compilado.updated_at != template.updated_at:
+        compilado = TemplateCompilado(template)
+        _compilados[template.id] = compilado
+    return compilado
+
+def _carregar(tipos, idiomas):
+    encontrados = {}
+    for template in EmailTemplate.objects.filter(
+        notification_type__in=tipos,
+        language__in=set(idiomas) | {IDIOMA_PADRAO},
+        is_active=True
+    ).order_by('id'):
+        encontrados.setdefault((template.notification_type, template.language), template)
+
+    for tipo in tipos:
+        for idioma in idiomas:
+            template = encontrados.get((tipo, idioma)) or encontrados.get((tipo, IDIOMA_PADRAO))
+            _resolvidos[(tipo, idioma)] = _compilar(template) if template else None
+
+def obter(tipos, idiomas):
+    """
+    Retorna os templates compilados para cada (tipo, idioma), com fallback para pt-br.
+
+    Os pares ainda não resolvidos no processo são carregados em uma única
+    consulta. O resultado contém apenas os pares que possuem template.
+    """
+    _validar_versao()
+
+    pares = {(tipo, idioma) for tipo in set(tipos) for idioma in set(idiomas)}
+    faltantes = [par for par in pares if par not in _resolvidos]
+    if faltantes:
+        _carregar({tipo for tipo, _ in faltantes}, {idioma for _, idioma in faltantes})
+
+    return {par: _resolvidos[par] for par in pares if _resolvidos.get(par)}
+
+def aquecer():
+    """Compila os templates de todos os tipos de notificação em todos os idiomas."""
+    from accounts.models import User
+
+    _validar_versao()
+    _carregar(
+        {tipo for tipo, _ in EmailTemplate.TYPE_CHOICES},
+        {idioma for idioma, _ in User.LANGUAGE_CHOICES}
+    )
+
+def nova_versao():
+    """Sinaliza a todos os processos que os templates devem ser resolvidos novamente."""
+    try:
+        get_redis_client().incr(CHAVE_VERSAO)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar a versão dos templates de email: {str(e)}")
+
+def limpar():
+    """Descarta todos os templates compilados do processo."""
+    global _versao
+    _resolvidos.clear()
+    _compilados.clear()
+    _versao = None
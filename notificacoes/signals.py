@@ -0,0 +1,24 @@
+from celery.signals import worker_process_init
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+import logging
+
+from .models import EmailTemplate
+from . import registro_templates
+
+logger = logging.getLogger(__name__)
+
+@receiver(post_save, sender=EmailTemplate)
+@receiver(post_delete, sender=EmailTemplate)
+def invalidar_templates_compilados(sender, instance, **kwargs):
+    """Avisa os workers que os templates de email mudaram após o commit."""
+    transaction.on_commit(registro_templates.nova_versao)
+
+@worker_process_init.connect
+def aquecer_templates_compilados(**kwargs):
+    """Compila os templates de email ao iniciar cada processo do worker."""
+    try:
+        registro_templates.aquecer()
+    except Exception as e:
+        logger.error(f"Erro ao aquecer os templates de email: {str(e)}")
@@ -1,66 +1,415 @@
 from celery import shared_task
 from django.utils import timezone
-from django.core.mail import EmailMultiAlternatives
-from django.template import Template, Context
 from django.conf import settings
-from django.db import transaction
+from django.db import connection, transaction
 from django.contrib.contenttypes.models import ContentType
 from datetime import timedelta
+import json
 import logging
+import uuid
 
+from core.coalescencia import agendar_coalescido, consumir_itens
+from core.travas import execucao_unica
 from reservas.models import Booking
-from .models import Notification, EmailTemplate
+from .models import Notification
+from . import envio, outbox, registro_templates
 
 logger = logging.getLogger(__name__)
 
+# Linhas lidas por vez ao percorrer reservas a notificar
+TAMANHO_BLOCO_CONSULTA = 500
+
+# Notificações enviadas por tarefa de envio
+TAMANHO_LOTE_ENVIO = 100
+
+# Tipos não urgentes que usuários com o modo resumo recebem agrupados em um único email
+TIPOS_RESUMO = ('reminder', 'waiting_list')
+
 @shared_task
 def enviar_email(notification_id):
     """Envia um e-mail para uma notificação."""
     try:
-        notification = Notification.objects.get(id=notification_id)
-        
-        # Verifica se a notificação já foi enviada
-        if notification.status == 'sent':
-            return f"Notificação {notification.id} já foi enviada anteriormente."
-        
-        # Incrementa contador de tentativas
-        notification.send_attempts += 1
-        
-        # Prepara e envia o email
-        email = EmailMultiAlternatives(
-            subject=notification.email_subject,
-            body=notification.email_body,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[notification.recipient.email]
-        )
-        
-        # Adiciona a versão HTML se disponível
-        if notification.email_html:
-            email.attach_alternative(notification.email_html, "text/html")
-        
-        # Envia o email
-        email.send()
-        
-        # Atualiza status da notificação
-        notification.status = 'sent'
-        notification.sent_at = timezone.now()
-        notification.save()
-        
-        return f"Email enviado com sucesso para a notificação {notification.id}"
-    
+        notification = Notification.objects.select_related('recipient').get(id=notification_id)
     except Notification.DoesNotExist:
         return f"Notificação {notification_id} não encontrada."
+    
+    # Verifica se a notificação já foi enviada
+    if notification.status == 'sent':
+        return f"Notificação {notification.id} já foi enviada anteriormente."
+    
+    try:
+        enviadas, falhas = envio.enviar_notificacoes([notification])
     except Exception as e:
-        # Registra o erro e marca a notificação como falha
-        try:
-            notification.status = 'failed'
-            notification.error_message = str(e)
-            notification.save()
-        except:
-            pass
-        
         logger.error(f"Erro ao enviar email para notificação {notification_id}: {str(e)}")
         return f"Erro ao enviar email: {str(e)}"
+    
+    if falhas:
+        return f"Erro ao enviar email: {falhas[notification.id]}"
+    if not enviadas:
+        return f"Envio da notificação {notification.id} adiado: servidor de email em pausa."
+    
+    return f"Email enviado com sucesso para a notificação {notification.id}"
+
+def obter_template(notification_type, language):
+    """Retorna o template ativo do tipo no idioma informado, com fallback para pt-br."""
+    return obter_templates([notification_type], [language]).get((notification_type, language))
+
+def obter_templates(tipos, idiomas):
+    """
+    Resolve os templates compilados para cada (tipo, idioma).
+    
+    Idiomas sem template recebem o template em pt-br do mesmo tipo. Retorna
+    um dicionário (notification_type, language) -> TemplateCompilado contendo
+    apenas os pares para os quais algum template foi encontrado.
+    """
+    return registro_templates.obter(tipos, idiomas)
+
+def _tipo_de_conteudo(entity_type, tipos_conteudo):
+    chave = entity_type.lower()
+    if chave not in tipos_conteudo:
+        tipos_conteudo[chave] = ContentType.objects.get(model=chave)
+    return tipos_conteudo[chave]
+
+def _montar_notificacao(recipient, notification_type, template, object_id=None, entity_type=None,
+                        context=None, content_type=None, content_object=None):
+    """Renderiza o template compilado com o contexto da notificação e retorna a notificação ainda não gravada."""
+    # Contexto padrão para o template
+    if context is None:
+        context = {}
+    
+    # Adiciona as informações do usuário ao contexto
+    context.update({
+        'user': recipient,
+        'site_name': 'Reservas Online',
+        'site_url': settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+    })
+    
+    # Adiciona o objeto da notificação ao contexto se disponível
+    if content_object:
+        context[entity_type.lower()] = content_object
+    
+    # Renderiza os templates
+    subject, body_text, body_html = template.renderizar(context)
+    
+    return Notification(
+        recipient=recipient,
+        notification_type=notification_type,
+        title=subject,
+        message=body_text,
+        email_subject=subject,
+        email_body=body_text,
+        email_html=body_html,
+        content_type=content_type,
+        object_id=str(object_id) if object_id else None
+    )
+
+def criar_notificacao(recipient, notification_type, object_id=None, entity_type=None, context=None):
+    """
+    Renderiza o template e grava a notificação como pendente, sem enviá-la.
+    
+    Retorna None se não houver template para o tipo.
+    """
+    template = obter_template(notification_type, recipient.preferred_language)
+    if not template:
+        logger.error(f"Template não encontrado para {notification_type} em {recipient.preferred_language}")
+        return None
+    
+    # Define o objeto associado à notificação
+    content_type = None
+    content_object = None
+    if entity_type:
+        content_type = ContentType.objects.get(model=entity_type.lower())
+        if object_id:
+            try:
+                content_object = content_type.get_object_for_this_type(id=object_id)
+            except Exception as e:
+                logger.error(f"Erro ao obter objeto: {str(e)}")
+    
+    notification = _montar_notificacao(
+        recipient, notification_type, template, object_id, entity_type, context, content_type, content_object
+    )
+    notification.save()
+    return notification
+
+def criar_notificacoes(itens, resumir=True):
+    """
+    Renderiza e grava em lote as notificações pendentes de `itens`, sem enviá-las.
+    
+    Cada item é um dicionário com `recipient` (usuário já carregado) ou
+    `recipient_id`, `notification_type` e, opcionalmente, `object_id`,
+    `entity_type`, `context` e `content_object`. Usuários, templates (com o
+    fallback em pt-br) e objetos associados são resolvidos com uma consulta
+    por tipo, e as notificações são inseridas com bulk_create. Itens sem
+    usuário ou template são ignorados. Com `resumir`, os itens de TIPOS_RESUMO
+    de usuários com o modo resumo são acumulados para o resumo em vez de
+    criados. Retorna os ids criados, na ordem dos itens.
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+    
+    itens = list(itens)
+    if not itens:
+        return []
+    
+    # Usuários ainda não carregados, em uma consulta
+    usuarios = User.objects.in_bulk({item['recipient_id'] for item in itens if 'recipient' not in item})
+    for item in itens:
+        if 'recipient' not in item:
+            item['recipient'] = usuarios.get(item['recipient_id'])
+    itens = [item for item in itens if item['recipient'] is not None]
+    
+    if resumir:
+        itens = acumular_resumos(itens)
+    if not itens:
+        return []
+    
+    templates = obter_templates(
+        [item['notification_type'] for item in itens],
+        [item['recipient'].preferred_language for item in itens]
+    )
+    
+    # Objetos associados ainda não carregados, em uma consulta por tipo de entidade
+    tipos_conteudo = {}
+    pendentes = {}
+    for item in itens:
+        if item.get('entity_type') and item.get('object_id') and not item.get('content_object'):
+            pendentes.setdefault(item['entity_type'].lower(), set()).add(str(item['object_id']))
+    objetos = {}
+    for entidade, ids in pendentes.items():
+        try:
+            modelo = _tipo_de_conteudo(entidade, tipos_conteudo).model_class()
+            for pk, objeto in modelo._default_manager.in_bulk(ids).items():
+                objetos[(entidade, str(pk))] = objeto
+        except Exception as e:
+            logger.error(f"Erro ao obter objetos de {entidade}: {str(e)}")
+    
+    lote = uuid.uuid4()
+    notificacoes = []
+    for item in itens:
+        recipient = item['recipient']
+        notification_type = item['notification_type']
+        template = templates.get((notification_type, recipient.preferred_language))
+        if not template:
+            logger.error(f"Template não encontrado para {notification_type} em {recipient.preferred_language}")
+            continue
+        
+        entity_type = item.get('entity_type')
+        object_id = item.get('object_id')
+        try:
+            content_type = None
+            content_object = item.get('content_object')
+            if content_object is not None:
+                content_type = ContentType.objects.get_for_model(content_object)
+            elif entity_type:
+                content_type = _tipo_de_conteudo(entity_type, tipos_conteudo)
+                content_object = objetos.get((entity_type.lower(), str(object_id)))
+            
+            notification = _montar_notificacao(
+                recipient, notification_type, template, object_id, entity_type,
+                item.get('context'), content_type, content_object
+            )
+        except Exception as e:
+            logger.error(f"Erro ao criar notificação {notification_type} para {recipient.email}: {str(e)}")
+            continue
+        
+        notification.batch_id = lote
+        notificacoes.append(notification)
+    
+    if not notificacoes:
+        return []
+    
+    Notification.objects.bulk_create(notificacoes, batch_size=TAMANHO_BLOCO_CONSULTA)
+    if connection.features.can_return_rows_from_bulk_insert:
+        return [notification.id for notification in notificacoes]
+    
+    # Bancos que não retornam as chaves do bulk_create (MySQL): recupera pelo lote
+    return list(Notification.objects.filter(batch_id=lote).order_by('id').values_list('id', flat=True))
+
+def acumular_resumos(itens):
+    """
+    Separa para o resumo de cada destinatário os itens de TIPOS_RESUMO de usuários com o modo resumo.
+    
+    As preferências são lidas com uma única consulta. Os itens separados só
+    são acumulados no Redis depois do commit da transação corrente, e o
+    envio do resumo é agendado pela caixa de saída ao fim da janela do
+    usuário (digest_window_minutes); assim uma transação desfeita não deixa
+    itens nem resumos agendados. Retorna os itens que devem ser criados
+    agora, na ordem original.
+    """
+    from accounts.models import UserPreference
+    
+    candidatos = {item['recipient'].id for item in itens if item['notification_type'] in TIPOS_RESUMO}
+    if not candidatos:
+        return itens
+    
+    janelas = dict(UserPreference.objects.filter(
+        user_id__in=candidatos,
+        digest_mode=True
+    ).values_list('user_id', 'digest_window_minutes'))
+    if not janelas:
+        return itens
+    
+    agora = timezone.now().isoformat()
+    acumulados = {}
+    restantes = []
+    for item in itens:
+        recipient_id = item['recipient'].id
+        if item['notification_type'] in TIPOS_RESUMO and recipient_id in janelas:
+            item_resumo = {
+                'recipient_id': recipient_id,
+                'notification_type': item['notification_type'],
+                'object_id': str(item['object_id']) if item.get('object_id') else None,
+                'entity_type': item.get('entity_type'),
+                'context': item.get('context') or {},
+                'criado_em': agora
+            }
+            try:
+                json.dumps(item_resumo)
+            except (TypeError, ValueError):
+                # Contexto não serializável não pode ser acumulado; segue individualmente
+                restantes.append(item)
+                continue
+            acumulados.setdefault(recipient_id, []).append(item_resumo)
+        else:
+            restantes.append(item)
+    
+    if acumulados:
+        transaction.on_commit(lambda: _agendar_resumos(acumulados, janelas))
+    return restantes
+
+def _enfileirar_resumo(tarefa, kwargs, atraso):
+    outbox.enfileirar(tarefa, kwargs=kwargs, atraso=atraso)
+
+def _agendar_resumos(acumulados, janelas):
+    """
+    Acumula os itens no resumo de cada usuário, após o commit.
+    
+    O primeiro item de uma janela grava o envio do resumo na caixa de
+    saída com atraso, em vez de um countdown que o broker reentregaria
+    em janelas longas. Se o Redis falhar, os itens do usuário seguem
+    como notificações individuais, também pela caixa de saída.
+    """
+    for recipient_id, do_usuario in acumulados.items():
+        try:
+            agendar_coalescido(
+                enviar_resumo_notificacoes,
+                str(recipient_id),
+                do_usuario,
+                janela=max(janelas[recipient_id], 1) * 60,
+                agendar=_enfileirar_resumo
+            )
+        except Exception as e:
+            logger.error(f"Erro ao acumular resumo do usuário {recipient_id}: {str(e)}")
+            try:
+                outbox.enfileirar(criar_e_enviar_notificacoes_lote, [do_usuario], {'resumir': False})
+            except Exception as e:
+                logger.error(f"Erro ao enfileirar notificações do usuário {recipient_id}: {str(e)}")
+
+def despachar_envios(notification_ids):
+    """
+    Grava na caixa de saída o envio das notificações em grupos de TAMANHO_LOTE_ENVIO.
+    
+    Deve ser chamada na transação que criou as notificações, para que o
+    envio só seja publicado se elas forem confirmadas.
+    """
+    outbox.enfileirar_lote(enviar_emails_lote, [
+        [notification_ids[inicio:inicio + TAMANHO_LOTE_ENVIO]]
+        for inicio in range(0, len(notification_ids), TAMANHO_LOTE_ENVIO)
+    ])
+
+@shared_task
+def enviar_emails_lote(notification_ids):
+    """Envia um grupo de notificações já renderizadas por uma única conexão SMTP."""
+    # Ignora as notificações já enviadas (reentregas da tarefa)
+    notificacoes = list(
+        Notification.objects.filter(id__in=notification_ids).exclude(status='sent').select_related('recipient').order_by('id')
+    )
+    
+    try:
+        enviadas, falhas = envio.enviar_notificacoes(notificacoes)
+    except Exception as e:
+        logger.error(f"Erro ao enviar lote de emails: {str(e)}")
+        return f"Erro ao enviar lote de emails: {str(e)}"
+    
+    return f"Enviados {len(enviadas)} de {len(notification_ids)} emails do lote"
+
+@shared_task
+def criar_e_enviar_notificacoes_lote(itens, resumir=True):
+    """
+    Cria em lote as notificações de `itens` e enfileira o envio em grupos.
+    
+    Os itens seguem o formato de criar_notificacoes(). Quando chamada
+    diretamente (sem .delay), a renderização acontece no processo de quem
+    chama e a única tarefa intermediária é a de envio.
+    """
+    try:
+        with transaction.atomic():
+            notificacoes = criar_notificacoes(itens, resumir=resumir)
+            despachar_envios(notificacoes)
+    except Exception as e:
+        logger.error(f"Erro ao criar notificações em lote: {str(e)}")
+        return f"Erro ao criar notificações em lote: {str(e)}"
+    
+    return f"Criadas {len(notificacoes)} notificações de {len(itens)} solicitadas"
+
+@shared_task
+def enviar_resumo_notificacoes(chave_coalescencia=None):
+    """
+    Envia em um único email as notificações acumuladas de um usuário durante a janela do resumo.
+    
+    O resumo é renderizado uma vez com o template 'digest', listando cada
+    notificação acumulada pelos dados do seu contexto. Sem template de resumo,
+    as notificações acumuladas são criadas e enviadas individualmente.
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+    
+    itens = consumir_itens(enviar_resumo_notificacoes, chave_coalescencia)
+    if not itens:
+        return "Nenhuma notificação acumulada para o resumo."
+    
+    recipient = User.objects.filter(id=chave_coalescencia).first()
+    if not recipient:
+        return f"Usuário {chave_coalescencia} não encontrado."
+    
+    itens.sort(key=lambda item: item['criado_em'])
+    tipos = dict(Notification.TYPE_CHOICES)
+    
+    try:
+        with transaction.atomic():
+            if obter_template('digest', recipient.preferred_language):
+                notificacoes = criar_notificacoes([{
+                    'recipient': recipient,
+                    'notification_type': 'digest',
+                    'context': {
+                        'total': len(itens),
+                        'notificacoes': [
+                            {'tipo': str(tipos.get(item['notification_type'], item['notification_type'])), **item['context']}
+                            for item in itens
+                        ]
+                    }
+                }])
+            else:
+                logger.error(f"Template não encontrado para digest em {recipient.preferred_language}; enviando individualmente")
+                notificacoes = criar_notificacoes(
+                    [
+                        {
+                            'recipient': recipient,
+                            'notification_type': item['notification_type'],
+                            'object_id': item['object_id'],
+                            'entity_type': item.get('entity_type'),
+                            'context': item['context']
+                        }
+                        for item in itens
+                    ],
+                    resumir=False
+                )
+            despachar_envios(notificacoes)
+    except Exception as e:
+        logger.error(f"Erro ao enviar resumo para o usuário {chave_coalescencia}: {str(e)}")
+        return f"Erro ao enviar resumo: {str(e)}"
+    
+    return f"Resumo com {len(itens)} notificações enviado para {recipient.email}"
 
 @shared_task
 def criar_e_enviar_notificacao(recipient_id, notification_type, object_id=None, entity_type=None, context=None):
@@ -73,70 +422,22 @@ def criar_e_enviar_notificacao(recipient_id, notification_type, object_id=None,
             # Obtém o usuário
             recipient = User.objects.get(id=recipient_id)
             
-            # Obtém o template de email
-            template = EmailTemplate.objects.filter(
-                notification_type=notification_type,
-                language=recipient.preferred_language,
-                is_active=True
-            ).first()
-            
-            if not template:
-                # Tenta obter o template na língua padrão
-                template = EmailTemplate.objects.filter(
-                    notification_type=notification_type,
-                    language='pt-br',
-                    is_active=True
-                ).first()
+            # Tipos não urgentes de usuários com o modo resumo vão para o resumo
+            if not acumular_resumos([{
+                'recipient': recipient,
+                'notification_type': notification_type,
+                'object_id': object_id,
+                'entity_type': entity_type,
+                'context': context
+            }]):
+                return f"Notificação {notification_type} acumulada no resumo de {recipient.email}"
             
-            if not template:
-                logger.error(f"Template não encontrado para {notification_type} em {recipient.preferred_language}")
+            notification = criar_notificacao(recipient, notification_type, object_id, entity_type, context)
+            if not notification:
                 return f"Template não encontrado para {notification_type}"
             
-            # Define o objeto associado à notificação
-            content_object = None
-            if entity_type and object_id:
-                try:
-                    content_type = ContentType.objects.get(model=entity_type.lower())
-                    content_object = content_type.get_object_for_this_type(id=object_id)
-                except Exception as e:
-                    logger.error(f"Erro ao obter objeto: {str(e)}")
-            
-            # Contexto padrão para o template
-            if context is None:
-                context = {}
-            
-            # Adiciona as informações do usuário ao contexto
-            context.update({
-                'user': recipient,
-                'site_name': 'Reservas Online',
-                'site_url': settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
-            })
-            
-            # Adiciona o objeto da notificação ao contexto se disponível
-            if content_object:
-                context[entity_type.lower()] = content_object
-            
-            # Renderiza os templates
-            template_context = Context(context)
-            subject = Template(template.subject).render(template_context)
-            body_text = Template(template.body_text).render(template_context)
-            body_html = Template(template.body_html).render(template_context)
-            
-            # Cria a notificação
-            notification = Notification.objects.create(
-                recipient=recipient,
-                notification_type=notification_type,
-                title=subject,
-                message=body_text,
-                email_subject=subject,
-                email_body=body_text,
-                email_html=body_html,
-                content_type=ContentType.objects.get(model=entity_type.lower()) if entity_type else None,
-                object_id=str(object_id) if object_id else None
-            )
-            
-            # Envia o email de forma assíncrona
-            enviar_email.delay(notification.id)
+            # Envia o email de forma assíncrona após o commit, pela caixa de saída
+            outbox.enfileirar(enviar_email, [notification.id])
             
             return f"Notificação {notification.id} criada para {recipient.email}"
     
@@ -146,110 +447,134 @@ def criar_e_enviar_notificacao(recipient_id, notification_type, object_id=None,
         logger.error(f"Erro ao criar notificação: {str(e)}")
         return f"Erro ao criar notificação: {str(e)}"
 
-@shared_task
-def enviar_lembretes_reservas():
-    """Envia lembretes para reservas marcadas para o dia seguinte."""
-    amanha = timezone.now().date() + timedelta(days=1)
+def reservas_para_notificar(reservas):
+    """
+    Carrega as reservas a notificar junto com usuário e prestador, em uma única consulta com JOIN.
     
-    # Busca reservas confirmadas para amanhã
-    reservas = Booking.objects.filter(
-        start_datetime__date=amanha,
-        status='confirmed'
-    )
+    O resultado é percorrido em blocos de TAMANHO_BLOCO_CONSULTA linhas para
+    não carregar lotes grandes inteiros na memória.
+    """
+    return reservas.select_related(
+        'user', 'provider__user'
+    ).order_by('start_datetime').iterator(chunk_size=TAMANHO_BLOCO_CONSULTA)
+
+def preparar_notificacoes_reservas(reservas, notification_type, **extras):
+    """
+    Renderiza e grava em lote uma notificação pendente por reserva, sem enviá-las.
     
-    contador = 0
-    for reserva in reservas:
-        # Verifica se o usuário deseja receber lembretes
-        try:
-            if not reserva.user.preferences.receive_reminders:
-                continue
-        except:
-            pass
-        
-        # Envia o lembrete
-        criar_e_enviar_notificacao.delay(
-            recipient_id=reserva.user.id,
-            notification_type='reminder',
-            object_id=str(reserva.id),
-            entity_type='Booking',
-            context={
+    O contexto é montado apenas com os dados já carregados na reserva.
+    `extras` são acrescentados aos dados da reserva no contexto. Retorna os
+    ids das notificações criadas, na ordem das reservas.
+    """
+    return criar_notificacoes(
+        {
+            'recipient': reserva.user,
+            'notification_type': notification_type,
+            'object_id': str(reserva.id),
+            'entity_type': 'Booking',
+            'content_object': reserva,
+            'context': {
                 'booking': {
                     'service_name': reserva.provider.service_name,
                     'provider_name': reserva.provider.user.get_full_name(),
                     'date': reserva.start_datetime.strftime('%d/%m/%Y'),
                     'time': reserva.start_datetime.strftime('%H:%M'),
-                    'code': reserva.confirmation_code
+                    'code': reserva.confirmation_code,
+                    **extras
                 }
             }
-        )
-        contador += 1
+        }
+        for reserva in reservas
+    )
+
+def preparar_lembretes(data):
+    """Renderiza os lembretes das reservas confirmadas na data, na ordem de início."""
+    # A preferência é filtrada na própria consulta; usuários sem preferências cadastradas recebem lembretes
+    reservas = Booking.objects.filter(
+        start_datetime__date=data,
+        status='confirmed'
+    ).exclude(user__preferences__receive_reminders=False)
+    
+    return preparar_notificacoes_reservas(reservas_para_notificar(reservas), 'reminder')
+
+@shared_task
+@execucao_unica(intervalo_minimo=3600)
+def enviar_lembretes_reservas():
+    """
+    Prepara os lembretes das reservas do dia seguinte e agenda o envio em ondas.
+    
+    Todos os lembretes são renderizados e gravados como pendentes antes de
+    qualquer envio. Em seguida são divididos, na ordem de início das
+    reservas, em ondas de REMINDER_WAVE_SIZE notificações distribuídas ao
+    longo de REMINDER_WINDOW_MINUTES, para que o envio seja um fluxo
+    constante em vez de um pico no horário do agendamento.
+    """
+    amanha = timezone.now().date() + timedelta(days=1)
+    
+    with transaction.atomic():
+        notificacoes = preparar_lembretes(amanha)
+        ondas = agendar_ondas_lembretes(notificacoes)
     
-    return f"Enviados {contador} lembretes de reservas para amanhã ({amanha})"
+    return f"Preparados {len(notificacoes)} lembretes de reservas para amanhã ({amanha}) em {ondas} ondas"
+
+def agendar_ondas_lembretes(notification_ids):
+    """Divide as notificações em ondas e grava na caixa de saída cada uma igualmente espaçada na janela de envio."""
+    tamanho = max(settings.REMINDER_WAVE_SIZE, 1)
+    ondas = [notification_ids[i:i + tamanho] for i in range(0, len(notification_ids), tamanho)]
+    if not ondas:
+        return 0
+    
+    intervalo = settings.REMINDER_WINDOW_MINUTES * 60 / len(ondas)
+    for indice, onda in enumerate(ondas):
+        outbox.enfileirar(enviar_onda_lembretes, [onda], atraso=int(indice * intervalo))
+    
+    return len(ondas)
+
+@shared_task
+def enviar_onda_lembretes(notification_ids):
+    """Envia sequencialmente uma onda de lembretes já renderizados."""
+    return enviar_emails_lote(notification_ids)
 
 @shared_task
 def enviar_solicitacao_avaliacao(booking_id):
     """Envia solicitação de avaliação após o término de uma reserva."""
-    try:
-        reserva = Booking.objects.get(id=booking_id, status='completed')
-        
-        # Verifica se já existe uma avaliação
-        if hasattr(reserva, 'review'):
-            return f"Reserva {booking_id} já possui avaliação."
-        
-        # Envia solicitação de avaliação
-        criar_e_enviar_notificacao.delay(
-            recipient_id=reserva.user.id,
-            notification_type='review',
-            object_id=str(reserva.id),
-            entity_type='Booking',
-            context={
-                'booking': {
-                    'service_name': reserva.provider.service_name,
-                    'provider_name': reserva.provider.user.get_full_name(),
-                    'date': reserva.start_datetime.strftime('%d/%m/%Y'),
-                    'time': reserva.start_datetime.strftime('%H:%M')
-                }
-            }
-        )
-        
-        return f"Solicitação de avaliação enviada para a reserva {booking_id}"
+    return enviar_solicitacao_avaliacao_lote([booking_id])
+
+@shared_task
+def enviar_solicitacao_avaliacao_lote(booking_ids):
+    """Envia solicitações de avaliação para um lote de reservas concluídas."""
+    # Ignora reservas que já possuem avaliação
+    reservas = Booking.objects.filter(
+        id__in=booking_ids,
+        status='completed',
+        review__isnull=True
+    )
     
-    except Booking.DoesNotExist:
-        return f"Reserva {booking_id} não encontrada ou não concluída."
-    except Exception as e:
-        logger.error(f"Erro ao enviar solicitação de avaliação: {str(e)}")
-        return f"Erro ao enviar solicitação de avaliação: {str(e)}"
+    with transaction.atomic():
+        notificacoes = preparar_notificacoes_reservas(reservas_para_notificar(reservas), 'review')
+        despachar_envios(notificacoes)
+    
+    return f"Enviadas {len(notificacoes)} solicitações de avaliação de {len(booking_ids)} reservas"
 
 @shared_task
 def notificar_cancelamento_reserva(booking_id, reason=None):
     """Notifica o usuário sobre o cancelamento de uma reserva."""
-    try:
-        reserva = Booking.objects.get(id=booking_id)
-        
-        # Envia notificação de cancelamento
-        criar_e_enviar_notificacao.delay(
-            recipient_id=reserva.user.id,
-            notification_type='cancellation',
-            object_id=str(reserva.id),
-            entity_type='Booking',
-            context={
-                'booking': {
-                    'service_name': reserva.provider.service_name,
-                    'provider_name': reserva.provider.user.get_full_name(),
-                    'date': reserva.start_datetime.strftime('%d/%m/%Y'),
-                    'time': reserva.start_datetime.strftime('%H:%M'),
-                    'reason': reason or 'Não especificado'
-                }
-            }
+    return notificar_cancelamento_reservas_lote([booking_id], reason)
+
+@shared_task
+def notificar_cancelamento_reservas_lote(booking_ids, reason=None):
+    """Notifica os usuários sobre o cancelamento de um lote de reservas."""
+    reservas = Booking.objects.filter(id__in=booking_ids)
+    
+    with transaction.atomic():
+        notificacoes = preparar_notificacoes_reservas(
+            reservas_para_notificar(reservas),
+            'cancellation',
+            reason=reason or 'Não especificado'
         )
-        
-        return f"Notificação de cancelamento enviada para a reserva {booking_id}"
+        despachar_envios(notificacoes)
     
-    except Booking.DoesNotExist:
-        return f"Reserva {booking_id} não encontrada."
-    except Exception as e:
-        logger.error(f"Erro ao enviar notificação de cancelamento: {str(e)}")
-        return f"Erro ao enviar notificação de cancelamento: {str(e)}"
+    return f"Enviadas {len(notificacoes)} notificações de cancelamento de {len(booking_ids)} reservas"
 
 @shared_task
 def notificar_vagas_lista_espera():
@@ -257,36 +582,32 @@ def notificar_vagas_lista_espera():
     from reservas.models import WaitingList
     
     # Busca itens da lista de espera ainda não notificados
-    itens = WaitingList.objects.filter(is_notified=False)
+    itens = list(WaitingList.objects.filter(is_notified=False).select_related('provider__user'))
     
-    contador = 0
-    for item in itens:
-        # Verifica se existem horários disponíveis na data desejada
-        data_desejada = item.desired_date
-        provider = item.provider
-        
-        # Esta verificação é simplificada. Na prática, seria necessário
-        # verificar se existem horários disponíveis na data desejada
-        # com base na lógica de disponibilidade do prestador
-        
-        # Para fins de demonstração, notificamos todos
-        criar_e_enviar_notificacao.delay(
-            recipient_id=item.user.id,
-            notification_type='waiting_list',
-            object_id=str(item.id),
-            entity_type='WaitingList',
-            context={
+    # Esta verificação é simplificada. Na prática, seria necessário
+    # verificar se existem horários disponíveis na data desejada
+    # com base na lógica de disponibilidade do prestador
+    
+    # Para fins de demonstração, notificamos todos
+    criar_e_enviar_notificacoes_lote([
+        {
+            'recipient_id': item.user_id,
+            'notification_type': 'waiting_list',
+            'object_id': str(item.id),
+            'entity_type': 'WaitingList',
+            'content_object': item,
+            'context': {
                 'waiting_list': {
-                    'service_name': provider.service_name,
-                    'provider_name': provider.user.get_full_name(),
-                    'date': data_desejada.strftime('%d/%m/%Y')
+                    'service_name': item.provider.service_name,
+                    'provider_name': item.provider.user.get_full_name(),
+                    'date': item.desired_date.strftime('%d/%m/%Y')
                 }
             }
-        )
-        
-        # Marca como notificado
-        item.is_notified = True
-        item.save()
-        contador += 1
+        }
+        for item in itens
+    ])
+    
+    # Marca como notificados
+    WaitingList.objects.filter(id__in=[item.id for item in itens]).update(is_notified=True)
     
-    return f"Enviadas {contador} notificações de vagas disponíveis para lista de espera" 
\ No newline at end of file
+    return f"Enviadas {len(itens)} notificações de vagas disponíveis para lista de espera"
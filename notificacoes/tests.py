@@ -1,3 +1,475 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+import smtplib
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import UserPreference
+from reservas.models import Booking, Provider
+from .models import EmailTemplate, Notification, OutboxMessage
+from . import envio, outbox, registro_templates, tasks
+
+User = get_user_model()
+
+class TemplatesCompiladosMixin:
+    """Começa cada teste sem templates compilados e com a versão dos templates fixa."""
+
+    def setUp(self):
+        super().setUp()
+        registro_templates.limpar()
+        redis = mock.patch.object(registro_templates, 'get_redis_client')
+        self.redis = redis.start().return_value
+        self.redis.get.return_value = '1'
+        self.addCleanup(redis.stop)
+
+class NotificacoesReservasTest(TemplatesCompiladosMixin, TestCase):
+    """Garante que as notificações de reservas são preparadas com um número fixo de consultas."""
+
+    QUANTIDADE = 3
+
+    # Reservas, templates e um INSERT em lote; sem retorno das chaves no bulk_create (MySQL), mais a leitura do lote
+    CONSULTAS = 3 if connection.features.can_return_rows_from_bulk_insert else 4
+
+    @classmethod
+    def setUpTestData(cls):
+        for tipo in ('reminder', 'review', 'cancellation'):
+            EmailTemplate.objects.create(
+                name=tipo,
+                notification_type=tipo,
+                subject='Reserva {{ booking.confirmation_code }}',
+                body_text='Olá {{ user.first_name }}, {{ booking.provider.service_name }} com {{ booking.provider.user.first_name }}',
+                body_html='<p>{{ booking.provider.service_name }}</p>'
+            )
+
+        prestador = User.objects.create_user('prestador@exemplo.com', first_name='Ana', last_name='Souza')
+        cls.provider = Provider.objects.create(user=prestador, service_name='Corte')
+
+        # bulk_create evita os sinais de Booking, que dependem do Redis
+        amanha = timezone.now() + timedelta(days=1)
+        reservas = []
+        for indice in range(cls.QUANTIDADE):
+            cliente = User.objects.create_user(f'cliente{indice}@exemplo.com', first_name=f'Cliente {indice}', last_name='Silva')
+            reservas.append(Booking(
+                user=cliente,
+                provider=cls.provider,
+                start_datetime=amanha + timedelta(hours=indice),
+                end_datetime=amanha + timedelta(hours=indice + 1),
+                status='confirmed',
+                confirmation_code=f'COD{indice:05d}'
+            ))
+        Booking.objects.bulk_create(reservas)
+        cls.data = timezone.localtime(amanha).date()
+
+        # Um cliente que não deseja lembretes
+        sem_lembretes = User.objects.create_user('sem.lembretes@exemplo.com', first_name='Sem', last_name='Lembretes')
+        UserPreference.objects.create(user=sem_lembretes, receive_reminders=False)
+        Booking.objects.bulk_create([Booking(
+            user=sem_lembretes,
+            provider=cls.provider,
+            start_datetime=amanha,
+            end_datetime=amanha + timedelta(hours=1),
+            status='confirmed',
+            confirmation_code='SEMLEMB0'
+        )])
+
+    def setUp(self):
+        super().setUp()
+        # Carrega o cache de ContentType fora das asserções
+        ContentType.objects.get_for_model(Booking)
+
+    def assertEnvioNaCaixaDeSaida(self):
+        mensagem = OutboxMessage.objects.get()
+        self.assertEqual(mensagem.task_name, tasks.enviar_emails_lote.name)
+        self.assertEqual(len(mensagem.args[0]), self.QUANTIDADE)
+
+    def _ids(self):
+        return [str(id) for id in Booking.objects.filter(
+            user__email__startswith='cliente'
+        ).values_list('id', flat=True)]
+
+    def test_lembretes_sem_consultas_por_reserva(self):
+        # Mais a consulta das preferências de resumo, feita para os tipos não urgentes
+        with self.assertNumQueries(self.CONSULTAS + 1):
+            notificacoes = tasks.preparar_lembretes(self.data)
+
+        self.assertEqual(len(notificacoes), self.QUANTIDADE)
+        notification = Notification.objects.get(id=notificacoes[0])
+        self.assertEqual(notification.email_subject, 'Reserva COD00000')
+        self.assertEqual(notification.email_body, 'Olá Cliente 0, Corte com Ana')
+
+    def test_templates_compilados_reaproveitados(self):
+        tasks.preparar_lembretes(self.data)
+
+        # Sem alteração de versão, o template não é consultado novamente
+        with self.assertNumQueries(self.CONSULTAS):
+            tasks.preparar_lembretes(self.data)
+
+    def test_solicitacao_avaliacao_sem_consultas_por_reserva(self):
+        Booking.objects.update(status='completed')
+        ids = self._ids()
+
+        # Mais SAVEPOINT, RELEASE e o INSERT do envio na caixa de saída
+        with self.assertNumQueries(self.CONSULTAS + 3):
+            tasks.enviar_solicitacao_avaliacao_lote(ids)
+
+        self.assertEnvioNaCaixaDeSaida()
+
+    def test_cancelamento_sem_consultas_por_reserva(self):
+        ids = self._ids()
+
+        with self.assertNumQueries(self.CONSULTAS + 3):
+            tasks.notificar_cancelamento_reservas_lote(ids, 'Prestador indisponível')
+
+        self.assertEnvioNaCaixaDeSaida()
+
+class NotificacoesEmLoteTest(TemplatesCompiladosMixin, TestCase):
+    """Testes da criação de notificações em lote."""
+
+    @classmethod
+    def setUpTestData(cls):
+        EmailTemplate.objects.create(
+            name='Relatório',
+            notification_type='report',
+            subject='Relatório para {{ user.first_name }}',
+            body_text='{{ report.title }}',
+            body_html='<p>{{ report.title }}</p>'
+        )
+        EmailTemplate.objects.create(
+            name='Report',
+            notification_type='report',
+            language='en',
+            subject='Report for {{ user.first_name }}',
+            body_text='{{ report.title }}',
+            body_html='<p>{{ report.title }}</p>'
+        )
+        cls.usuarios = [
+            User.objects.create_user('pt@exemplo.com', first_name='Maria', last_name='Lima'),
+            User.objects.create_user('en@exemplo.com', first_name='John', last_name='Doe', preferred_language='en'),
+            User.objects.create_user('es@exemplo.com', first_name='Juan', last_name='Pérez', preferred_language='es'),
+        ]
+
+    def test_resolve_templates_com_fallback(self):
+        itens = [
+            {'recipient_id': usuario.id, 'notification_type': 'report', 'context': {'report': {'title': 'Semana'}}}
+            for usuario in self.usuarios
+        ]
+
+        tasks.criar_e_enviar_notificacoes_lote(itens)
+
+        ids = OutboxMessage.objects.get().args[0]
+        assuntos = list(Notification.objects.filter(id__in=ids).order_by('id').values_list('email_subject', flat=True))
+        self.assertEqual(assuntos, ['Relatório para Maria', 'Report for John', 'Relatório para Juan'])
+
+    def test_ignora_usuario_inexistente(self):
+        itens = [
+            {'recipient_id': self.usuarios[0].id, 'notification_type': 'report'},
+            {'recipient_id': 0, 'notification_type': 'report'},
+        ]
+
+        self.assertEqual(len(tasks.criar_notificacoes(itens)), 1)
+
+    def test_template_alterado_apos_nova_versao(self):
+        itens = [{'recipient_id': self.usuarios[0].id, 'notification_type': 'report'}]
+        tasks.criar_notificacoes(itens)
+
+        EmailTemplate.objects.filter(language='pt-br').update(
+            subject='Novo relatório para {{ user.first_name }}',
+            updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        self.redis.get.return_value = '2'
+
+        ids = tasks.criar_notificacoes(itens)
+        self.assertEqual(Notification.objects.get(id=ids[0]).email_subject, 'Novo relatório para Maria')
+
+class ResumoNotificacoesTest(TemplatesCompiladosMixin, TestCase):
+    """Testes do modo resumo, que agrupa notificações não urgentes em um único email."""
+
+    @classmethod
+    def setUpTestData(cls):
+        EmailTemplate.objects.create(
+            name='Lembrete',
+            notification_type='reminder',
+            subject='Lembrete {{ booking.code }}',
+            body_text='{{ booking.service_name }}',
+            body_html='<p>{{ booking.service_name }}</p>'
+        )
+        EmailTemplate.objects.create(
+            name='Resumo',
+            notification_type='digest',
+            subject='{{ total }} notificações',
+            body_text='{% for item in notificacoes %}{{ item.tipo }} {{ item.booking.code }};{% endfor %}',
+            body_html='<p>{{ total }}</p>'
+        )
+        cls.com_resumo = User.objects.create_user('resumo@exemplo.com', first_name='Rita', last_name='Melo')
+        UserPreference.objects.create(user=cls.com_resumo, digest_mode=True, digest_window_minutes=30)
+        cls.sem_resumo = User.objects.create_user('imediato@exemplo.com', first_name='Igor', last_name='Reis')
+
+    def _lembrete(self, usuario, codigo):
+        return {'recipient': usuario, 'notification_type': 'reminder', 'context': {'booking': {'code': codigo, 'service_name': 'Corte'}}}
+
+    @mock.patch.object(tasks, 'agendar_coalescido')
+    def test_acumula_tipos_nao_urgentes_de_quem_usa_resumo(self, agendar):
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = tasks.criar_notificacoes([
+                self._lembrete(self.com_resumo, 'A1'),
+                self._lembrete(self.sem_resumo, 'B1'),
+                self._lembrete(self.com_resumo, 'A2'),
+                {'recipient': self.com_resumo, 'notification_type': 'review'},
+            ])
+            # Nada é acumulado antes do commit
+            agendar.assert_not_called()
+
+        # Apenas o lembrete de quem não usa o resumo é criado; avaliação não tem template
+        self.assertEqual(Notification.objects.get(id__in=ids).recipient, self.sem_resumo)
+        agendar.assert_called_once()
+        args, kwargs = agendar.call_args
+        self.assertEqual(args[1], str(self.com_resumo.id))
+        self.assertEqual([item['context']['booking']['code'] for item in args[2]], ['A1', 'A2'])
+        self.assertEqual(kwargs['janela'], 1800)
+
+    @mock.patch.object(tasks, 'agendar_coalescido')
+    def test_transacao_desfeita_nao_acumula(self, agendar):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    tasks.criar_notificacoes([self._lembrete(self.com_resumo, 'A1')])
+                    raise RuntimeError('desfaz')
+
+        agendar.assert_not_called()
+
+    def test_resumo_agendado_pela_caixa_de_saida(self):
+        with mock.patch('core.coalescencia.get_redis_client') as redis, mock.patch('core.coalescencia.metricas'):
+            redis.return_value.pipeline.return_value.execute.return_value = [1, True, True]
+            with self.captureOnCommitCallbacks(execute=True):
+                tasks.criar_notificacoes([self._lembrete(self.com_resumo, 'A1')])
+
+        mensagem = OutboxMessage.objects.get()
+        self.assertEqual(mensagem.task_name, tasks.enviar_resumo_notificacoes.name)
+        self.assertEqual(mensagem.kwargs, {'chave_coalescencia': str(self.com_resumo.id)})
+        self.assertGreater(mensagem.available_at, timezone.now() + timedelta(minutes=29))
+
+    @mock.patch.object(tasks, 'agendar_coalescido', side_effect=ConnectionError('Redis indisponível'))
+    def test_sem_redis_envia_individualmente(self, agendar):
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.criar_notificacoes([self._lembrete(self.com_resumo, 'A1'), self._lembrete(self.com_resumo, 'A2')])
+
+        mensagem = OutboxMessage.objects.get()
+        self.assertEqual(mensagem.task_name, tasks.criar_e_enviar_notificacoes_lote.name)
+        self.assertEqual(mensagem.kwargs, {'resumir': False})
+
+        tasks.criar_e_enviar_notificacoes_lote(*mensagem.args, **mensagem.kwargs)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('email_subject', flat=True)),
+            ['Lembrete A1', 'Lembrete A2']
+        )
+
+    @mock.patch.object(tasks, 'agendar_coalescido')
+    def test_notificacao_individual_respeita_resumo(self, agendar):
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.criar_e_enviar_notificacao(
+                self.com_resumo.id, 'reminder', context={'booking': {'code': 'A1', 'service_name': 'Corte'}}
+            )
+
+        self.assertFalse(Notification.objects.exists())
+        agendar.assert_called_once()
+
+    @mock.patch.object(tasks, 'consumir_itens')
+    def test_resumo_renderizado_em_uma_notificacao(self, consumir):
+        consumir.return_value = [
+            {'notification_type': 'reminder', 'object_id': '2', 'context': {'booking': {'code': 'A2'}}, 'criado_em': '2024-01-01T10:05:00'},
+            {'notification_type': 'reminder', 'object_id': '1', 'context': {'booking': {'code': 'A1'}}, 'criado_em': '2024-01-01T10:00:00'},
+        ]
+
+        tasks.enviar_resumo_notificacoes(chave_coalescencia=str(self.com_resumo.id))
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.notification_type, 'digest')
+        self.assertEqual(notification.email_subject, '2 notificações')
+        self.assertEqual(notification.email_body, 'Lembrete A1;Lembrete A2;')
+        self.assertEqual(OutboxMessage.objects.get().args, [[notification.id]])
+
+    @mock.patch.object(tasks, 'consumir_itens')
+    def test_sem_template_de_resumo_envia_individualmente(self, consumir):
+        EmailTemplate.objects.filter(notification_type='digest').delete()
+        consumir.return_value = [
+            {'notification_type': 'reminder', 'object_id': '1', 'context': {'booking': {'code': 'A1'}}, 'criado_em': '2024-01-01T10:00:00'},
+            {'notification_type': 'reminder', 'object_id': '2', 'context': {'booking': {'code': 'A2'}}, 'criado_em': '2024-01-01T10:05:00'},
+        ]
+
+        tasks.enviar_resumo_notificacoes(chave_coalescencia=str(self.com_resumo.id))
+
+        self.assertEqual(
+            list(Notification.objects.order_by('id').values_list('email_subject', flat=True)),
+            ['Lembrete A1', 'Lembrete A2']
+        )
+
+class EnvioEmailsLoteTest(TestCase):
+    """Testes do envio de emails em lote por uma única conexão SMTP."""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user('destinatario@exemplo.com', first_name='Maria', last_name='Lima')
+        cls.ids = [
+            Notification.objects.create(
+                recipient=usuario,
+                notification_type='reminder',
+                title=f'Lembrete {indice}',
+                message='Corpo',
+                email_subject=f'Lembrete {indice}',
+                email_body='Corpo',
+                email_html='<p>Corpo</p>'
+            ).id
+            for indice in range(3)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        # Sem o Redis: sempre há ficha, o disjuntor começa fechado e as métricas são ignoradas
+        for modulo in ('limitador', 'disjuntor', 'metricas'):
+            patcher = mock.patch.object(envio, modulo)
+            setattr(self, modulo, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.disjuntor.restante.return_value = 0
+        self.disjuntor.registrar_falha.return_value = False
+
+        # Instante fixo para medir o atraso das retentativas gravadas na caixa de saída
+        self.agora = timezone.now()
+        patcher = mock.patch('django.utils.timezone.now', return_value=self.agora)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _reagendados(self):
+        """Retorna {ids: segundos de atraso} das execuções de enviar_emails_lote na caixa de saída."""
+        return {
+            tuple(mensagem.args[0]): (mensagem.available_at - self.agora).total_seconds()
+            for mensagem in OutboxMessage.objects.filter(task_name=tasks.enviar_emails_lote.name)
+        }
+
+    def test_envia_lote_com_um_update_por_microlote(self):
+        # Uma consulta das notificações e um UPDATE para o microlote
+        with self.assertNumQueries(2):
+            tasks.enviar_emails_lote(self.ids)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            set(Notification.objects.filter(id__in=self.ids).values_list('status', 'send_attempts')),
+            {('sent', 1)}
+        )
+
+    def test_reconecta_apos_desconexao(self):
+        conexao = mock.Mock()
+        conexao.send_messages.side_effect = [smtplib.SMTPServerDisconnected('queda'), 1, 1, 1]
+
+        with mock.patch.object(envio, 'get_connection', return_value=conexao):
+            tasks.enviar_emails_lote(self.ids)
+
+        self.assertEqual(conexao.open.call_count, 2)
+        self.assertEqual(Notification.objects.filter(id__in=self.ids, status='sent').count(), 3)
+
+    def test_registra_falha_do_destinatario(self):
+        conexao = mock.Mock()
+        conexao.send_messages.side_effect = [1, smtplib.SMTPRecipientsRefused({}), 1]
+
+        with mock.patch.object(envio, 'get_connection', return_value=conexao):
+            tasks.enviar_emails_lote(self.ids)
+
+        falha = Notification.objects.get(id=self.ids[1])
+        self.assertEqual(falha.status, 'failed')
+        self.assertEqual(falha.send_attempts, 1)
+        self.assertEqual(conexao.open.call_count, 1)
+        # Destinatário recusado não é reenviado nem conta para o disjuntor
+        self.assertEqual(self._reagendados(), {})
+        self.disjuntor.registrar_falha.assert_not_called()
+
+    @mock.patch('random.uniform', side_effect=lambda minimo, maximo: maximo)
+    def test_reagenda_falha_temporaria_com_backoff(self, uniform):
+        Notification.objects.filter(id=self.ids[0]).update(send_attempts=2)
+        conexao = mock.Mock()
+        conexao.send_messages.side_effect = smtplib.SMTPDataError(451, 'tente depois')
+
+        with self.settings(EMAIL_RETRY_BASE_SECONDS=60, EMAIL_RETRY_MAX_SECONDS=3600, EMAIL_MAX_SEND_ATTEMPTS=5):
+            with mock.patch.object(envio, 'get_connection', return_value=conexao):
+                tasks.enviar_emails_lote(self.ids)
+
+        # Terceira tentativa espera 4x a base; as demais, a base
+        self.assertEqual(self._reagendados(), {(self.ids[0],): 240, tuple(self.ids[1:]): 60})
+
+    def test_disjuntor_aberto_adia_restantes(self):
+        conexao = mock.Mock()
+        conexao.send_messages.side_effect = smtplib.SMTPDataError(451, 'tente depois')
+        # A primeira falha abre o disjuntor
+        self.disjuntor.restante.side_effect = [0, 0, 30, 30]
+
+        with mock.patch.object(envio, 'get_connection', return_value=conexao):
+            tasks.enviar_emails_lote(self.ids)
+
+        self.assertEqual(conexao.send_messages.call_count, 1)
+        self.assertEqual(Notification.objects.filter(id__in=self.ids[1:], status='pending').count(), 2)
+        self.assertIn(tuple(self.ids[1:]), self._reagendados())
+
+@override_settings(REMINDER_WAVE_SIZE=2, REMINDER_WINDOW_MINUTES=60)
+class OndasLembretesTest(TestCase):
+    """Testes da distribuição dos lembretes em ondas ao longo da janela de envio."""
+
+    def test_ondas_igualmente_espacadas_na_ordem(self):
+        antes = timezone.now()
+
+        self.assertEqual(tasks.agendar_ondas_lembretes([1, 2, 3, 4, 5]), 3)
+
+        mensagens = list(OutboxMessage.objects.order_by('available_at'))
+        self.assertEqual([mensagem.task_name for mensagem in mensagens], [tasks.enviar_onda_lembretes.name] * 3)
+        self.assertEqual([mensagem.args for mensagem in mensagens], [[[1, 2]], [[3, 4]], [[5]]])
+        # 60 minutos divididos em três ondas: uma a cada 20 minutos a partir de agora
+        atrasos = [(mensagem.available_at - antes).total_seconds() for mensagem in mensagens]
+        for atraso, esperado in zip(atrasos, (0, 1200, 2400)):
+            self.assertAlmostEqual(atraso, esperado, delta=5)
+
+    def test_sem_lembretes(self):
+        self.assertEqual(tasks.agendar_ondas_lembretes([]), 0)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+class CaixaDeSaidaTest(TestCase):
+    """Testes da caixa de saída de tarefas."""
+
+    def test_descarta_mensagens_da_transacao_desfeita(self):
+        try:
+            with transaction.atomic():
+                outbox.enfileirar(tasks.enviar_email, [1])
+                raise RuntimeError('falha na transação')
+        except RuntimeError:
+            pass
+
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    @mock.patch('notificacoes.outbox.metricas')
+    @mock.patch('notificacoes.outbox.current_app')
+    def test_drenar_publica_disponiveis_e_apaga(self, app, metricas):
+        outbox.enfileirar(tasks.enviar_email, [1])
+        outbox.enfileirar(tasks.enviar_emails_lote, [[2, 3]], atraso=3600)
+
+        self.assertEqual(outbox.drenar(), 1)
+
+        app.send_task.assert_called_once_with(tasks.enviar_email.name, args=[1], kwargs={})
+        # A mensagem com atraso continua aguardando
+        self.assertEqual(list(OutboxMessage.objects.values_list('task_name', flat=True)), [tasks.enviar_emails_lote.name])
+
+    @mock.patch('notificacoes.outbox.metricas')
+    @mock.patch('notificacoes.outbox.current_app')
+    def test_drenar_mantem_mensagem_com_falha(self, app, metricas):
+        app.send_task.side_effect = ConnectionError('broker indisponível')
+        outbox.enfileirar(tasks.enviar_email, [1])
+        outbox.enfileirar(tasks.enviar_email, [2])
+
+        self.assertEqual(outbox.drenar(), 0)
+
+        # Apenas a primeira é tentada; ambas continuam na caixa de saída
+        self.assertEqual(app.send_task.call_count, 1)
+        self.assertEqual(
+            list(OutboxMessage.objects.order_by('id').values_list('attempts', flat=True)),
+            [1, 0]
+        )
@@ -0,0 +1,121 @@
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Booking, ProviderAvailability, ProviderBreak, ProviderDayLock
+from .disponibilidade import STATUS_OCUPANTES, janela_do_dia
+from .cache import datas_do_intervalo
+from .retencoes import verificar_retencao, liberar_retencao
+from .capacidade import dia_lotado, data_local
+
+class ConflitoReservaError(Exception):
+    """Erro levantado quando o horário solicitado não está livre na agenda do prestador."""
+
+def travar_dias(provider_id, datas):
+    """
+    Trava as linhas (prestador, dia) até o fim da transação atual.
+
+    Reservas de prestadores ou dias diferentes seguem em paralelo; apenas
+    reservas concorrentes no mesmo dia do mesmo prestador são serializadas.
+    As datas são travadas em ordem para evitar deadlocks.
+    """
+    for data in sorted(set(datas)):
+        try:
+            with transaction.atomic():
+                ProviderDayLock.objects.get_or_create(provider_id=provider_id, date=data)
+        except IntegrityError:
+            # Criada por uma transação concorrente
+            pass
+        ProviderDayLock.objects.select_for_update().get(provider_id=provider_id, date=data)
+
+def _verificar_horario(provider, inicio, fim, excluir_id=None):
+    """Levanta ConflitoReservaError se o horário estiver fora do expediente ou ocupado."""
+    data = timezone.localtime(inicio).date()
+
+    disponibilidade = ProviderAvailability.objects.filter(
+        provider=provider,
+        day_of_week=data.weekday(),
+        is_available=True
+    ).first()
+    if not disponibilidade:
+        raise ConflitoReservaError("O prestador não atende neste dia")
+
+    dt_inicio, dt_fim = janela_do_dia(data, disponibilidade.start_time, disponibilidade.end_time)
+    if inicio < dt_inicio or fim > dt_fim:
+        raise ConflitoReservaError("Horário fora do expediente do prestador")
+
+    reservas = Booking.objects.filter(
+        provider=provider,
+        status__in=STATUS_OCUPANTES,
+        start_datetime__lt=fim,
+        end_datetime__gt=inicio
+    )
+    if excluir_id:
+        reservas = reservas.exclude(id=excluir_id)
+    if reservas.exists():
+        raise ConflitoReservaError("Horário indisponível: conflito com outra reserva")
+
+    if ProviderBreak.objects.filter(
+        provider=provider,
+        start_datetime__lt=fim,
+        end_datetime__gt=inicio
+    ).exists():
+        raise ConflitoReservaError("Horário indisponível: pausa do prestador")
+
+def criar_reserva(user, provider, start_datetime, notes='', hold_token=None):
+    """
+    Cria uma reserva verificando conflitos de forma atômica.
+
+    A verificação e a inserção acontecem com o dia do prestador travado, de
+    modo que duas requisições concorrentes não conseguem reservar horários
+    sobrepostos nem ultrapassar `max_daily_bookings`. Um horário retido no
+    checkout só pode ser reservado com o token da retenção, que é consumido
+    após o commit.
+    """
+    if timezone.is_naive(start_datetime):
+        start_datetime = timezone.make_aware(start_datetime)
+    end_datetime = start_datetime + timedelta(minutes=provider.average_service_time)
+
+    with transaction.atomic():
+        travar_dias(provider.id, datas_do_intervalo(start_datetime, end_datetime))
+        if not verificar_retencao(provider.id, start_datetime, end_datetime, hold_token):
+            raise ConflitoReservaError("Horário retido temporariamente por outro usuário")
+        _verificar_horario(provider, start_datetime, end_datetime)
+        if dia_lotado(provider.id, data_local(start_datetime), provider.max_daily_bookings):
+            raise ConflitoReservaError("O prestador atingiu o limite de reservas para este dia")
+
+        reserva = Booking.objects.create(
+            user=user,
+            provider=provider,
+            start_datetime=start_datetime,
+            end_datetime=end_datetime,
+            notes=notes or ''
+        )
+
+        if hold_token:
+            transaction.on_commit(lambda: liberar_retencao(provider.id, start_datetime, hold_token))
+
+        return reserva
+
+def reagendar_reserva(reserva, start_datetime):
+    """Move uma reserva para um novo horário verificando conflitos de forma atômica."""
+    if timezone.is_naive(start_datetime):
+        start_datetime = timezone.make_aware(start_datetime)
+    provider = reserva.provider
+    end_datetime = start_datetime + timedelta(minutes=provider.average_service_time)
+
+    with transaction.atomic():
+        travar_dias(
+            provider.id,
+            datas_do_intervalo(reserva.start_datetime, reserva.end_datetime)
+            + datas_do_intervalo(start_datetime, end_datetime)
+        )
+        _verificar_horario(provider, start_datetime, end_datetime, excluir_id=reserva.id)
+        nova_data = data_local(start_datetime)
+        if nova_data != data_local(reserva.start_datetime) and dia_lotado(provider.id, nova_data, provider.max_daily_bookings):
+            raise ConflitoReservaError("O prestador atingiu o limite de reservas para este dia")
+
+        reserva.start_datetime = start_datetime
+        reserva.end_datetime = end_datetime
+        reserva.save(update_fields=['start_datetime', 'end_datetime', 'updated_at'])
+        return reserva
\ No newline at end of file
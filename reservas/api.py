@@ -0,0 +1,269 @@
+from ninja import Router, Query
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from typing import Dict, Any, List
+from datetime import timedelta
+from uuid import UUID
+from .schemas import (
+    BookingCreateSchema, BookingUpdateSchema, BookingOutSchema,
+    TimeslotHoldCreateSchema, TimeslotHoldOutSchema,
+    AvailableTimeslotsQuerySchema, AvailableTimeslotsResponseSchema,
+    AvailableTimeslotsRangeQuerySchema, AvailableTimeslotsRangeResponseSchema,
+    ProvidersAvailabilityQuerySchema, ProvidersAvailabilityResponseSchema,
+    EarliestTimeslotsQuerySchema, EarliestTimeslotSchema, AvailabilityCacheStatsSchema,
+    CapacityCalendarQuerySchema, CapacityCalendarResponseSchema,
+    BookingHistoryQuerySchema, BookingHistorySchema, ExportBookingsQuerySchema
+)
+from .models import Provider, ProviderAvailability, Booking
+from .agendamento import criar_reserva, reagendar_reserva, ConflitoReservaError
+from .retencoes import reter_horario, obter_retencao, liberar_retencao
+from .capacidade import dias_com_capacidade
+from .arquivamento import historico_reservas
+from .tasks import (
+    calcular_horarios_disponiveis, calcular_horarios_disponiveis_periodo,
+    calcular_horarios_disponiveis_prestadores, buscar_primeiros_horarios_disponiveis,
+    MAX_DIAS_PERIODO
+)
+from . import cache as cache_disponibilidade
+from core.auth import JWTAuth, admin_required
+from core.utils import generate_excel_file, generate_csv_file, create_file_response, format_datetime
+
+router = Router()
+
+def _booking_out(booking):
+    """Monta os dados de saída de uma reserva."""
+    return {
+        "id": booking.id,
+        "user_id": booking.user_id,
+        "user_name": booking.user.get_full_name(),
+        "provider_id": booking.provider_id,
+        "provider_name": booking.provider.user.get_full_name(),
+        "start_datetime": booking.start_datetime,
+        "end_datetime": booking.end_datetime,
+        "status": booking.status,
+        "confirmation_code": booking.confirmation_code,
+        "notes": booking.notes,
+        "created_at": booking.created_at,
+        "updated_at": booking.updated_at,
+        "has_review": hasattr(booking, 'review')
+    }
+
+@router.post("/", auth=JWTAuth(), response={201: BookingOutSchema, 404: Dict[str, Any], 409: Dict[str, Any]})
+def create_booking(request, data: BookingCreateSchema):
+    """Cria uma reserva, rejeitando de forma atômica horários já ocupados."""
+    provider = get_object_or_404(Provider.objects.select_related('user'), id=data.provider_id, active=True)
+
+    try:
+        booking = criar_reserva(request.auth, provider, data.start_datetime, data.notes, hold_token=data.hold_token)
+    except ConflitoReservaError as e:
+        return 409, {"detail": str(e)}
+
+    return 201, _booking_out(booking)
+
+@router.put("/{booking_id}", auth=JWTAuth(), response={200: BookingOutSchema, 404: Dict[str, Any], 409: Dict[str, Any]})
+def update_booking(request, booking_id: UUID, data: BookingUpdateSchema):
+    """Atualiza as observações ou reagenda uma reserva ativa do usuário."""
+    booking = get_object_or_404(
+        Booking.objects.select_related('user', 'provider__user'),
+        id=booking_id,
+        user=request.auth,
+        status__in=['pending', 'confirmed']
+    )
+
+    if data.start_datetime:
+        try:
+            booking = reagendar_reserva(booking, data.start_datetime)
+        except ConflitoReservaError as e:
+            return 409, {"detail": str(e)}
+
+    if data.notes is not None:
+        booking.notes = data.notes
+        booking.save(update_fields=['notes', 'updated_at'])
+
+    return 200, _booking_out(booking)
+
+def _filtros_historico(start_date=None, end_date=None):
+    """Monta os filtros de período comuns ao histórico e à exportação."""
+    filtros = {}
+    if start_date:
+        filtros['start_datetime__date__gte'] = start_date
+    if end_date:
+        filtros['start_datetime__date__lte'] = end_date
+    return filtros
+
+@router.get("/historico", auth=JWTAuth(), response=List[BookingHistorySchema])
+def get_booking_history(request, filters: BookingHistoryQuerySchema = Query(...)):
+    """Retorna o histórico de reservas do usuário, incluindo as reservas arquivadas."""
+    inicio = (filters.page - 1) * filters.page_size
+    reservas = historico_reservas(
+        user_id=request.auth.id,
+        **_filtros_historico(filters.start_date, filters.end_date)
+    )
+    return list(reservas[inicio:inicio + filters.page_size])
+
+@router.get("/exportar", auth=JWTAuth())
+@admin_required
+def export_bookings(request, filters: ExportBookingsQuerySchema = Query(...)):
+    """Exporta as reservas (ativas e arquivadas) em Excel ou CSV (apenas para administradores)."""
+    filtros = _filtros_historico(filters.start_date, filters.end_date)
+    if filters.provider_id:
+        filtros['provider_id'] = filters.provider_id
+    if filters.status:
+        filtros['status'] = filters.status
+
+    headers = ['Código', 'Serviço', 'Prestador', 'Início', 'Término', 'Status', 'Nota', 'Arquivada']
+    data = [
+        [
+            reserva['confirmation_code'],
+            reserva['service_name'],
+            reserva['provider_name'],
+            format_datetime(timezone.localtime(reserva['start_datetime'])),
+            format_datetime(timezone.localtime(reserva['end_datetime'])),
+            reserva['status'],
+            reserva['rating'],
+            'Sim' if reserva['archived'] else 'Não'
+        ]
+        for reserva in historico_reservas(**filtros).iterator()
+    ]
+
+    if filters.format == 'excel':
+        file_data = generate_excel_file(data, headers, sheet_name='Reservas')
+    else:
+        file_data = generate_csv_file(data, headers)
+    return create_file_response(file_data, 'reservas', filters.format)
+
+@router.get("/disponibilidade", auth=JWTAuth(), response={200: AvailableTimeslotsResponseSchema, 400: Dict[str, Any]})
+def get_available_timeslots(request, filters: AvailableTimeslotsQuerySchema = Query(...)):
+    """Retorna os horários de um prestador em uma data."""
+    provider = get_object_or_404(Provider.objects.select_related('user'), id=filters.provider_id)
+
+    timeslots = calcular_horarios_disponiveis(provider.id, filters.date)
+    if isinstance(timeslots, str):
+        return 400, {"detail": timeslots}
+
+    return 200, {
+        "provider_id": provider.id,
+        "provider_name": provider.user.get_full_name(),
+        "date": filters.date,
+        "timeslots": timeslots
+    }
+
+@router.get("/disponibilidade/periodo", auth=JWTAuth(), response={200: AvailableTimeslotsRangeResponseSchema, 400: Dict[str, Any]})
+def get_available_timeslots_range(request, filters: AvailableTimeslotsRangeQuerySchema = Query(...)):
+    """Retorna os horários de um prestador para cada dia de um período (ou apenas as contagens no modo resumo)."""
+    if (filters.end_date - filters.start_date).days >= MAX_DIAS_PERIODO:
+        return 400, {"detail": f"O período não pode exceder {MAX_DIAS_PERIODO} dias"}
+
+    provider = get_object_or_404(Provider.objects.select_related('user'), id=filters.provider_id)
+
+    days = calcular_horarios_disponiveis_periodo(
+        provider.id,
+        filters.start_date,
+        filters.end_date,
+        resumo=filters.summary
+    )
+    if isinstance(days, str):
+        return 400, {"detail": days}
+
+    return 200, {
+        "provider_id": provider.id,
+        "provider_name": provider.user.get_full_name(),
+        "start_date": filters.start_date,
+        "end_date": filters.end_date,
+        "days": days
+    }
+
+@router.get("/disponibilidade/prestadores", auth=JWTAuth(), response={200: ProvidersAvailabilityResponseSchema, 400: Dict[str, Any]})
+def get_providers_available_timeslots(request, filters: ProvidersAvailabilityQuerySchema = Query(...)):
+    """Retorna os horários de vários prestadores ativos em uma data (por ids ou por serviço)."""
+    providers = calcular_horarios_disponiveis_prestadores(
+        filters.date,
+        provider_ids=filters.provider_ids,
+        service_name=filters.service_name,
+        apenas_livres=filters.only_available
+    )
+    if isinstance(providers, str):
+        return 400, {"detail": providers}
+
+    return 200, {
+        "date": filters.date,
+        "providers": providers
+    }
+
+@router.get("/disponibilidade/proximos", auth=JWTAuth(), response={200: List[EarliestTimeslotSchema], 400: Dict[str, Any]})
+def get_earliest_timeslots(request, filters: EarliestTimeslotsQuerySchema = Query(...)):
+    """Retorna os primeiros horários livres entre os prestadores de um serviço."""
+    timeslots = buscar_primeiros_horarios_disponiveis(
+        service_name=filters.service_name,
+        inicio=filters.start_datetime,
+        fim=filters.end_datetime,
+        limite=filters.limit,
+        hora_minima=filters.time_from,
+        hora_maxima=filters.time_to
+    )
+    if isinstance(timeslots, str):
+        return 400, {"detail": timeslots}
+
+    return 200, timeslots
+
+@router.post("/disponibilidade/retencoes", auth=JWTAuth(), response={201: TimeslotHoldOutSchema, 404: Dict[str, Any], 409: Dict[str, Any]})
+def create_timeslot_hold(request, data: TimeslotHoldCreateSchema):
+    """Retém um horário livre durante o checkout e retorna o token a ser usado na criação da reserva."""
+    provider = get_object_or_404(Provider, id=data.provider_id, active=True)
+    start_datetime = data.start_datetime
+    if timezone.is_naive(start_datetime):
+        start_datetime = timezone.make_aware(start_datetime)
+
+    timeslots = calcular_horarios_disponiveis(provider.id, timezone.localtime(start_datetime).date())
+    if isinstance(timeslots, str) or not any(
+        slot['is_available'] and slot['start_time'] == start_datetime for slot in timeslots
+    ):
+        return 409, {"detail": "Horário indisponível"}
+
+    end_datetime = start_datetime + timedelta(minutes=provider.average_service_time)
+    hold = reter_horario(provider.id, start_datetime, end_datetime, request.auth.id)
+    if hold is None:
+        return 409, {"detail": "Horário retido temporariamente por outro usuário"}
+
+    token, expires_at = hold
+    return 201, {
+        "token": token,
+        "provider_id": provider.id,
+        "start_datetime": start_datetime,
+        "expires_at": expires_at
+    }
+
+@router.delete("/disponibilidade/retencoes/{token}", auth=JWTAuth(), response={204: None, 404: Dict[str, Any]})
+def delete_timeslot_hold(request, token: str):
+    """Libera um horário retido no checkout."""
+    hold = obter_retencao(token)
+    if hold is None or not liberar_retencao(hold[0], hold[1], token):
+        return 404, {"detail": "Retenção não encontrada ou expirada"}
+    return 204, None
+
+@router.get("/disponibilidade/capacidade", auth=JWTAuth(), response={200: CapacityCalendarResponseSchema, 400: Dict[str, Any]})
+def get_capacity_calendar(request, filters: CapacityCalendarQuerySchema = Query(...)):
+    """Retorna, para cada dia de atendimento do período, as reservas ativas e a capacidade diária restante."""
+    if (filters.end_date - filters.start_date).days >= MAX_DIAS_PERIODO:
+        return 400, {"detail": f"O período não pode exceder {MAX_DIAS_PERIODO} dias"}
+
+    provider = get_object_or_404(Provider, id=filters.provider_id)
+    expedientes = set(
+        ProviderAvailability.objects.filter(provider=provider, is_available=True).values_list('day_of_week', flat=True)
+    )
+
+    days = dias_com_capacidade(provider, filters.start_date, filters.end_date, expedientes)
+    if filters.only_available:
+        days = [day for day in days if day['capacity_left'] > 0]
+
+    return 200, {
+        "provider_id": provider.id,
+        "max_daily_bookings": provider.max_daily_bookings,
+        "days": days
+    }
+
+@router.get("/disponibilidade/cache", auth=JWTAuth(), response=AvailabilityCacheStatsSchema)
+@admin_required
+def get_availability_cache_stats(request):
+    """Retorna os contadores de acertos e falhas do cache de disponibilidade (apenas para administradores)."""
+    return cache_disponibilidade.estatisticas()
\ No newline at end of file
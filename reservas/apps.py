@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ReservasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reservas'
+
+    def ready(self):
+        # Registra os sinais de invalidação do cache de disponibilidade
+        from . import signals  # noqa: F401
\ No newline at end of file
@@ -0,0 +1,108 @@
+from django.db import connection, transaction
+from django.db.models import BooleanField, F, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from avaliacoes.models import Review, ReviewResponse
+from .models import Booking, BookingArchive
+
+# Status finais que podem ser movidos para o arquivo
+STATUS_ARQUIVAVEIS = ['completed', 'canceled', 'archived']
+
+# Quantidade de reservas movidas por transação
+TAMANHO_LOTE = 500
+
+# Campos comuns às reservas ativas e arquivadas no histórico
+CAMPOS_HISTORICO = [
+    'id', 'user_id', 'provider_id', 'start_datetime', 'end_datetime', 'status',
+    'confirmation_code', 'notes', 'created_at', 'provider_name', 'service_name',
+    'rating', 'archived'
+]
+
+def _sql_copiar(quantidade):
+    reserva = connection.ops.quote_name(Booking._meta.db_table)
+    arquivo = connection.ops.quote_name(BookingArchive._meta.db_table)
+    avaliacao = connection.ops.quote_name(Review._meta.db_table)
+    resposta = connection.ops.quote_name(ReviewResponse._meta.db_table)
+    marcadores = ', '.join(['%s'] * quantidade)
+    return f"""
+        INSERT INTO {arquivo} (
+            id, user_id, provider_id, start_datetime, end_datetime, status,
+            confirmation_code, notes, created_at, updated_at, archived_at,
+            review_rating, review_comment, review_created_at,
+            review_response_text, review_response_by_id, review_response_created_at
+        )
+        SELECT
+            b.id, b.user_id, b.provider_id, b.start_datetime, b.end_datetime, b.status,
+            b.confirmation_code, b.notes, b.created_at, b.updated_at, %s,
+            r.rating, COALESCE(r.comment, ''), r.created_at,
+            COALESCE(rr.text, ''), rr.responded_by_id, rr.created_at
+        FROM {reserva} b
+        LEFT JOIN {avaliacao} r ON r.booking_id = b.id
+        LEFT JOIN {resposta} rr ON rr.review_id = r.id
+        WHERE b.id IN ({marcadores})
+    """
+
+def _sql_remover(quantidade):
+    reserva = connection.ops.quote_name(Booking._meta.db_table)
+    marcadores = ', '.join(['%s'] * quantidade)
+    return f"DELETE FROM {reserva} WHERE id IN ({marcadores})"
+
+def mover_lote(limite, tamanho_lote=TAMANHO_LOTE):
+    """
+    Move para BookingArchive um lote de reservas finalizadas antes de `limite`.
+
+    A cópia é um único INSERT ... SELECT (com a avaliação e a resposta do
+    prestador) e a remoção um único DELETE, na mesma transação. As linhas são travadas e
+    reverificadas antes da cópia. Retorna a quantidade de reservas movidas.
+    """
+    with transaction.atomic():
+        ids = list(Booking.objects.select_for_update(skip_locked=True).filter(
+            status__in=STATUS_ARQUIVAVEIS,
+            end_datetime__lt=limite
+        ).order_by('id').values_list('id', flat=True)[:tamanho_lote])
+        if not ids:
+            return 0
+
+        campo_id = Booking._meta.pk
+        parametros = [campo_id.get_db_prep_value(booking_id, connection) for booking_id in ids]
+        agora = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        with connection.cursor() as cursor:
+            cursor.execute(_sql_copiar(len(ids)), [agora] + parametros)
+
+        # Avaliações e respostas seguem copiadas no arquivo e entram nas estatísticas de avaliação
+        ReviewResponse.objects.filter(review__booking_id__in=ids).delete()
+        Review.objects.filter(booking_id__in=ids).delete()
+
+        with connection.cursor() as cursor:
+            cursor.execute(_sql_remover(len(ids)), parametros)
+
+        return len(ids)
+
+def historico_reservas(**filtros):
+    """
+    Retorna as reservas ativas e arquivadas que atendem aos filtros, como dicionários.
+
+    Os filtros usam os nomes de campo comuns aos dois modelos e as anotações
+    seguem a mesma ordem nas duas consultas, exigida pelo UNION. Usado apenas
+    pelos endpoints de histórico e exportação; o restante do sistema lê
+    somente a tabela de reservas ativas.
+    """
+    nome_prestador = Concat('provider__user__first_name', Value(' '), 'provider__user__last_name')
+
+    ativas = Booking.objects.filter(**filtros).annotate(
+        provider_name=nome_prestador,
+        service_name=F('provider__service_name'),
+        rating=F('review__rating'),
+        archived=Value(False, output_field=BooleanField())
+    ).values(*CAMPOS_HISTORICO).order_by()
+
+    arquivadas = BookingArchive.objects.filter(**filtros).annotate(
+        provider_name=nome_prestador,
+        service_name=F('provider__service_name'),
+        rating=F('review_rating'),
+        archived=Value(True, output_field=BooleanField())
+    ).values(*CAMPOS_HISTORICO).order_by()
+
+    return ativas.union(arquivadas, all=True).order_by('-start_datetime')
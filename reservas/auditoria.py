@@ -0,0 +1,29 @@
+import heapq
+
+def encontrar_conflitos(linhas):
+    """
+    Gera os pares de reservas sobrepostas em uma única passada.
+
+    `linhas` são tuplas (id, provider_id, start_datetime, end_datetime)
+    ordenadas por prestador e início, como vêm de um cursor do banco. Para
+    cada prestador mantém um heap com as reservas ainda abertas (ordenadas
+    pelo término); toda reserva que começa antes do término de uma aberta
+    forma um par com ela. Gera tuplas (provider_id, id_a, id_b, inicio, fim)
+    com o trecho sobreposto.
+    """
+    prestador_atual = None
+    abertas = []
+
+    for booking_id, provider_id, inicio, fim in linhas:
+        if provider_id != prestador_atual:
+            prestador_atual = provider_id
+            abertas = []
+
+        # Descarta as reservas que terminam antes do início desta
+        while abertas and abertas[0][0] <= inicio:
+            heapq.heappop(abertas)
+
+        for fim_aberta, _, id_aberta in abertas:
+            yield provider_id, id_aberta, booking_id, inicio, min(fim, fim_aberta)
+
+        heapq.heappush(abertas, (fim, str(booking_id), booking_id))
@@ -0,0 +1,172 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from itertools import count
+from django.utils import timezone
+import heapq
+
+from .models import ProviderAvailability
+from .disponibilidade import janela_do_dia
+from .capacidade import dia_lotado
+from .materializacao import horizonte, buscar_slots_livres
+from .retencoes import retidos_por_dia, aplicar_retencoes
+
+# Entradas da fila: um dia candidato de um prestador, um horário concreto ou
+# o próximo horário livre materializado
+DIA = 0
+HORARIO = 1
+MATERIALIZADO = 2
+
+# Horários materializados lidos por vez da consulta por faixa
+TAMANHO_BLOCO_MATERIALIZADOS = 200
+
+def _proximo_dia_util(expedientes, data, data_limite):
+    """Retorna a primeira data a partir de `data` em que o prestador atende, ou None."""
+    while data <= data_limite:
+        if data.weekday() in expedientes:
+            return data
+        data += timedelta(days=1)
+    return None
+
+def buscar_primeiros_horarios(providers, inicio, fim, limite, hora_minima=None, hora_maxima=None):
+    """
+    Retorna os `limite` primeiros horários livres entre os prestadores informados.
+
+    Usa uma fila de prioridade com dias candidatos (chave = primeiro instante
+    possível do expediente) e horários concretos. Um dia só é calculado quando
+    chega ao topo da fila, então a busca para assim que os `limite` horários
+    mais cedo forem encontrados, sem calcular todos os dias de todos os
+    prestadores. Dias que já atingiram `max_daily_bookings` são ignorados.
+
+    Dentro do horizonte materializado, os horários dos prestadores com
+    materialize_slots vêm de uma única consulta por faixa no índice de
+    ProviderSlot (estado livre, ordenada por início), lida aos poucos e
+    intercalada na mesma fila; apenas os dias após o horizonte são calculados.
+    """
+    from .tasks import calcular_horarios_disponiveis
+
+    providers = {provider.id: provider for provider in providers}
+    if not providers or limite <= 0:
+        return []
+
+    inicio = max(inicio, timezone.now())
+    data_limite = timezone.localtime(fim).date()
+
+    expedientes = defaultdict(dict)
+    for provider_id, dia, hora_inicio, hora_fim in ProviderAvailability.objects.filter(
+        provider_id__in=list(providers),
+        is_available=True
+    ).values_list('provider_id', 'day_of_week', 'start_time', 'end_time'):
+        expedientes[provider_id][dia] = (hora_inicio, hora_fim)
+
+    fila = []
+    desempate = count()
+
+    def agendar_dia(provider_id, data):
+        data = _proximo_dia_util(expedientes[provider_id], data, data_limite)
+        if data is None:
+            return
+        hora_inicio, hora_fim = expedientes[provider_id][data.weekday()]
+        if hora_minima and hora_minima > hora_inicio:
+            hora_inicio = hora_minima
+        dt_inicio, _ = janela_do_dia(data, hora_inicio, hora_fim)
+        heapq.heappush(fila, (max(dt_inicio, inicio), DIA, next(desempate), provider_id, data))
+
+    data_inicial = timezone.localtime(inicio).date()
+    materializados = {provider_id for provider_id, provider in providers.items() if provider.materialize_slots}
+    _, fim_horizonte = horizonte()
+    for provider_id in expedientes:
+        if provider_id in materializados:
+            agendar_dia(provider_id, max(data_inicial, fim_horizonte + timedelta(days=1)))
+        else:
+            agendar_dia(provider_id, data_inicial)
+
+    livres = iter(())
+    if materializados:
+        limite_horizonte = timezone.make_aware(
+            datetime.combine(fim_horizonte + timedelta(days=1), time.min),
+            timezone.get_default_timezone()
+        )
+        livres = buscar_slots_livres(materializados, inicio, min(fim, limite_horizonte)).values_list(
+            'provider_id', 'start_datetime', 'end_datetime'
+        ).iterator(chunk_size=TAMANHO_BLOCO_MATERIALIZADOS)
+
+    def agendar_proximo_livre():
+        livre = next(livres, None)
+        if livre:
+            heapq.heappush(fila, (livre[1], MATERIALIZADO, next(desempate), livre[0], livre))
+
+    agendar_proximo_livre()
+
+    # Lotação e retenções por (prestador, data) dos horários materializados; None se o dia estiver lotado
+    retidos = {}
+
+    def horario_materializado(provider_id, slot_inicio, slot_fim):
+        provider = providers[provider_id]
+        slot_inicio, slot_fim = timezone.localtime(slot_inicio), timezone.localtime(slot_fim)
+        hora_slot = slot_inicio.time()
+        if slot_fim > fim or (hora_minima and hora_slot < hora_minima) or (hora_maxima and hora_slot > hora_maxima):
+            return None
+
+        dia = (provider_id, slot_inicio.date())
+        if dia not in retidos:
+            lotado = dia_lotado(provider_id, dia[1], provider.max_daily_bookings)
+            retidos[dia] = None if lotado else retidos_por_dia([dia])[dia]
+        if retidos[dia] is None:
+            return None
+
+        slot = {'start_time': slot_inicio, 'end_time': slot_fim, 'is_available': True}
+        if not aplicar_retencoes([slot], retidos[dia])[0]['is_available']:
+            return None
+
+        return {
+            'provider_id': provider_id,
+            'provider_name': provider.user.get_full_name(),
+            'service_name': provider.service_name,
+            'start_time': slot_inicio,
+            'end_time': slot_fim
+        }
+
+    resultado = []
+    while fila and len(resultado) < limite:
+        instante, tipo, _, provider_id, item = heapq.heappop(fila)
+        if instante >= fim:
+            break
+
+        if tipo == HORARIO:
+            resultado.append(item)
+            continue
+
+        if tipo == MATERIALIZADO:
+            agendar_proximo_livre()
+            horario = horario_materializado(*item)
+            if horario:
+                resultado.append(horario)
+            continue
+
+        data = item
+        provider = providers[provider_id]
+
+        # Expande o dia em horários concretos e agenda o próximo dia do prestador
+        agendar_dia(provider_id, data + timedelta(days=1))
+        if dia_lotado(provider_id, data, provider.max_daily_bookings):
+            continue
+
+        slots = calcular_horarios_disponiveis(provider_id, data)
+        if isinstance(slots, str):
+            continue
+
+        for slot in slots:
+            hora_slot = timezone.localtime(slot['start_time']).time()
+            if not slot['is_available'] or slot['start_time'] < inicio or slot['end_time'] > fim:
+                continue
+            if (hora_minima and hora_slot < hora_minima) or (hora_maxima and hora_slot > hora_maxima):
+                continue
+            heapq.heappush(fila, (slot['start_time'], HORARIO, next(desempate), provider_id, {
+                'provider_id': provider_id,
+                'provider_name': provider.user.get_full_name(),
+                'service_name': provider.service_name,
+                'start_time': slot['start_time'],
+                'end_time': slot['end_time']
+            }))
+
+    return resultado
\ No newline at end of file
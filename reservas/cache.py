@@ -0,0 +1,135 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+import time
+
+PREFIXO = 'disponibilidade'
+CHAVE_ACERTOS = f'{PREFIXO}:metricas:acertos'
+CHAVE_FALHAS = f'{PREFIXO}:metricas:falhas'
+
+def _chave_versao(provider_id):
+    return f'{PREFIXO}:versao:{provider_id}'
+
+def _chave_geracao(provider_id, data):
+    return f'{PREFIXO}:geracao:{provider_id}:{data.isoformat()}'
+
+def _chave_dia(provider_id, data, versao):
+    return f'{PREFIXO}:{provider_id}:{data.isoformat()}:v{versao}'
+
+def _nova_versao():
+    # Baseada no relógio para nunca reaproveitar uma versão já usada, mesmo
+    # que a chave de versão tenha sido removida do Redis
+    return int(time.time() * 1000)
+
+def _incrementar(chave, quantidade):
+    """Incrementa um contador no cache, criando-o se necessário."""
+    if quantidade <= 0:
+        return
+    try:
+        cache.incr(chave, quantidade)
+    except ValueError:
+        if not cache.add(chave, quantidade, timeout=None):
+            cache.incr(chave, quantidade)
+
+def _versoes_prestadores(provider_ids):
+    """Retorna {provider_id: versão} das configurações de disponibilidade dos prestadores."""
+    chaves = {_chave_versao(provider_id): provider_id for provider_id in provider_ids}
+    encontradas = cache.get_many(list(chaves))
+
+    versoes = {}
+    for chave, provider_id in chaves.items():
+        versao = encontradas.get(chave)
+        if versao is None:
+            cache.add(chave, _nova_versao(), timeout=None)
+            versao = cache.get(chave)
+        versoes[provider_id] = versao
+    return versoes
+
+def obter_versoes(dias):
+    """
+    Retorna {(provider_id, data): versão} dos dias informados.
+
+    A versão combina a versão das configurações do prestador com a geração do
+    dia, avançada a cada invalidação. Deve ser lida antes do cálculo e
+    reutilizada ao salvar: um resultado calculado antes de uma invalidação
+    concorrente é gravado sob a versão antiga e nunca mais é lido.
+    """
+    dias = list(dict.fromkeys(dias))
+    versoes_prestadores = _versoes_prestadores({provider_id for provider_id, data in dias})
+    geracoes = cache.get_many([_chave_geracao(provider_id, data) for provider_id, data in dias])
+
+    return {
+        (provider_id, data): f'{versoes_prestadores[provider_id]}.{geracoes.get(_chave_geracao(provider_id, data), 0)}'
+        for provider_id, data in dias
+    }
+
+def obter_slots(versoes):
+    """Retorna {(provider_id, data): slots} dos dias encontrados em cache e contabiliza acertos e falhas."""
+    chaves = {_chave_dia(provider_id, data, versao): (provider_id, data) for (provider_id, data), versao in versoes.items()}
+    encontrados = cache.get_many(list(chaves))
+
+    _incrementar(CHAVE_ACERTOS, len(encontrados))
+    _incrementar(CHAVE_FALHAS, len(chaves) - len(encontrados))
+
+    return {chaves[chave]: slots for chave, slots in encontrados.items()}
+
+def salvar_slots(versoes, slots_por_dia):
+    """Armazena os slots calculados por (provider_id, data) sob as versões lidas antes do cálculo."""
+    cache.set_many(
+        {
+            _chave_dia(provider_id, data, versoes[(provider_id, data)]): slots
+            for (provider_id, data), slots in slots_por_dia.items()
+        },
+        timeout=settings.AVAILABILITY_CACHE_TIMEOUT
+    )
+
+def datas_do_intervalo(inicio, fim):
+    """Retorna as datas locais tocadas pelo intervalo [inicio, fim)."""
+    data = timezone.localtime(inicio).date()
+    ultima = timezone.localtime(fim - timedelta(microseconds=1)).date() if fim > inicio else data
+    datas = []
+    while data <= ultima:
+        datas.append(data)
+        data += timedelta(days=1)
+    return datas
+
+def invalidar_dias(provider_id, datas):
+    """
+    Invalida os slots de um prestador nas datas informadas avançando a geração de cada dia.
+
+    Os slots em cache não são removidos: ficam sob a geração anterior, que não
+    é mais lida, e expiram com AVAILABILITY_CACHE_TIMEOUT. Assim um cálculo
+    iniciado antes da invalidação também não é lido depois dela.
+    """
+    for data in datas:
+        chave = _chave_geracao(provider_id, data)
+        try:
+            cache.incr(chave)
+        except ValueError:
+            # Geração inicial baseada no relógio, para nunca repetir uma geração
+            # já usada se a chave expirar; a chave sobrevive aos slots que valida
+            if not cache.add(chave, _nova_versao(), timeout=settings.AVAILABILITY_CACHE_TIMEOUT * 2):
+                cache.incr(chave)
+
+def invalidar_prestador(provider_id):
+    """Invalida todos os dias em cache de um prestador avançando a versão das suas configurações."""
+    chave = _chave_versao(provider_id)
+    try:
+        # Uma nova versão do relógio poderia repetir a atual no mesmo milissegundo
+        cache.incr(chave)
+    except ValueError:
+        if not cache.add(chave, _nova_versao(), timeout=None):
+            cache.incr(chave)
+
+def estatisticas():
+    """Retorna os contadores de acertos e falhas do cache de disponibilidade."""
+    valores = cache.get_many([CHAVE_ACERTOS, CHAVE_FALHAS])
+    acertos = valores.get(CHAVE_ACERTOS, 0)
+    falhas = valores.get(CHAVE_FALHAS, 0)
+    total = acertos + falhas
+    return {
+        'hits': acertos,
+        'misses': falhas,
+        'hit_ratio': round(acertos / total, 4) if total else 0.0
+    }
\ No newline at end of file
@@ -0,0 +1,131 @@
+from datetime import datetime, time, timedelta
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.redis import get_redis_client
+from .models import Booking, Provider
+from .disponibilidade import STATUS_OCUPANTES
+
+PREFIXO = 'capacidade'
+
+def _chave(provider_id, data):
+    return f'{PREFIXO}:{provider_id}:{data.isoformat()}'
+
+def _chave_limite(provider_id):
+    return f'{PREFIXO}:limite:{provider_id}'
+
+def _expira_em(data):
+    # Mantém o contador até dois dias após a data
+    fim = datetime.combine(data + timedelta(days=2), time.min)
+    return int(timezone.make_aware(fim).timestamp())
+
+def data_local(instante):
+    """Retorna a data local usada como chave do contador."""
+    return timezone.localtime(instante).date()
+
+def ajustar(provider_id, data, delta):
+    """Incrementa (ou decrementa) atomicamente o contador de reservas ativas do prestador na data."""
+    pipe = get_redis_client().pipeline()
+    pipe.incrby(_chave(provider_id, data), delta)
+    pipe.expireat(_chave(provider_id, data), _expira_em(data))
+    pipe.execute()
+
+def ajustar_em_lote(deltas):
+    """Aplica {(provider_id, data): delta} aos contadores em uma única ida ao Redis."""
+    if not deltas:
+        return
+    pipe = get_redis_client().pipeline()
+    for (provider_id, data), delta in deltas.items():
+        pipe.incrby(_chave(provider_id, data), delta)
+        pipe.expireat(_chave(provider_id, data), _expira_em(data))
+    pipe.execute()
+
+def obter(pares):
+    """Retorna {(provider_id, data): reservas ativas} para os pares informados (um MGET)."""
+    pares = list(pares)
+    if not pares:
+        return {}
+    valores = get_redis_client().mget([_chave(provider_id, data) for provider_id, data in pares])
+    return {par: max(int(valor or 0), 0) for par, valor in zip(pares, valores)}
+
+def limites(provider_ids):
+    """Retorna {provider_id: max_daily_bookings}, lendo do cache e completando pelo banco."""
+    chaves = {_chave_limite(provider_id): provider_id for provider_id in provider_ids}
+    encontrados = {chaves[chave]: valor for chave, valor in cache.get_many(list(chaves)).items()}
+
+    faltantes = [provider_id for provider_id in provider_ids if provider_id not in encontrados]
+    if faltantes:
+        do_banco = dict(Provider.objects.filter(id__in=faltantes).values_list('id', 'max_daily_bookings'))
+        cache.set_many({_chave_limite(provider_id): limite for provider_id, limite in do_banco.items()}, timeout=None)
+        encontrados.update(do_banco)
+    return encontrados
+
+def invalidar_limite(provider_id):
+    cache.delete(_chave_limite(provider_id))
+
+def dia_lotado(provider_id, data, limite=None):
+    """Indica se o prestador já atingiu `max_daily_bookings` na data."""
+    if limite is None:
+        limite = limites([provider_id]).get(provider_id)
+    if limite is None:
+        return False
+    return obter([(provider_id, data)])[(provider_id, data)] >= limite
+
+def aplicar_lotacao(slots, lotado):
+    """Marca todos os slots como indisponíveis quando o dia está lotado."""
+    if not lotado:
+        return slots
+    return [dict(slot, is_available=False) for slot in slots]
+
+def reconciliar(data_inicio, data_fim):
+    """
+    Regrava os contadores do período a partir da tabela de reservas.
+
+    Corrige desvios causados por alterações em massa ou transações revertidas.
+    Contadores do período sem reservas ativas no banco são removidos.
+    """
+    tz = timezone.get_default_timezone()
+    inicio = timezone.make_aware(datetime.combine(data_inicio, time.min), tz)
+    fim = timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), time.min), tz)
+
+    contagens = Booking.objects.filter(
+        status__in=STATUS_OCUPANTES,
+        start_datetime__gte=inicio,
+        start_datetime__lt=fim
+    ).annotate(
+        data=TruncDate('start_datetime', tzinfo=tz)
+    ).values_list('provider_id', 'data').annotate(total=Count('id')).order_by()
+
+    corretos = {_chave(provider_id, data): (total, data) for provider_id, data, total in contagens}
+
+    cliente = get_redis_client()
+    pipe = cliente.pipeline()
+    for chave in cliente.scan_iter(match=f'{PREFIXO}:*:*-*-*', count=1000):
+        data = datetime.strptime(chave.rsplit(':', 1)[1], '%Y-%m-%d').date()
+        if data_inicio <= data <= data_fim and chave not in corretos:
+            pipe.delete(chave)
+    for chave, (total, data) in corretos.items():
+        pipe.set(chave, total)
+        pipe.expireat(chave, _expira_em(data))
+    pipe.execute()
+
+    return len(corretos)
+
+def dias_com_capacidade(provider, data_inicio, data_fim, expedientes):
+    """Retorna, para cada dia de atendimento do período, as reservas ativas e a capacidade restante."""
+    datas = [
+        data_inicio + timedelta(days=i)
+        for i in range((data_fim - data_inicio).days + 1)
+        if (data_inicio + timedelta(days=i)).weekday() in expedientes
+    ]
+    ocupadas = obter((provider.id, data) for data in datas)
+    return [
+        {
+            'date': data,
+            'bookings': ocupadas[(provider.id, data)],
+            'capacity_left': max(provider.max_daily_bookings - ocupadas[(provider.id, data)], 0)
+        }
+        for data in datas
+    ]
\ No newline at end of file
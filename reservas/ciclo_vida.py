@@ -0,0 +1,115 @@
+from datetime import timedelta
+from django.utils import timezone
+
+from core.redis import get_redis_client
+
+PREFIXO = 'ciclo_vida'
+
+# Transições agendadas, cada uma em um conjunto ordenado (membro = id da reserva, score = prazo)
+EXPIRAR = 'expirar'
+CONCLUIR = 'concluir'
+AVALIAR = 'avaliar'
+
+# Prazo para confirmar uma reserva pendente
+PRAZO_CONFIRMACAO = timedelta(hours=12)
+# Atraso da solicitação de avaliação após a conclusão
+ATRASO_AVALIACAO = timedelta(hours=1)
+# Espera antes de reprocessar as reservas de um lote que falhou
+ATRASO_RETENTATIVA = timedelta(minutes=1)
+
+# Reservas registradas por pipeline ao popular os prazos
+TAMANHO_LOTE = 1000
+
+# Retira e retorna atomicamente os membros vencidos, para que dois
+# despachantes nunca processem a mesma reserva
+_SCRIPT_REIVINDICAR = """
+local itens = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #itens > 0 then
+    redis.call('ZREM', KEYS[1], unpack(itens))
+end
+return itens
+"""
+
+def _chave(transicao):
+    return f'{PREFIXO}:{transicao}'
+
+def proxima_transicao(status, created_at, end_datetime):
+    """Retorna (transição, prazo) do próximo passo automático da reserva, ou None."""
+    if status == 'pending':
+        return EXPIRAR, created_at + PRAZO_CONFIRMACAO
+    if status == 'confirmed':
+        return CONCLUIR, end_datetime
+    return None
+
+def registrar(booking_id, status, created_at, end_datetime):
+    """
+    Registra o próximo prazo da reserva e cancela os prazos que deixaram de valer.
+
+    A solicitação de avaliação só é agendada pelo despachante ao concluir a
+    reserva, então ela é mantida enquanto a reserva estiver concluída.
+    """
+    booking_id = str(booking_id)
+    proxima = proxima_transicao(status, created_at, end_datetime)
+
+    pipe = get_redis_client().pipeline()
+    for transicao in (EXPIRAR, CONCLUIR):
+        if not proxima or proxima[0] != transicao:
+            pipe.zrem(_chave(transicao), booking_id)
+    if status != 'completed':
+        pipe.zrem(_chave(AVALIAR), booking_id)
+    if proxima:
+        transicao, prazo = proxima
+        pipe.zadd(_chave(transicao), {booking_id: prazo.timestamp()})
+    pipe.execute()
+
+def cancelar(booking_id):
+    """Remove todos os prazos pendentes da reserva."""
+    pipe = get_redis_client().pipeline()
+    for transicao in (EXPIRAR, CONCLUIR, AVALIAR):
+        pipe.zrem(_chave(transicao), str(booking_id))
+    pipe.execute()
+
+def agendar(transicao, prazos):
+    """Agenda {booking_id: prazo} em uma transição."""
+    if prazos:
+        get_redis_client().zadd(
+            _chave(transicao),
+            {str(booking_id): prazo.timestamp() for booking_id, prazo in prazos.items()}
+        )
+
+def reivindicar(transicao, agora, limite):
+    """Retira da transição e retorna até `limite` ids de reservas com prazo vencido."""
+    return get_redis_client().eval(_SCRIPT_REIVINDICAR, 1, _chave(transicao), agora.timestamp(), limite)
+
+def devolver(transicao, booking_ids):
+    """
+    Devolve à transição os ids reivindicados cujo lote falhou.
+
+    O novo prazo é ATRASO_RETENTATIVA à frente, para que a mesma execução
+    do despachante não volte a reivindicá-los em seguida.
+    """
+    prazo = timezone.now() + ATRASO_RETENTATIVA
+    agendar(transicao, {booking_id: prazo for booking_id in booking_ids})
+
+def popular(reservas):
+    """
+    Registra o próximo prazo de reservas já existentes, como as criadas antes da implantação dos prazos.
+
+    Idempotente: registrar de novo uma reserva apenas regrava o mesmo prazo.
+    Retorna a quantidade de reservas agendadas.
+    """
+    contador = 0
+    pipe = get_redis_client().pipeline()
+    for booking_id, status, created_at, end_datetime in reservas.values_list(
+        'id', 'status', 'created_at', 'end_datetime'
+    ).iterator(chunk_size=TAMANHO_LOTE):
+        proxima = proxima_transicao(status, created_at, end_datetime)
+        if not proxima:
+            continue
+        transicao, prazo = proxima
+        pipe.zadd(_chave(transicao), {str(booking_id): prazo.timestamp()})
+        contador += 1
+        if contador % TAMANHO_LOTE == 0:
+            pipe.execute()
+    pipe.execute()
+    return contador
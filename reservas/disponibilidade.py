@@ -0,0 +1,192 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from django.utils import timezone
+
+from .models import Booking, ProviderAvailability, ProviderBreak
+
+# Status de reserva que ocupam a agenda do prestador
+STATUS_OCUPANTES = ['confirmed', 'pending']
+
+def janela_do_dia(data, hora_inicio, hora_fim):
+    """Retorna os datetimes (com fuso) de início e fim do expediente em uma data."""
+    tz = timezone.get_default_timezone()
+    dt_inicio = timezone.make_aware(datetime.combine(data, hora_inicio), tz)
+    dt_fim = timezone.make_aware(datetime.combine(data, hora_fim), tz)
+    return dt_inicio, dt_fim
+
+def mesclar_intervalos(intervalos):
+    """Ordena e mescla intervalos (início, fim) sobrepostos ou contíguos."""
+    mesclados = []
+    for inicio, fim in sorted(intervalos):
+        if mesclados and inicio <= mesclados[-1][1]:
+            if fim > mesclados[-1][1]:
+                mesclados[-1][1] = fim
+        else:
+            mesclados.append([inicio, fim])
+    return [(inicio, fim) for inicio, fim in mesclados]
+
+def carregar_ocupacoes_por_prestador(provider_ids, dt_inicio, dt_fim):
+    """
+    Carrega as reservas ativas e as pausas de vários prestadores que tocam a janela informada.
+
+    Executa uma consulta para reservas e outra para pausas, agrupa os
+    intervalos por prestador em memória e retorna {provider_id: ocupados},
+    com os intervalos de cada prestador já ordenados e mesclados.
+    """
+    reservas = Booking.objects.filter(
+        provider_id__in=provider_ids,
+        status__in=STATUS_OCUPANTES,
+        start_datetime__lt=dt_fim,
+        end_datetime__gt=dt_inicio
+    ).values_list('provider_id', 'start_datetime', 'end_datetime')
+
+    pausas = ProviderBreak.objects.filter(
+        provider_id__in=provider_ids,
+        start_datetime__lt=dt_fim,
+        end_datetime__gt=dt_inicio
+    ).values_list('provider_id', 'start_datetime', 'end_datetime')
+
+    intervalos = defaultdict(list)
+    for provider_id, inicio, fim in list(reservas) + list(pausas):
+        intervalos[provider_id].append((inicio, fim))
+
+    return {
+        provider_id: mesclar_intervalos(intervalos[provider_id])
+        for provider_id in provider_ids
+    }
+
+def carregar_ocupacoes(provider, dt_inicio, dt_fim):
+    """Carrega os intervalos ocupados (reservas ativas e pausas) de um prestador na janela informada."""
+    return carregar_ocupacoes_por_prestador([provider.id], dt_inicio, dt_fim)[provider.id]
+
+def carregar_disponibilidades_semanais(provider):
+    """Retorna {dia_semana: (hora_inicio, hora_fim)} dos dias em que o prestador atende."""
+    return {
+        dia: (inicio, fim)
+        for dia, inicio, fim in ProviderAvailability.objects.filter(
+            provider=provider,
+            is_available=True
+        ).values_list('day_of_week', 'start_time', 'end_time')
+    }
+
+def varrer_slots(dt_inicio, dt_fim, tempo_atendimento, intervalo, ocupados, indice=0):
+    """
+    Gera os slots do expediente marcando cada um como livre ou ocupado.
+
+    Os slots e os intervalos ocupados (ordenados e mesclados) são percorridos
+    uma única vez, com um ponteiro avançando sobre os intervalos ocupados a
+    partir de `indice`.
+    """
+    duracao_atendimento = timedelta(minutes=tempo_atendimento)
+    duracao_slot = timedelta(minutes=tempo_atendimento + intervalo)
+
+    slots = []
+    slot_inicio = dt_inicio
+
+    while slot_inicio + duracao_slot <= dt_fim:
+        slot_fim = slot_inicio + duracao_atendimento
+
+        # Descarta intervalos que terminam antes do início do slot
+        while indice < len(ocupados) and ocupados[indice][1] <= slot_inicio:
+            indice += 1
+
+        conflito = indice < len(ocupados) and ocupados[indice][0] < slot_fim
+
+        slots.append({
+            'start_time': slot_inicio,
+            'end_time': slot_fim,
+            'is_available': not conflito
+        })
+
+        slot_inicio += duracao_slot
+
+    return slots
+
+def calcular_slots_periodo(provider, data_inicio, data_fim):
+    """
+    Calcula os slots de cada dia entre `data_inicio` e `data_fim` (inclusive).
+
+    A disponibilidade semanal, as reservas e as pausas são lidas uma única vez
+    para o período inteiro. Retorna uma lista de tuplas (data, slots).
+    """
+    semanais = carregar_disponibilidades_semanais(provider)
+
+    datas = [data_inicio + timedelta(days=i) for i in range((data_fim - data_inicio).days + 1)]
+    janelas = {
+        data: janela_do_dia(data, *semanais[data.weekday()])
+        for data in datas
+        if data.weekday() in semanais
+    }
+
+    if not janelas:
+        return [(data, []) for data in datas]
+
+    ocupados = carregar_ocupacoes(
+        provider,
+        min(inicio for inicio, _ in janelas.values()),
+        max(fim for _, fim in janelas.values())
+    )
+    fins = [fim for _, fim in ocupados]
+
+    resultado = []
+    for data in datas:
+        if data not in janelas:
+            resultado.append((data, []))
+            continue
+
+        dt_inicio, dt_fim = janelas[data]
+        # Primeiro intervalo ocupado que termina depois do início do expediente
+        indice = bisect_right(fins, dt_inicio)
+        resultado.append((data, varrer_slots(
+            dt_inicio,
+            dt_fim,
+            provider.average_service_time,
+            provider.interval_between_bookings,
+            ocupados,
+            indice
+        )))
+
+    return resultado
+
+def calcular_slots_prestadores(providers, data):
+    """
+    Calcula os slots de vários prestadores em uma data.
+
+    A disponibilidade do dia da semana, as reservas e as pausas de todos os
+    prestadores são lidas em consultas únicas. Retorna {provider_id: slots}.
+    """
+    providers = {provider.id: provider for provider in providers}
+    if not providers:
+        return {}
+
+    janelas = {
+        provider_id: janela_do_dia(data, inicio, fim)
+        for provider_id, inicio, fim in ProviderAvailability.objects.filter(
+            provider_id__in=list(providers),
+            day_of_week=data.weekday(),
+            is_available=True
+        ).values_list('provider_id', 'start_time', 'end_time')
+    }
+
+    resultado = {provider_id: [] for provider_id in providers}
+    if not janelas:
+        return resultado
+
+    ocupados = carregar_ocupacoes_por_prestador(
+        list(janelas),
+        min(inicio for inicio, _ in janelas.values()),
+        max(fim for _, fim in janelas.values())
+    )
+
+    for provider_id, (dt_inicio, dt_fim) in janelas.items():
+        provider = providers[provider_id]
+        resultado[provider_id] = varrer_slots(
+            dt_inicio,
+            dt_fim,
+            provider.average_service_time,
+            provider.interval_between_bookings,
+            ocupados[provider_id]
+        )
+
+    return resultado
\ No newline at end of file
@@ -0,0 +1,112 @@
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.utils import timezone
+import re
+import unicodedata
+
+from .models import WaitingList
+
+# Períodos do dia reconhecidos na preferência de horário
+PERIODOS = {
+    'manha': (time(6, 0), time(12, 0)),
+    'tarde': (time(12, 0), time(18, 0)),
+    'noite': (time(18, 0), time.max),
+}
+
+_HORA = r'(\d{1,2})(?:\s*[:h]\s*(\d{2}))?\s*h?'
+_FAIXA = re.compile(_HORA + r'\s*(?:-|a|as|ate)\s*' + _HORA)
+_A_PARTIR = re.compile(r'(?:a partir d[ae]s?|apos(?: as?)?|depois d[ae]s?)\s*' + _HORA)
+_ATE = re.compile(r'(?:ate(?: as?)?|antes d[ae]s?)\s*' + _HORA)
+_HORARIO = re.compile(_HORA)
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+def _hora(horas, minutos):
+    horas, minutos = int(horas), int(minutos or 0)
+    if horas > 23 or minutos > 59:
+        return None
+    return time(horas, minutos)
+
+def interpretar_preferencia(texto):
+    """
+    Converte a preferência de horário em uma lista de janelas (início, fim).
+
+    Aceita períodos ("manhã", "tarde", "noite"), faixas ("14h-16h",
+    "09:00 às 11:30"), limites ("a partir das 15h", "até 12h") e horários
+    isolados ("14h", janela de uma hora). Uma lista vazia significa qualquer
+    horário, inclusive para textos que não puderam ser interpretados.
+    """
+    texto = _normalizar(texto or '')
+    janelas = [janela for periodo, janela in PERIODOS.items() if periodo in texto]
+
+    for padrao, montar in (
+        (_FAIXA, lambda g: (_hora(g[0], g[1]), _hora(g[2], g[3]))),
+        (_A_PARTIR, lambda g: (_hora(g[0], g[1]), time.max)),
+        (_ATE, lambda g: (time.min, _hora(g[0], g[1]))),
+    ):
+        for encontrado in padrao.finditer(texto):
+            inicio, fim = montar(encontrado.groups())
+            if inicio is not None and fim is not None and inicio < fim:
+                janelas.append((inicio, fim))
+        texto = padrao.sub(' ', texto)
+
+    for encontrado in _HORARIO.finditer(texto):
+        inicio = _hora(*encontrado.groups())
+        if inicio is not None:
+            fim = (datetime.combine(datetime.min, inicio) + timedelta(hours=1)).time()
+            janelas.append((inicio, fim if fim > inicio else time.max))
+
+    return janelas
+
+def preferencia_cobre(janelas, inicio, fim):
+    """Indica se alguma janela (horário local) contém o horário [inicio, fim)."""
+    if not janelas:
+        return True
+    inicio_local = timezone.localtime(inicio)
+    fim_local = timezone.localtime(fim)
+    if fim_local.date() != inicio_local.date():
+        return False
+    return any(
+        janela_inicio <= inicio_local.time() and fim_local.time() <= janela_fim
+        for janela_inicio, janela_fim in janelas
+    )
+
+def ofertar_vagas(provider_id, data, slots_livres):
+    """
+    Associa cada horário livre a uma entrada da lista de espera, em ordem de chegada.
+
+    Considera apenas as entradas não notificadas do prestador na data (índice
+    provider, desired_date, is_notified) e oferece no máximo um horário por
+    entrada e uma entrada por horário. As entradas escolhidas são travadas e
+    marcadas como notificadas, então execuções concorrentes não oferecem a
+    mesma vaga duas vezes. Deve ser chamada dentro da transação que grava as
+    notificações das ofertas, para que uma falha ao gravá-las desfaça também
+    a marcação. Retorna uma lista de (entrada, slot).
+    """
+    if not slots_livres:
+        return []
+
+    with transaction.atomic():
+        entradas = [
+            (entrada, interpretar_preferencia(entrada.time_preference))
+            for entrada in WaitingList.objects.select_for_update(skip_locked=True).filter(
+                provider_id=provider_id,
+                desired_date=data,
+                is_notified=False
+            ).order_by('created_at', 'id')
+        ]
+
+        ofertas = []
+        for slot in sorted(slots_livres, key=lambda slot: slot['start_time']):
+            for indice, (entrada, janelas) in enumerate(entradas):
+                if preferencia_cobre(janelas, slot['start_time'], slot['end_time']):
+                    ofertas.append((entrada, slot))
+                    del entradas[indice]
+                    break
+
+        if ofertas:
+            WaitingList.objects.filter(id__in=[entrada.id for entrada, _ in ofertas]).update(is_notified=True)
+
+    return ofertas
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from reservas import ciclo_vida
+from reservas.disponibilidade import STATUS_OCUPANTES
+from reservas.models import Booking
+
+class Command(BaseCommand):
+    help = 'Agenda no Redis os prazos das reservas pendentes e confirmadas já existentes'
+
+    def handle(self, *args, **options):
+        contador = ciclo_vida.popular(Booking.objects.filter(status__in=STATUS_OCUPANTES))
+        self.stdout.write(self.style.SUCCESS(f'{contador} prazos de reservas agendados.'))
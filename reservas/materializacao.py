@@ -0,0 +1,219 @@
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import Provider, ProviderSlot, Booking, ProviderBreak
+from . import cache as cache_disponibilidade
+from .disponibilidade import (
+    STATUS_OCUPANTES, janela_do_dia, mesclar_intervalos,
+    carregar_disponibilidades_semanais, varrer_slots
+)
+
+def horizonte():
+    """Retorna as datas inicial e final (inclusive) do horizonte materializado."""
+    hoje = timezone.localdate()
+    return hoje, hoje + timedelta(days=settings.SLOT_MATERIALIZATION_DAYS - 1)
+
+def dentro_do_horizonte(data):
+    """Indica se a data está dentro do horizonte materializado."""
+    inicio_horizonte, fim_horizonte = horizonte()
+    return inicio_horizonte <= data <= fim_horizonte
+
+def ler_slots_materializados(provider, dt_inicio, dt_fim):
+    """Lê os horários materializados do expediente no formato de AvailableTimeslotSchema."""
+    return [
+        {
+            'start_time': timezone.localtime(inicio),
+            'end_time': timezone.localtime(fim),
+            'is_available': estado == 'free'
+        }
+        for inicio, fim, estado in ProviderSlot.objects.filter(
+            provider=provider,
+            start_datetime__gte=dt_inicio,
+            start_datetime__lt=dt_fim
+        ).order_by('start_datetime').values_list('start_datetime', 'end_datetime', 'state')
+    ]
+
+def _carregar_intervalos(provider_id, dt_inicio, dt_fim):
+    """Retorna as reservas ativas e as pausas da janela como listas mescladas separadas."""
+    reservas = Booking.objects.filter(
+        provider_id=provider_id,
+        status__in=STATUS_OCUPANTES,
+        start_datetime__lt=dt_fim,
+        end_datetime__gt=dt_inicio
+    ).values_list('start_datetime', 'end_datetime')
+
+    pausas = ProviderBreak.objects.filter(
+        provider_id=provider_id,
+        start_datetime__lt=dt_fim,
+        end_datetime__gt=dt_inicio
+    ).values_list('start_datetime', 'end_datetime')
+
+    return mesclar_intervalos(reservas), mesclar_intervalos(pausas)
+
+def _marcar_conflitos(slots, ocupados):
+    """Para slots (início, fim) ordenados, indica quais sobrepõem os intervalos ocupados mesclados."""
+    conflitos = []
+    indice = 0
+    for inicio, fim in slots:
+        while indice < len(ocupados) and ocupados[indice][1] <= inicio:
+            indice += 1
+        conflitos.append(indice < len(ocupados) and ocupados[indice][0] < fim)
+    return conflitos
+
+def _estados(slots, reservas, pausas):
+    bloqueados = _marcar_conflitos(slots, pausas)
+    reservados = _marcar_conflitos(slots, reservas)
+    return [
+        'blocked' if bloqueado else 'booked' if reservado else 'free'
+        for bloqueado, reservado in zip(bloqueados, reservados)
+    ]
+
+def materializar_dias(provider, datas):
+    """
+    Recalcula e regrava os horários materializados do prestador nas datas informadas.
+
+    Após o commit, invalida o cache das datas regravadas: um dia que acabou
+    de entrar no horizonte pode ter sido lido e guardado antes de ter linhas.
+    """
+    datas = sorted(data for data in datas if dentro_do_horizonte(data))
+    if not datas:
+        return 0
+
+    semanais = carregar_disponibilidades_semanais(provider)
+    janelas = {
+        data: janela_do_dia(data, *semanais[data.weekday()])
+        for data in datas
+        if data.weekday() in semanais
+    }
+
+    novos = []
+    if janelas:
+        reservas, pausas = _carregar_intervalos(
+            provider.id,
+            min(inicio for inicio, _ in janelas.values()),
+            max(fim for _, fim in janelas.values())
+        )
+        for dt_inicio, dt_fim in janelas.values():
+            grade = [
+                (slot['start_time'], slot['end_time'])
+                for slot in varrer_slots(
+                    dt_inicio,
+                    dt_fim,
+                    provider.average_service_time,
+                    provider.interval_between_bookings,
+                    []
+                )
+            ]
+            for (inicio, fim), estado in zip(grade, _estados(grade, reservas, pausas)):
+                novos.append(ProviderSlot(
+                    provider=provider,
+                    start_datetime=inicio,
+                    end_datetime=fim,
+                    state=estado
+                ))
+
+    tz = timezone.get_default_timezone()
+    dias = Q()
+    for data in datas:
+        inicio_dia = timezone.make_aware(datetime.combine(data, time.min), tz)
+        dias |= Q(start_datetime__gte=inicio_dia, start_datetime__lt=inicio_dia + timedelta(days=1))
+
+    with transaction.atomic():
+        ProviderSlot.objects.filter(dias, provider=provider).delete()
+        ProviderSlot.objects.bulk_create(novos, batch_size=1000)
+
+    transaction.on_commit(lambda: cache_disponibilidade.invalidar_dias(provider.id, datas))
+    return len(novos)
+
+def reavaliar_intervalos(provider_id, intervalos, materializado=None):
+    """
+    Recalcula o estado apenas dos horários materializados que tocam os intervalos informados.
+
+    Usado na criação, cancelamento e reagendamento de reservas e na edição de
+    pausas. Prestadores sem materialização são ignorados. `materializado` é
+    o materialize_slots já carregado do prestador; sem ele, o banco é
+    consultado.
+    """
+    intervalos = [(inicio, fim) for inicio, fim in intervalos if inicio and fim]
+    if not intervalos or materializado is False:
+        return 0
+    if materializado is None and not Provider.objects.filter(id=provider_id, materialize_slots=True).exists():
+        return 0
+
+    atualizados = 0
+    for inicio, fim in mesclar_intervalos(intervalos):
+        with transaction.atomic():
+            slots = list(ProviderSlot.objects.select_for_update().filter(
+                provider_id=provider_id,
+                start_datetime__lt=fim,
+                end_datetime__gt=inicio
+            ).order_by('start_datetime'))
+            if not slots:
+                continue
+
+            reservas, pausas = _carregar_intervalos(provider_id, slots[0].start_datetime, slots[-1].end_datetime)
+            estados = _estados([(slot.start_datetime, slot.end_datetime) for slot in slots], reservas, pausas)
+
+            agora = timezone.now()
+            alterados = []
+            for slot, estado in zip(slots, estados):
+                if slot.state != estado:
+                    slot.state = estado
+                    slot.updated_at = agora
+                    alterados.append(slot)
+            ProviderSlot.objects.bulk_update(alterados, ['state', 'updated_at'])
+            atualizados += len(alterados)
+
+    return atualizados
+
+def rematerializar_prestador(provider_id, dia_semana=None):
+    """Regrava o horizonte do prestador (opcionalmente apenas os dias de um dia da semana)."""
+    try:
+        provider = Provider.objects.get(id=provider_id)
+    except Provider.DoesNotExist:
+        return 0
+
+    if not provider.materialize_slots:
+        ProviderSlot.objects.filter(provider=provider).delete()
+        return 0
+
+    inicio_horizonte, fim_horizonte = horizonte()
+    datas = [
+        inicio_horizonte + timedelta(days=i)
+        for i in range((fim_horizonte - inicio_horizonte).days + 1)
+    ]
+    if dia_semana is not None:
+        datas = [data for data in datas if data.weekday() == dia_semana]
+    return materializar_dias(provider, datas)
+
+def avancar_horizonte(provider):
+    """Remove horários passados e materializa os dias que entraram no horizonte."""
+    inicio_horizonte, fim_horizonte = horizonte()
+    agora = timezone.now()
+
+    ProviderSlot.objects.filter(provider=provider, end_datetime__lt=agora).delete()
+
+    ultimo = ProviderSlot.objects.filter(provider=provider).aggregate(ultimo=Max('start_datetime'))['ultimo']
+    primeira = inicio_horizonte
+    if ultimo:
+        primeira = max(primeira, timezone.localtime(ultimo).date() + timedelta(days=1))
+
+    datas = [primeira + timedelta(days=i) for i in range((fim_horizonte - primeira).days + 1)]
+    return materializar_dias(provider, datas)
+
+def buscar_slots_livres(provider_ids, inicio, fim):
+    """
+    Retorna os horários livres materializados dos prestadores na janela (consulta por faixa no índice).
+
+    Usada pela busca dos primeiros horários disponíveis para os prestadores
+    com materialize_slots dentro do horizonte.
+    """
+    return ProviderSlot.objects.filter(
+        provider_id__in=provider_ids,
+        state='free',
+        start_datetime__gte=inicio,
+        start_datetime__lt=fim
+    ).order_by('start_datetime')
\ No newline at end of file
@@ -14,6 +14,7 @@ class Provider(models.Model):
     average_service_time = models.IntegerField(_('tempo médio de atendimento (minutos)'), default=60)
     interval_between_bookings = models.IntegerField(_('intervalo entre reservas (minutos)'), default=15)
     max_daily_bookings = models.IntegerField(_('máximo de reservas diárias'), default=10)
+    materialize_slots = models.BooleanField(_('materializar horários'), default=False)
     active = models.BooleanField(_('ativo'), default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -67,6 +68,47 @@ class ProviderBreak(models.Model):
     def __str__(self):
         return f"{self.provider.user.get_full_name()}: {self.start_datetime.strftime('%d/%m/%Y %H:%M')} - {self.end_datetime.strftime('%d/%m/%Y %H:%M')}"
 
+class ProviderSlot(models.Model):
+    """Modelo para os horários materializados dos prestadores com alto volume de reservas."""
+    
+    STATE_CHOICES = [
+        ('free', _('Livre')),
+        ('booked', _('Reservado')),
+        ('blocked', _('Bloqueado')),
+    ]
+    
+    provider = models.ForeignKey(Provider, on_delete=models.CASCADE, related_name='slots')
+    start_datetime = models.DateTimeField(_('início do horário'))
+    end_datetime = models.DateTimeField(_('fim do horário'))
+    state = models.CharField(_('estado'), max_length=10, choices=STATE_CHOICES, default='free')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = _('horário materializado')
+        verbose_name_plural = _('horários materializados')
+        ordering = ['start_datetime']
+        unique_together = ['provider', 'start_datetime']
+        indexes = [
+            models.Index(fields=['provider', 'state', 'start_datetime']),
+        ]
+    
+    def __str__(self):
+        return f"{self.provider_id}: {self.start_datetime.strftime('%d/%m/%Y %H:%M')} ({self.get_state_display()})"
+
+class ProviderDayLock(models.Model):
+    """Linha de trava por prestador e dia usada para serializar a criação de reservas."""
+    
+    provider = models.ForeignKey(Provider, on_delete=models.CASCADE, related_name='day_locks')
+    date = models.DateField(_('data'))
+    
+    class Meta:
+        verbose_name = _('trava de agenda')
+        verbose_name_plural = _('travas de agenda')
+        unique_together = ['provider', 'date']
+    
+    def __str__(self):
+        return f"{self.provider_id}: {self.date.strftime('%d/%m/%Y')}"
+
 class Booking(models.Model):
     """Modelo para reservas de serviços."""
     
@@ -109,6 +151,49 @@ class Booking(models.Model):
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.provider.service_name} - {self.start_datetime.strftime('%d/%m/%Y %H:%M')}"
 
+class BookingArchive(models.Model):
+    """Modelo para reservas antigas movidas da tabela de reservas ativas, com a avaliação e a resposta do prestador."""
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_bookings')
+    provider = models.ForeignKey(Provider, on_delete=models.CASCADE, related_name='archived_bookings')
+    start_datetime = models.DateTimeField(_('data e hora de início'))
+    end_datetime = models.DateTimeField(_('data e hora de término'))
+    status = models.CharField(_('status'), max_length=10, choices=Booking.STATUS_CHOICES)
+    confirmation_code = models.CharField(_('código de confirmação'), max_length=8, db_index=True)
+    notes = models.TextField(_('observações'), blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(_('arquivada em'))
+
+    # Resumo da avaliação da reserva
+    review_rating = models.IntegerField(_('nota da avaliação'), null=True, blank=True)
+    review_comment = models.TextField(_('comentário da avaliação'), blank=True)
+    review_created_at = models.DateTimeField(_('data da avaliação'), null=True, blank=True)
+
+    # Resposta do prestador à avaliação
+    review_response_text = models.TextField(_('resposta à avaliação'), blank=True)
+    review_response_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='archived_review_responses'
+    )
+    review_response_created_at = models.DateTimeField(_('data da resposta'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('reserva arquivada')
+        verbose_name_plural = _('reservas arquivadas')
+        ordering = ['-start_datetime']
+        indexes = [
+            models.Index(fields=['user', 'start_datetime']),
+            models.Index(fields=['provider', 'start_datetime']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.provider_id} - {self.start_datetime.strftime('%d/%m/%Y %H:%M')} (arquivada)"
+
 class WaitingList(models.Model):
     """Modelo para lista de espera de reservas canceladas."""
     
@@ -122,6 +207,9 @@ class WaitingList(models.Model):
     class Meta:
         verbose_name = _('lista de espera')
         verbose_name_plural = _('listas de espera')
+        indexes = [
+            models.Index(fields=['provider', 'desired_date', 'is_notified']),
+        ]
     
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.provider.service_name} - {self.desired_date.strftime('%d/%m/%Y')}"
@@ -0,0 +1,66 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+
+from .models import ProviderAvailability
+from .disponibilidade import carregar_ocupacoes_por_prestador, janela_do_dia, varrer_slots
+
+def _meia_noite(data):
+    return timezone.make_aware(datetime.combine(data, time.min), timezone.get_default_timezone())
+
+def calcular_slots_em_massa(providers, data_inicio, data_fim):
+    """
+    Calcula os slots de vários prestadores para todos os dias do período.
+
+    Executa três consultas (disponibilidades, reservas e pausas) para todo o
+    conjunto. Os dias de cada prestador são percorridos por varrer_slots,
+    que começa no primeiro intervalo ocupado que termina depois do início do
+    expediente; o resultado é igual ao de calcular_slots_periodo, inclusive
+    nas mudanças de horário de verão. Retorna {provider_id: {data: slots}}
+    no formato de AvailableTimeslotSchema.
+    """
+    providers = {provider.id: provider for provider in providers}
+    if not providers:
+        return {}
+
+    datas = [data_inicio + timedelta(days=i) for i in range((data_fim - data_inicio).days + 1)]
+
+    semanais = defaultdict(dict)
+    for provider_id, dia, inicio, fim in ProviderAvailability.objects.filter(
+        provider_id__in=list(providers),
+        is_available=True
+    ).values_list('provider_id', 'day_of_week', 'start_time', 'end_time'):
+        semanais[provider_id][dia] = (inicio, fim)
+
+    ocupacoes = carregar_ocupacoes_por_prestador(
+        list(providers),
+        _meia_noite(data_inicio),
+        _meia_noite(data_fim + timedelta(days=1))
+    )
+
+    resultado = {}
+    for provider_id, provider in providers.items():
+        # Sem duração, a varredura não avançaria
+        expedientes = semanais.get(provider_id, {}) if provider.average_service_time + provider.interval_between_bookings else {}
+        ocupados = ocupacoes[provider_id]
+        fins = [fim for _, fim in ocupados]
+
+        dias_provider = {}
+        for data in datas:
+            if data.weekday() not in expedientes:
+                dias_provider[data] = []
+                continue
+
+            dt_inicio, dt_fim = janela_do_dia(data, *expedientes[data.weekday()])
+            dias_provider[data] = varrer_slots(
+                dt_inicio,
+                dt_fim,
+                provider.average_service_time,
+                provider.interval_between_bookings,
+                ocupados,
+                bisect_right(fins, dt_inicio)
+            )
+        resultado[provider_id] = dias_provider
+
+    return resultado
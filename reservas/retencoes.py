@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils import timezone
+import secrets
+import time
+
+from core.redis import get_redis_client
+from .cache import datas_do_intervalo
+
+PREFIXO = 'retencao'
+
+# Retém o intervalo apenas se nenhuma retenção ativa dos dias tocados o
+# sobrepuser. Os membros dos índices são 'token|user_id|início|fim' (instantes
+# em segundos) e o score é a expiração; os índices são os primeiros KEYS e a
+# chave do token é o último.
+_SCRIPT_RETER = """
+local inicio = tonumber(ARGV[3])
+local fim = tonumber(ARGV[4])
+for i = 1, #KEYS - 1 do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', ARGV[1])
+    for _, membro in ipairs(redis.call('ZRANGE', KEYS[i], 0, -1)) do
+        local _, _, outro_inicio, outro_fim = string.match(membro, '^([^|]*)|([^|]*)|([^|]*)|([^|]*)$')
+        if tonumber(outro_inicio) < fim and tonumber(outro_fim) > inicio then
+            return 0
+        end
+    end
+end
+for i = 1, #KEYS - 1 do
+    redis.call('ZADD', KEYS[i], ARGV[2], ARGV[5])
+    redis.call('EXPIRE', KEYS[i], ARGV[6])
+end
+redis.call('SET', KEYS[#KEYS], ARGV[7], 'EX', ARGV[6])
+return 1
+"""
+
+# Remove a retenção e seus índices apenas se a chave do token ainda tiver o valor lido
+_SCRIPT_LIBERAR = """
+if redis.call('GET', KEYS[#KEYS]) ~= ARGV[1] then
+    return 0
+end
+for i = 1, #KEYS - 1 do
+    redis.call('ZREM', KEYS[i], ARGV[2])
+end
+redis.call('DEL', KEYS[#KEYS])
+return 1
+"""
+
+def _chave_token(token):
+    return f'{PREFIXO}:token:{token}'
+
+def _chave_indice(provider_id, data):
+    return f'{PREFIXO}:indice:{provider_id}:{data.isoformat()}'
+
+def _chaves_indices(provider_id, inicio, fim):
+    return [_chave_indice(provider_id, data) for data in datas_do_intervalo(inicio, fim)]
+
+def _membro(token, user_id, inicio, fim):
+    return f'{token}|{user_id}|{inicio.timestamp()}|{fim.timestamp()}'
+
+def _intervalo(membro):
+    """Retorna (token, início, fim) de um membro do índice, com instantes em segundos."""
+    token, _, inicio, fim = membro.split('|')
+    return token, float(inicio), float(fim)
+
+def reter_horario(provider_id, inicio, fim, user_id):
+    """
+    Retém o intervalo [inicio, fim) da agenda do prestador por SLOT_HOLD_SECONDS.
+
+    A verificação e a gravação são atômicas: a retenção é recusada se
+    sobrepuser qualquer retenção ativa, mesmo com outro horário de início.
+    Retorna (token, expira_em) ou None se o intervalo já estiver retido.
+    """
+    token = secrets.token_urlsafe(16)
+    ttl = settings.SLOT_HOLD_SECONDS
+    agora = time.time()
+
+    retido = get_redis_client().eval(
+        _SCRIPT_RETER,
+        len(datas_do_intervalo(inicio, fim)) + 1,
+        *_chaves_indices(provider_id, inicio, fim),
+        _chave_token(token),
+        agora,
+        agora + ttl,
+        inicio.timestamp(),
+        fim.timestamp(),
+        _membro(token, user_id, inicio, fim),
+        ttl,
+        f'{provider_id}|{inicio.isoformat()}|{fim.isoformat()}|{user_id}'
+    )
+    if not retido:
+        return None
+
+    return token, timezone.now() + timedelta(seconds=ttl)
+
+def _ler_token(token):
+    valor = get_redis_client().get(_chave_token(token))
+    if not valor:
+        return None
+    provider_id, inicio, fim, user_id = valor.split('|')
+    return valor, int(provider_id), datetime.fromisoformat(inicio), datetime.fromisoformat(fim), user_id
+
+def obter_retencao(token):
+    """Retorna (provider_id, inicio) da retenção do token, ou None se expirada."""
+    retencao = _ler_token(token)
+    if retencao is None:
+        return None
+    return retencao[1], retencao[2]
+
+def verificar_retencao(provider_id, inicio, fim, token=None):
+    """Indica se o intervalo está livre de retenções de terceiros (sem retenção sobreposta ou retido pelo token)."""
+    agora = time.time()
+    pipe = get_redis_client().pipeline()
+    for chave in _chaves_indices(provider_id, inicio, fim):
+        pipe.zrangebyscore(chave, agora, '+inf')
+
+    inicio, fim = inicio.timestamp(), fim.timestamp()
+    for membros in pipe.execute():
+        for membro in membros:
+            dono, outro_inicio, outro_fim = _intervalo(membro)
+            if dono != token and outro_inicio < fim and outro_fim > inicio:
+                return False
+    return True
+
+def liberar_retencao(provider_id, inicio, token):
+    """Libera a retenção se o token conferir com o prestador e o início. Retorna True se algo foi removido."""
+    retencao = _ler_token(token)
+    if retencao is None:
+        return False
+    valor, provider_retido, inicio_retido, fim_retido, user_id = retencao
+    if provider_retido != provider_id or inicio_retido != inicio:
+        return False
+
+    chaves = _chaves_indices(provider_id, inicio_retido, fim_retido)
+    return bool(get_redis_client().eval(
+        _SCRIPT_LIBERAR,
+        len(chaves) + 1,
+        *chaves,
+        _chave_token(token),
+        valor,
+        _membro(token, user_id, inicio_retido, fim_retido)
+    ))
+
+def retidos_por_dia(pares):
+    """Retorna {(provider_id, data): [(início, fim)]} dos intervalos retidos, em segundos, em uma ida ao Redis."""
+    pares = list(pares)
+    if not pares:
+        return {}
+
+    agora = time.time()
+    pipe = get_redis_client().pipeline()
+    for provider_id, data in pares:
+        pipe.zrangebyscore(_chave_indice(provider_id, data), agora, '+inf')
+    return {
+        par: [_intervalo(membro)[1:] for membro in membros]
+        for par, membros in zip(pares, pipe.execute())
+    }
+
+def aplicar_retencoes(slots, retidos):
+    """Marca como retidos (e indisponíveis) os slots que sobrepõem algum intervalo em `retidos`."""
+    if not retidos:
+        return slots
+    marcados = []
+    for slot in slots:
+        inicio, fim = slot['start_time'].timestamp(), slot['end_time'].timestamp()
+        if any(retido_inicio < fim and retido_fim > inicio for retido_inicio, retido_fim in retidos):
+            slot = dict(slot, is_available=False, is_held=True)
+        marcados.append(slot)
+    return marcados
+
+def marcar_retidos(provider_id, data, slots):
+    """Aplica as retenções ativas de um prestador em uma data aos slots calculados."""
+    return aplicar_retencoes(slots, retidos_por_dia([(provider_id, data)])[(provider_id, data)])
@@ -18,6 +18,7 @@ class ProviderUpdateSchema(Schema):
     average_service_time: Optional[int] = Field(default=None, ge=10, le=240)
     interval_between_bookings: Optional[int] = Field(default=None, ge=0, le=60)
     max_daily_bookings: Optional[int] = Field(default=None, ge=1, le=100)
+    materialize_slots: Optional[bool] = None
     active: Optional[bool] = None
 
 class ProviderOutSchema(Schema):
@@ -30,6 +31,7 @@ class ProviderOutSchema(Schema):
     average_service_time: int
     interval_between_bookings: int
     max_daily_bookings: int
+    materialize_slots: bool
     active: bool
     created_at: datetime
     updated_at: datetime
@@ -90,6 +92,7 @@ class BookingCreateSchema(Schema):
     provider_id: int
     start_datetime: datetime
     notes: Optional[str] = None
+    hold_token: Optional[str] = None  # Token da retenção obtida no checkout
     
     @validator('start_datetime')
     def start_datetime_not_in_past(cls, v):
@@ -141,6 +144,7 @@ class AvailableTimeslotSchema(Schema):
     start_time: datetime
     end_time: datetime
     is_available: bool
+    is_held: bool = False  # Retido temporariamente por outro checkout
 
 class AvailableTimeslotsQuerySchema(Schema):
     provider_id: int
@@ -151,7 +155,120 @@ class AvailableTimeslotsResponseSchema(Schema):
     provider_name: str
     date: date
     timeslots: List[AvailableTimeslotSchema]
+
+class AvailableTimeslotsRangeQuerySchema(Schema):
+    provider_id: int
+    start_date: date
+    end_date: date
+    summary: bool = False
     
+    @validator('end_date')
+    def end_date_after_start_date(cls, v, values):
+        if 'start_date' in values and v < values['start_date']:
+            raise ValueError('A data final deve ser igual ou posterior à data inicial')
+        return v
+
+class AvailableDaySchema(Schema):
+    date: date
+    total_slots: int
+    free_slots: int
+    timeslots: Optional[List[AvailableTimeslotSchema]] = None  # Omitido no modo resumo
+
+class AvailableTimeslotsRangeResponseSchema(Schema):
+    provider_id: int
+    provider_name: str
+    start_date: date
+    end_date: date
+    days: List[AvailableDaySchema]
+
+class ProvidersAvailabilityQuerySchema(Schema):
+    date: date
+    provider_ids: Optional[List[int]] = None
+    service_name: Optional[str] = None
+    only_available: bool = False
+
+class ProviderTimeslotsSchema(Schema):
+    provider_name: str
+    service_name: str
+    timeslots: List[AvailableTimeslotSchema]
+
+class ProvidersAvailabilityResponseSchema(Schema):
+    date: date
+    providers: Dict[int, ProviderTimeslotsSchema]  # {provider_id: horários}
+
+class EarliestTimeslotsQuerySchema(Schema):
+    service_name: Optional[str] = None
+    start_datetime: Optional[datetime] = None
+    end_datetime: Optional[datetime] = None
+    time_from: Optional[time] = None  # Preferência de horário (início)
+    time_to: Optional[time] = None  # Preferência de horário (fim)
+    limit: int = Field(default=5, ge=1, le=50)
+
+class EarliestTimeslotSchema(Schema):
+    provider_id: int
+    provider_name: str
+    service_name: str
+    start_time: datetime
+    end_time: datetime
+
+# Esquemas para retenção de horários no checkout
+class TimeslotHoldCreateSchema(Schema):
+    provider_id: int
+    start_datetime: datetime
+
+class TimeslotHoldOutSchema(Schema):
+    token: str
+    provider_id: int
+    start_datetime: datetime
+    expires_at: datetime
+
+class AvailabilityCacheStatsSchema(Schema):
+    hits: int
+    misses: int
+    hit_ratio: float
+
+class CapacityCalendarQuerySchema(Schema):
+    provider_id: int
+    start_date: date
+    end_date: date
+    only_available: bool = False
+
+    @validator('end_date')
+    def end_date_after_start_date(cls, v, values):
+        if 'start_date' in values and v < values['start_date']:
+            raise ValueError('A data final deve ser igual ou posterior à data inicial')
+        return v
+
+class CapacityDaySchema(Schema):
+    date: date
+    bookings: int
+    capacity_left: int
+
+class CapacityCalendarResponseSchema(Schema):
+    provider_id: int
+    max_daily_bookings: int
+    days: List[CapacityDaySchema]
+
+class BookingHistoryQuerySchema(Schema):
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    page: int = 1
+    page_size: int = Field(default=10, le=100)
+
+class BookingHistorySchema(Schema):
+    id: UUID
+    provider_id: int
+    provider_name: str
+    service_name: str
+    start_datetime: datetime
+    end_datetime: datetime
+    status: str
+    confirmation_code: str
+    notes: str
+    created_at: datetime
+    rating: Optional[int] = None
+    archived: bool
+
 # Esquemas para exportação
 class ExportBookingsQuerySchema(Schema):
     start_date: Optional[date] = None
@@ -0,0 +1,176 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+import logging
+
+from .models import Provider, ProviderAvailability, ProviderBreak, Booking
+from . import cache as cache_disponibilidade
+from . import materializacao
+from . import capacidade
+from . import ciclo_vida
+from .disponibilidade import STATUS_OCUPANTES
+
+logger = logging.getLogger(__name__)
+
+# Campos do prestador que alteram a grade de horários
+CAMPOS_GRADE_PRESTADOR = ('average_service_time', 'interval_between_bookings')
+
+@receiver(post_init, sender=Booking)
+@receiver(post_init, sender=ProviderBreak)
+def guardar_intervalo_original(sender, instance, **kwargs):
+    """Guarda o intervalo carregado do banco para invalidar também as datas antigas."""
+    # Lê do __dict__ para não disparar consultas em campos adiados (.only/.defer)
+    instance._intervalo_original = (
+        instance.__dict__.get('start_datetime'),
+        instance.__dict__.get('end_datetime')
+    )
+
+@receiver(post_init, sender=Booking)
+def guardar_status_original(sender, instance, **kwargs):
+    """Guarda o status e o horário carregados do banco para ajustar capacidade e prazos."""
+    instance._capacidade_original = (instance.__dict__.get('status'), instance.__dict__.get('start_datetime'))
+    instance._ciclo_original = (instance.__dict__.get('status'), instance.__dict__.get('end_datetime'))
+    instance._vaga_original = (
+        instance.__dict__.get('status'),
+        instance.__dict__.get('start_datetime'),
+        instance.__dict__.get('end_datetime')
+    )
+
+@receiver(post_init, sender=Provider)
+def guardar_grade_original(sender, instance, **kwargs):
+    """Guarda os campos de grade carregados do banco."""
+    instance._grade_original = tuple(instance.__dict__.get(campo) for campo in CAMPOS_GRADE_PRESTADOR)
+    instance._materializacao_original = instance.__dict__.get('materialize_slots')
+
+def _datas_afetadas(instance):
+    datas = set()
+    for inicio, fim in (instance._intervalo_original, (instance.start_datetime, instance.end_datetime)):
+        if inicio and fim:
+            datas.update(cache_disponibilidade.datas_do_intervalo(inicio, fim))
+    return datas
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+@receiver(post_save, sender=ProviderBreak)
+@receiver(post_delete, sender=ProviderBreak)
+def invalidar_dias_ocupacao(sender, instance, **kwargs):
+    """Invalida os dias do prestador tocados pela reserva ou pausa (antes e depois da alteração)."""
+    provider_id = instance.provider_id
+    datas = _datas_afetadas(instance)
+    intervalos = [instance._intervalo_original, (instance.start_datetime, instance.end_datetime)]
+    instance._intervalo_original = (instance.start_datetime, instance.end_datetime)
+    # Reservas e pausas costumam ser salvas com o prestador carregado; evita consultá-lo de novo
+    materializado = instance.provider.materialize_slots if sender.provider.is_cached(instance) else None
+
+    # Invalida após o commit e depois de atualizar os horários materializados,
+    # para que uma leitura concorrente não volte a guardar no cache, sob a
+    # geração nova, o estado anterior à alteração
+    def atualizar():
+        materializacao.reavaliar_intervalos(provider_id, intervalos, materializado)
+        cache_disponibilidade.invalidar_dias(provider_id, datas)
+
+    transaction.on_commit(atualizar)
+
+def _dia_ocupado(status, inicio):
+    """Retorna a data local ocupada pela reserva, ou None se ela não conta para a capacidade."""
+    if status in STATUS_OCUPANTES and inicio:
+        return capacidade.data_local(inicio)
+    return None
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def ajustar_capacidade_diaria(sender, instance, created=False, **kwargs):
+    """Ajusta os contadores diários de reservas ativas na criação, cancelamento, mudança de status ou de data."""
+    anterior = None if created else _dia_ocupado(*instance._capacidade_original)
+    atual = None if kwargs.get('signal') is post_delete else _dia_ocupado(instance.status, instance.start_datetime)
+    instance._capacidade_original = (instance.status, instance.start_datetime)
+
+    if anterior == atual:
+        return
+
+    # Ajusta dentro da transação, com o dia do prestador travado, para que a
+    # próxima reserva do mesmo dia já leia o valor novo; desvios de transações
+    # revertidas são corrigidos pela reconciliação periódica
+    try:
+        if anterior:
+            capacidade.ajustar(instance.provider_id, anterior, -1)
+        if atual:
+            capacidade.ajustar(instance.provider_id, atual, 1)
+    except Exception as e:
+        logger.error(f"Erro ao ajustar capacidade diária do prestador {instance.provider_id}: {str(e)}")
+
+@receiver(post_save, sender=Booking)
+def registrar_prazos_reserva(sender, instance, created, **kwargs):
+    """Registra o próximo prazo automático da reserva quando ela é criada ou muda de status ou horário."""
+    atual = (instance.status, instance.end_datetime)
+    if not created and atual == instance._ciclo_original:
+        return
+    instance._ciclo_original = atual
+
+    booking_id, status, created_at, end_datetime = instance.id, instance.status, instance.created_at, instance.end_datetime
+    transaction.on_commit(lambda: ciclo_vida.registrar(booking_id, status, created_at, end_datetime))
+
+@receiver(post_delete, sender=Booking)
+def cancelar_prazos_reserva(sender, instance, **kwargs):
+    """Cancela os prazos pendentes de uma reserva excluída."""
+    booking_id = instance.id
+    transaction.on_commit(lambda: ciclo_vida.cancelar(booking_id))
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def ofertar_horario_liberado(sender, instance, created=False, **kwargs):
+    """Oferece à lista de espera o horário liberado por cancelamento, reagendamento ou exclusão."""
+    status, inicio, fim = instance._vaga_original
+    instance._vaga_original = (instance.status, instance.start_datetime, instance.end_datetime)
+    if created or status not in STATUS_OCUPANTES:
+        return
+
+    excluida = kwargs.get('signal') is post_delete
+    if not excluida and instance.status in STATUS_OCUPANTES and (inicio, fim) == (instance.start_datetime, instance.end_datetime):
+        return
+
+    from .tasks import agendar_oferta_vagas
+    vagas = [[instance.provider_id, inicio.isoformat(), fim.isoformat()]]
+    transaction.on_commit(lambda: agendar_oferta_vagas(vagas))
+
+@receiver(post_save, sender=ProviderAvailability)
+@receiver(post_delete, sender=ProviderAvailability)
+def invalidar_disponibilidade_semanal(sender, instance, **kwargs):
+    """Invalida os dias em cache do prestador quando a disponibilidade semanal muda."""
+    provider_id = instance.provider_id
+    dia_semana = instance.day_of_week
+
+    # Regrava os horários materializados antes de invalidar o cache
+    def atualizar():
+        materializacao.rematerializar_prestador(provider_id, dia_semana)
+        cache_disponibilidade.invalidar_prestador(provider_id)
+
+    transaction.on_commit(atualizar)
+
+@receiver(post_save, sender=Provider)
+def invalidar_grade_prestador(sender, instance, created, **kwargs):
+    """Invalida os dias do prestador quando a grade ou a materialização de horários mudam."""
+    grade = tuple(getattr(instance, campo) for campo in CAMPOS_GRADE_PRESTADOR)
+    grade_alterada = not created and grade != instance._grade_original
+    materializacao_alterada = instance.materialize_slots != bool(instance._materializacao_original)
+
+    instance._grade_original = grade
+    instance._materializacao_original = instance.materialize_slots
+    provider_id = instance.id
+
+    rematerializar = materializacao_alterada or (grade_alterada and instance.materialize_slots)
+
+    transaction.on_commit(lambda: capacidade.invalidar_limite(provider_id))
+
+    if not (grade_alterada or rematerializar):
+        return
+
+    # Regrava (ou remove) os horários materializados antes de invalidar o
+    # cache; ao ligar a materialização, o cache também guardaria os dias
+    # lidos enquanto as linhas ainda não existiam
+    def atualizar():
+        if rematerializar:
+            materializacao.rematerializar_prestador(provider_id)
+        cache_disponibilidade.invalidar_prestador(provider_id)
+
+    transaction.on_commit(atualizar)
\ No newline at end of file
@@ -2,78 +2,144 @@ from celery import shared_task
 from django.utils import timezone
 from datetime import timedelta
 import logging
-from django.db import transaction
 
-from .models import Booking, WaitingList
+from core.travas import execucao_unica
+from .models import Booking
 
 logger = logging.getLogger(__name__)
 
+def _notificar_expiradas(ids):
+    """Grava, na transação do lote, a notificação das reservas canceladas por falta de confirmação."""
+    from notificacoes import outbox
+    from notificacoes.tasks import notificar_cancelamento_reservas_lote
+    
+    # Notifica os usuários do lote em uma única tarefa
+    outbox.enfileirar(
+        notificar_cancelamento_reservas_lote,
+        [[str(booking_id) for booking_id in ids]],
+        {'reason': 'Tempo para confirmação expirado'}
+    )
+
+def _solicitar_avaliacao_concluidas(ids):
+    """Grava, na transação do lote, a solicitação de avaliação das reservas concluídas."""
+    from notificacoes import outbox
+    from notificacoes.tasks import enviar_solicitacao_avaliacao_lote
+    
+    # Atrasa em 1 hora para dar tempo de finalizar o atendimento
+    outbox.enfileirar(
+        enviar_solicitacao_avaliacao_lote,
+        [[str(booking_id) for booking_id in ids]],
+        atraso=3600  # 1 hora
+    )
+
 @shared_task
+@execucao_unica(intervalo_minimo=300)
 def verificar_confirmacoes_reservas():
-    """Verifica e cancela reservas pendentes que não foram confirmadas após 12h."""
-    limite = timezone.now() - timedelta(hours=12)
+    """
+    Verifica e cancela reservas pendentes que não foram confirmadas após 12h.
     
-    # Busca reservas pendentes criadas há mais de 12h
-    reservas = Booking.objects.filter(
-        status='pending',
-        created_at__lt=limite
-    )
+    Varredura de segurança: os prazos normalmente são executados por
+    processar_transicoes_vencidas.
+    """
+    from .transicoes import transicionar_em_lotes
+    
+    limite = timezone.now() - timedelta(hours=12)
     
+    # Cancela em lotes as reservas pendentes criadas há mais de 12h
     contador = 0
-    for reserva in reservas:
-        try:
-            with transaction.atomic():
-                # Atualiza o status da reserva
-                reserva.status = 'canceled'
-                reserva.save(update_fields=['status', 'updated_at'])
-                
-                # Notifica o usuário
-                from notificacoes.tasks import notificar_cancelamento_reserva
-                notificar_cancelamento_reserva.delay(
-                    str(reserva.id),
-                    reason='Tempo para confirmação expirado'
-                )
-                
-                contador += 1
-        
-        except Exception as e:
-            logger.error(f"Erro ao cancelar reserva {reserva.id}: {str(e)}")
+    for ids in transicionar_em_lotes(
+        ['pending'], 'canceled',
+        ao_alterar=_notificar_expiradas,
+        created_at__lt=limite
+    ):
+        contador += len(ids)
     
     return f"Canceladas {contador} reservas não confirmadas."
 
 @shared_task
+@execucao_unica(intervalo_minimo=300)
 def verificar_reservas_concluidas():
-    """Marca como concluídas as reservas que já passaram."""
+    """
+    Marca como concluídas as reservas que já passaram.
+    
+    Varredura de segurança: os prazos normalmente são executados por
+    processar_transicoes_vencidas.
+    """
+    from .transicoes import transicionar_em_lotes
+    
     agora = timezone.now()
     
-    # Busca reservas confirmadas com horário de término no passado
-    reservas = Booking.objects.filter(
-        status='confirmed',
+    # Conclui em lotes as reservas confirmadas com horário de término no passado
+    contador = 0
+    for ids in transicionar_em_lotes(
+        ['confirmed'], 'completed',
+        ao_alterar=_solicitar_avaliacao_concluidas,
         end_datetime__lt=agora
-    )
+    ):
+        contador += len(ids)
     
-    contador = 0
-    for reserva in reservas:
+    return f"Concluídas {contador} reservas."
+
+@shared_task
+@execucao_unica()
+def processar_transicoes_vencidas(limite=1000):
+    """Executa as transições de reservas cujo prazo venceu (expiração, conclusão e avaliação)."""
+    from . import ciclo_vida
+    from .transicoes import transicionar_em_lotes
+    from notificacoes import outbox
+    from notificacoes.tasks import enviar_solicitacao_avaliacao_lote
+    
+    agora = timezone.now()
+    contadores = {ciclo_vida.EXPIRAR: 0, ciclo_vida.CONCLUIR: 0, ciclo_vida.AVALIAR: 0}
+    
+    # Processa apenas as reservas vencidas, em lotes de até `limite` ids
+    while True:
+        ids = ciclo_vida.reivindicar(ciclo_vida.EXPIRAR, agora, limite)
+        if not ids:
+            break
+        # O status anterior e o prazo são conferidos de novo no UPDATE
+        for cancelados in transicionar_em_lotes(
+            ['pending'], 'canceled',
+            ao_alterar=_notificar_expiradas,
+            ao_falhar=lambda falhos: ciclo_vida.devolver(ciclo_vida.EXPIRAR, falhos),
+            id__in=ids,
+            created_at__lte=agora - ciclo_vida.PRAZO_CONFIRMACAO
+        ):
+            contadores[ciclo_vida.EXPIRAR] += len(cancelados)
+    
+    while True:
+        ids = ciclo_vida.reivindicar(ciclo_vida.CONCLUIR, agora, limite)
+        if not ids:
+            break
+        for concluidos in transicionar_em_lotes(
+            ['confirmed'], 'completed',
+            ao_falhar=lambda falhos: ciclo_vida.devolver(ciclo_vida.CONCLUIR, falhos),
+            id__in=ids,
+            end_datetime__lte=agora
+        ):
+            # Agenda a solicitação de avaliação para 1 hora após a conclusão
+            prazo = timezone.now() + ciclo_vida.ATRASO_AVALIACAO
+            ciclo_vida.agendar(ciclo_vida.AVALIAR, {booking_id: prazo for booking_id in concluidos})
+            contadores[ciclo_vida.CONCLUIR] += len(concluidos)
+    
+    while True:
+        ids = ciclo_vida.reivindicar(ciclo_vida.AVALIAR, agora, limite)
+        if not ids:
+            break
+        # Os ids já saíram do Redis; a caixa de saída garante que a solicitação não se perca
         try:
-            with transaction.atomic():
-                # Atualiza o status da reserva
-                reserva.status = 'completed'
-                reserva.save(update_fields=['status', 'updated_at'])
-                
-                # Envia solicitação de avaliação
-                from notificacoes.tasks import enviar_solicitacao_avaliacao
-                # Atrasa em 1 hora para dar tempo de finalizar o atendimento
-                enviar_solicitacao_avaliacao.apply_async(
-                    args=[str(reserva.id)],
-                    countdown=3600  # 1 hora
-                )
-                
-                contador += 1
-        
+            outbox.enfileirar(enviar_solicitacao_avaliacao_lote, [ids])
         except Exception as e:
-            logger.error(f"Erro ao concluir reserva {reserva.id}: {str(e)}")
+            logger.error(f"Erro ao enfileirar solicitações de avaliação: {str(e)}")
+            ciclo_vida.devolver(ciclo_vida.AVALIAR, ids)
+            break
+        contadores[ciclo_vida.AVALIAR] += len(ids)
     
-    return f"Concluídas {contador} reservas."
+    return (
+        f"Expiradas {contadores[ciclo_vida.EXPIRAR]} reservas, "
+        f"concluídas {contadores[ciclo_vida.CONCLUIR]} e "
+        f"{contadores[ciclo_vida.AVALIAR]} solicitações de avaliação enviadas."
+    )
 
 @shared_task
 def verificar_conflitos_reservas(booking_id):
@@ -109,32 +175,104 @@ def verificar_conflitos_reservas(booking_id):
             'erro': str(e)
         }
 
+# Quantidade máxima de pares detalhados nos dados do relatório de auditoria
+MAX_PARES_RELATORIO = 1000
+
 @shared_task
+@execucao_unica(intervalo_minimo=3600)
+def auditar_conflitos_reservas():
+    """Audita todas as reservas ativas em busca de horários sobrepostos e gera um relatório."""
+    from django.contrib.auth import get_user_model
+    from admin_dashboard.models import Report
+    from core.metricas import definir
+    from core.utils import generate_csv_file, format_datetime
+    from django.core.files.base import ContentFile
+    from .auditoria import encontrar_conflitos
+    from .disponibilidade import STATUS_OCUPANTES
+    import time
+    
+    User = get_user_model()
+    inicio_execucao = time.monotonic()
+    agora = timezone.now()
+    
+    try:
+        # Uma consulta ordenada por prestador e início, lida em blocos
+        linhas = Booking.objects.filter(
+            status__in=STATUS_OCUPANTES
+        ).order_by('provider_id', 'start_datetime').values_list(
+            'id', 'provider_id', 'start_datetime', 'end_datetime'
+        ).iterator(chunk_size=5000)
+        
+        pares = [
+            [str(id_a), str(id_b), provider_id, inicio.isoformat(), fim.isoformat()]
+            for provider_id, id_a, id_b, inicio, fim in encontrar_conflitos(linhas)
+        ]
+        prestadores_afetados = len({par[2] for par in pares})
+        duracao = time.monotonic() - inicio_execucao
+        
+        definir({
+            'auditoria_conflitos.pares': len(pares),
+            'auditoria_conflitos.prestadores_afetados': prestadores_afetados,
+            'auditoria_conflitos.duracao_segundos': round(duracao, 3),
+            'auditoria_conflitos.executado_em': int(agora.timestamp())
+        })
+        
+        # O relatório é registrado em nome do primeiro administrador ativo
+        admin = User.objects.filter(user_type='admin', is_active=True).order_by('id').first()
+        if not admin:
+            logger.error("Nenhum administrador ativo para registrar o relatório de auditoria de conflitos.")
+            return f"Encontrados {len(pares)} pares de reservas sobrepostas."
+        
+        report = Report.objects.create(
+            title=f"Auditoria de conflitos de reservas - {format_datetime(timezone.localtime(agora))}",
+            type='daily',
+            format='csv',
+            start_date=timezone.localdate(),
+            end_date=timezone.localdate(),
+            created_by=admin,
+            data={
+                'total_pares': len(pares),
+                'prestadores_afetados': prestadores_afetados,
+                'duracao_segundos': round(duracao, 3),
+                'pares': pares[:MAX_PARES_RELATORIO]
+            }
+        )
+        
+        if pares:
+            arquivo = generate_csv_file(pares, ['Reserva A', 'Reserva B', 'Prestador', 'Início da sobreposição', 'Fim da sobreposição'])
+            report.file.save(f"auditoria_conflitos_{agora.strftime('%Y%m%d')}.csv", ContentFile(arquivo.getvalue()))
+        
+        return f"Encontrados {len(pares)} pares de reservas sobrepostas em {prestadores_afetados} prestadores."
+    
+    except Exception as e:
+        logger.error(f"Erro ao auditar conflitos de reservas: {str(e)}")
+        return f"Erro ao auditar conflitos de reservas: {str(e)}"
+
+@shared_task
+@execucao_unica(intervalo_minimo=3600)
 def arquivar_reservas_antigas():
-    """Arquiva reservas muito antigas."""
-    limite = timezone.now() - timedelta(days=365)  # 1 ano
+    """Move as reservas muito antigas para a tabela de arquivo."""
+    from .arquivamento import mover_lote
     
-    # Busca reservas antigas
-    reservas = Booking.objects.filter(
-        status__in=['completed', 'canceled'],
-        end_datetime__lt=limite
-    )
+    limite = timezone.now() - timedelta(days=365)  # 1 ano
     
+    # Move em lotes as reservas finalizadas há mais de um ano
     contador = 0
-    for reserva in reservas:
+    while True:
         try:
-            reserva.status = 'archived'
-            reserva.save(update_fields=['status', 'updated_at'])
-            contador += 1
-        
+            movidas = mover_lote(limite)
         except Exception as e:
-            logger.error(f"Erro ao arquivar reserva {reserva.id}: {str(e)}")
+            logger.error(f"Erro ao arquivar lote de reservas antigas: {str(e)}")
+            break
+        if not movidas:
+            break
+        contador += movidas
     
     return f"Arquivadas {contador} reservas antigas."
 
 @shared_task
 def notificar_lista_espera_apos_cancelamento(booking_id):
-    """Notifica usuários na lista de espera quando uma reserva é cancelada."""
+    """Oferece o horário de uma reserva cancelada aos usuários da lista de espera."""
     try:
         reserva = Booking.objects.get(id=booking_id)
         
@@ -142,21 +280,9 @@ def notificar_lista_espera_apos_cancelamento(booking_id):
         if reserva.status != 'canceled':
             return f"Reserva {booking_id} não está cancelada."
         
-        # Busca usuários na lista de espera para esta data e prestador
-        lista_espera = WaitingList.objects.filter(
-            provider=reserva.provider,
-            desired_date=reserva.start_datetime.date(),
-            is_notified=False
-        )
-        
-        if not lista_espera.exists():
-            return f"Nenhum usuário na lista de espera para a data da reserva {booking_id}."
-        
-        # Notifica usuários
-        from notificacoes.tasks import notificar_vagas_lista_espera
-        notificar_vagas_lista_espera.delay()
-        
-        return f"Processo de notificação de lista de espera iniciado para {lista_espera.count()} usuários."
+        return ofertar_vagas_lista_espera([
+            [reserva.provider_id, reserva.start_datetime.isoformat(), reserva.end_datetime.isoformat()]
+        ])
     
     except Booking.DoesNotExist:
         return f"Reserva {booking_id} não encontrada."
@@ -164,18 +290,116 @@ def notificar_lista_espera_apos_cancelamento(booking_id):
         logger.error(f"Erro ao notificar lista de espera: {str(e)}")
         return f"Erro ao notificar lista de espera: {str(e)}"
 
+# Janela (segundos) em que cancelamentos do mesmo prestador são agrupados
+JANELA_LISTA_ESPERA = 30
+
+def agendar_oferta_vagas(vagas):
+    """Agenda a oferta de intervalos liberados, agrupando os disparos de cada prestador na janela."""
+    from core.coalescencia import agendar_coalescido
+    
+    por_prestador = {}
+    for vaga in vagas:
+        por_prestador.setdefault(vaga[0], []).append(vaga)
+    for provider_id, vagas_prestador in por_prestador.items():
+        agendar_coalescido(ofertar_vagas_lista_espera, str(provider_id), vagas_prestador, janela=JANELA_LISTA_ESPERA)
+
+@shared_task
+def ofertar_vagas_lista_espera(vagas=None, chave_coalescencia=None):
+    """
+    Oferece intervalos liberados [provider_id, início, fim] à lista de espera.
+    
+    Apenas os horários efetivamente livres dentro de cada intervalo são
+    oferecidos, um usuário por horário, respeitando a preferência de horário.
+    Quando agendada por agendar_oferta_vagas, processa de uma vez todos os
+    intervalos acumulados na janela.
+    """
+    from .models import Provider
+    from .lista_espera import ofertar_vagas
+    from core.coalescencia import consumir_itens
+    from notificacoes.tasks import criar_notificacoes, despachar_envios
+    from django.db import transaction
+    from collections import defaultdict
+    from datetime import datetime
+    
+    if chave_coalescencia is not None:
+        vagas = consumir_itens(ofertar_vagas_lista_espera, chave_coalescencia)
+    
+    # Agrupa os intervalos por prestador e data
+    intervalos = defaultdict(list)
+    for provider_id, inicio, fim in vagas or []:
+        inicio = datetime.fromisoformat(inicio)
+        fim = datetime.fromisoformat(fim)
+        intervalos[(provider_id, timezone.localtime(inicio).date())].append((inicio, fim))
+    
+    contador = 0
+    for (provider_id, data), liberados in intervalos.items():
+        try:
+            provider = Provider.objects.select_related('user').get(id=provider_id)
+            slots = calcular_horarios_disponiveis(provider_id, data)
+            if isinstance(slots, str):
+                logger.error(f"Erro ao ofertar vagas do prestador {provider_id}: {slots}")
+                continue
+            
+            # Horários livres que se sobrepõem a algum intervalo liberado
+            livres = [
+                slot for slot in slots
+                if slot['is_available'] and any(
+                    slot['start_time'] < fim and slot['end_time'] > inicio for inicio, fim in liberados
+                )
+            ]
+            
+            # As entradas só ficam como notificadas se as ofertas forem gravadas na mesma transação
+            with transaction.atomic():
+                ofertas = ofertar_vagas(provider_id, data, livres)
+                notificacoes = criar_notificacoes([
+                    {
+                        'recipient_id': entrada.user_id,
+                        'notification_type': 'waiting_list',
+                        'object_id': str(entrada.id),
+                        'entity_type': 'WaitingList',
+                        'content_object': entrada,
+                        'context': {
+                            'waiting_list': {
+                                'service_name': provider.service_name,
+                                'provider_name': provider.user.get_full_name(),
+                                'date': timezone.localtime(slot['start_time']).strftime('%d/%m/%Y'),
+                                'time': timezone.localtime(slot['start_time']).strftime('%H:%M')
+                            }
+                        }
+                    }
+                    for entrada, slot in ofertas
+                ])
+                despachar_envios(notificacoes)
+            contador += len(ofertas)
+        
+        except Exception as e:
+            logger.error(f"Erro ao ofertar vagas do prestador {provider_id}: {str(e)}")
+    
+    return f"Enviadas {contador} ofertas de vagas para a lista de espera."
+
 @shared_task
 def calcular_horarios_disponiveis(provider_id, data):
     """Calcula os horários disponíveis para um prestador em uma data específica."""
-    from .models import Provider, ProviderAvailability, ProviderBreak
-    from datetime import datetime, time, date
-    import pytz
+    from .models import Provider, ProviderAvailability
+    from .disponibilidade import janela_do_dia, carregar_ocupacoes, varrer_slots
+    from .materializacao import dentro_do_horizonte, ler_slots_materializados
+    from .retencoes import marcar_retidos
+    from .capacidade import dia_lotado, aplicar_lotacao
+    from . import cache as cache_disponibilidade
+    from datetime import datetime
     
     try:
         # Converte a data se for uma string
         if isinstance(data, str):
             data = datetime.strptime(data, '%Y-%m-%d').date()
         
+        # Consulta o cache antes de acessar o banco. A versão do dia é lida antes
+        # do cálculo para que uma invalidação concorrente descarte este resultado
+        versoes = cache_disponibilidade.obter_versoes([(provider_id, data)])
+        em_cache = cache_disponibilidade.obter_slots(versoes)
+        if (provider_id, data) in em_cache:
+            return aplicar_lotacao(marcar_retidos(provider_id, data, em_cache[(provider_id, data)]), dia_lotado(provider_id, data))
+        
         # Obtém o prestador
         provider = Provider.objects.get(id=provider_id)
         
@@ -190,56 +414,276 @@ def calcular_horarios_disponiveis(provider_id, data):
                 is_available=True
             )
         except ProviderAvailability.DoesNotExist:
-            return []
+            slots = []
+        else:
+            # Combina data e hora para criar datetimes
+            dt_inicio, dt_fim = janela_do_dia(data, disponibilidade.start_time, disponibilidade.end_time)
+            
+            slots = None
+            if provider.materialize_slots and dentro_do_horizonte(data):
+                # Prestadores de alto volume leem os horários materializados (uma consulta por faixa);
+                # um dia que entrou no horizonte e ainda não foi materializado segue para a varredura
+                slots = ler_slots_materializados(provider, dt_inicio, dt_fim) or None
+            if slots is None:
+                # Carrega reservas e pausas do dia de uma só vez (uma consulta cada)
+                ocupados = carregar_ocupacoes(provider, dt_inicio, dt_fim)
+                
+                # Percorre os slots e os intervalos ocupados em uma única passada
+                slots = varrer_slots(
+                    dt_inicio,
+                    dt_fim,
+                    provider.average_service_time,
+                    provider.interval_between_bookings,
+                    ocupados
+                )
         
-        # Obtém o horário de início e fim
-        hora_inicio = disponibilidade.start_time
-        hora_fim = disponibilidade.end_time
+        cache_disponibilidade.salvar_slots(versoes, {(provider_id, data): slots})
         
-        # Combina data e hora para criar datetimes
-        tz = pytz.timezone('America/Sao_Paulo')
-        dt_inicio = tz.localize(datetime.combine(data, hora_inicio))
-        dt_fim = tz.localize(datetime.combine(data, hora_fim))
+        # Retenções de checkout e lotação diária são aplicadas após o cache, pois mudam a cada reserva
+        slots = marcar_retidos(provider_id, data, slots)
+        return aplicar_lotacao(slots, dia_lotado(provider_id, data, provider.max_daily_bookings))
+    
+    except Provider.DoesNotExist:
+        return f"Prestador {provider_id} não encontrado."
+    except Exception as e:
+        logger.error(f"Erro ao calcular horários disponíveis: {str(e)}")
+        return f"Erro ao calcular horários disponíveis: {str(e)}"
+
+# Limite de dias por consulta de período
+MAX_DIAS_PERIODO = 62
+
+@shared_task
+def calcular_horarios_disponiveis_periodo(provider_id, data_inicio, data_fim, resumo=False):
+    """Calcula os horários disponíveis de um prestador para cada dia de um período."""
+    from .models import Provider
+    from .disponibilidade import calcular_slots_periodo
+    from .retencoes import retidos_por_dia, aplicar_retencoes
+    from . import capacidade
+    from . import cache as cache_disponibilidade
+    from datetime import datetime, timedelta
+    
+    try:
+        # Converte as datas se forem strings
+        if isinstance(data_inicio, str):
+            data_inicio = datetime.strptime(data_inicio, '%Y-%m-%d').date()
+        if isinstance(data_fim, str):
+            data_fim = datetime.strptime(data_fim, '%Y-%m-%d').date()
         
-        # Duração de cada slot (tempo de atendimento + intervalo)
-        duracao_slot = timedelta(minutes=provider.average_service_time + provider.interval_between_bookings)
+        if data_fim < data_inicio:
+            return "A data final deve ser igual ou posterior à data inicial."
+        if (data_fim - data_inicio).days >= MAX_DIAS_PERIODO:
+            return f"O período não pode exceder {MAX_DIAS_PERIODO} dias."
         
-        # Gera slots possíveis
-        slots = []
-        slot_inicio = dt_inicio
+        provider = Provider.objects.get(id=provider_id)
         
-        while slot_inicio + duracao_slot <= dt_fim:
-            slot_fim = slot_inicio + timedelta(minutes=provider.average_service_time)
-            
-            # Verifica reservas existentes
-            conflito = Booking.objects.filter(
-                provider=provider,
-                status__in=['confirmed', 'pending'],
-                start_datetime__lt=slot_fim,
-                end_datetime__gt=slot_inicio
-            ).exists()
-            
-            # Verifica pausas
-            pausa = ProviderBreak.objects.filter(
-                provider=provider,
-                start_datetime__lt=slot_fim,
-                end_datetime__gt=slot_inicio
-            ).exists()
-            
-            # Adiciona slot se disponível
-            slots.append({
-                'start_time': slot_inicio,
-                'end_time': slot_fim,
-                'is_available': not (conflito or pausa)
-            })
-            
-            # Avança para o próximo slot
-            slot_inicio += duracao_slot
+        # Busca no cache todos os dias do período e calcula apenas os faltantes
+        datas = [data_inicio + timedelta(days=i) for i in range((data_fim - data_inicio).days + 1)]
+        versoes = cache_disponibilidade.obter_versoes((provider.id, data) for data in datas)
+        slots_por_data = {data: slots for (_, data), slots in cache_disponibilidade.obter_slots(versoes).items()}
+        
+        faltantes = [data for data in datas if data not in slots_por_data]
+        if faltantes:
+            calculados = dict(calcular_slots_periodo(provider, faltantes[0], faltantes[-1]))
+            cache_disponibilidade.salvar_slots(versoes, {(provider.id, data): calculados[data] for data in faltantes})
+            slots_por_data.update(calculados)
+        
+        retidos = retidos_por_dia((provider.id, data) for data in datas)
+        ocupadas = capacidade.obter((provider.id, data) for data in datas)
         
-        return slots
+        dias = []
+        for data in datas:
+            slots = aplicar_retencoes(slots_por_data[data], retidos[(provider.id, data)])
+            slots = capacidade.aplicar_lotacao(slots, ocupadas[(provider.id, data)] >= provider.max_daily_bookings)
+            dia = {
+                'date': data,
+                'total_slots': len(slots),
+                'free_slots': sum(1 for slot in slots if slot['is_available'])
+            }
+            # No modo resumo retorna apenas as contagens por dia
+            if not resumo:
+                dia['timeslots'] = slots
+            dias.append(dia)
+        
+        return dias
     
     except Provider.DoesNotExist:
         return f"Prestador {provider_id} não encontrado."
     except Exception as e:
-        logger.error(f"Erro ao calcular horários disponíveis: {str(e)}")
-        return f"Erro ao calcular horários disponíveis: {str(e)}" 
\ No newline at end of file
+        logger.error(f"Erro ao calcular horários disponíveis do período: {str(e)}")
+        return f"Erro ao calcular horários disponíveis do período: {str(e)}"
+
+# Limite de prestadores por consulta em lote
+MAX_PRESTADORES_LOTE = 500
+
+@shared_task
+def calcular_horarios_disponiveis_prestadores(data, provider_ids=None, service_name=None, apenas_livres=False):
+    """Calcula os horários disponíveis de vários prestadores ativos em uma data específica."""
+    from .models import Provider
+    from .disponibilidade import calcular_slots_prestadores
+    from .retencoes import retidos_por_dia, aplicar_retencoes
+    from . import capacidade
+    from . import cache as cache_disponibilidade
+    from datetime import datetime
+    
+    try:
+        # Converte a data se for uma string
+        if isinstance(data, str):
+            data = datetime.strptime(data, '%Y-%m-%d').date()
+        
+        # Seleciona os prestadores por id ou por filtro
+        providers = Provider.objects.filter(active=True).select_related('user')
+        if provider_ids:
+            providers = providers.filter(id__in=provider_ids)
+        if service_name:
+            providers = providers.filter(service_name__icontains=service_name)
+        providers = list(providers.order_by('id')[:MAX_PRESTADORES_LOTE])
+        
+        # Busca no cache e calcula em lote apenas os prestadores faltantes
+        versoes = cache_disponibilidade.obter_versoes((provider.id, data) for provider in providers)
+        slots_por_prestador = {provider_id: slots for (provider_id, _), slots in cache_disponibilidade.obter_slots(versoes).items()}
+        
+        faltantes = [provider for provider in providers if provider.id not in slots_por_prestador]
+        if faltantes:
+            calculados = calcular_slots_prestadores(faltantes, data)
+            cache_disponibilidade.salvar_slots(versoes, {(provider_id, data): slots for provider_id, slots in calculados.items()})
+            slots_por_prestador.update(calculados)
+        
+        retidos = retidos_por_dia((provider.id, data) for provider in providers)
+        ocupadas = capacidade.obter((provider.id, data) for provider in providers)
+        
+        resultado = {}
+        for provider in providers:
+            slots = aplicar_retencoes(slots_por_prestador[provider.id], retidos[(provider.id, data)])
+            slots = capacidade.aplicar_lotacao(slots, ocupadas[(provider.id, data)] >= provider.max_daily_bookings)
+            if apenas_livres:
+                slots = [slot for slot in slots if slot['is_available']]
+            resultado[provider.id] = {
+                'provider_name': provider.user.get_full_name(),
+                'service_name': provider.service_name,
+                'timeslots': slots
+            }
+        
+        return resultado
+    
+    except Exception as e:
+        logger.error(f"Erro ao calcular horários disponíveis dos prestadores: {str(e)}")
+        return f"Erro ao calcular horários disponíveis dos prestadores: {str(e)}"
+
+@shared_task
+@execucao_unica(intervalo_minimo=3600)
+def avancar_horizonte_slots():
+    """Avança o horizonte dos horários materializados dos prestadores de alto volume."""
+    from .models import Provider
+    from .materializacao import avancar_horizonte
+    
+    contador = 0
+    for provider in Provider.objects.filter(materialize_slots=True, active=True):
+        try:
+            contador += avancar_horizonte(provider)
+        except Exception as e:
+            logger.error(f"Erro ao avançar horizonte de horários do prestador {provider.id}: {str(e)}")
+    
+    return f"Materializados {contador} novos horários."
+
+@shared_task
+@execucao_unica(intervalo_minimo=3600)
+def recalcular_disponibilidade_em_massa(dias=60, tamanho_lote=200):
+    """
+    Recalcula e grava em cache a disponibilidade dos prestadores ativos para os próximos dias.
+    
+    Prestadores com horários materializados ficam de fora: o cache deles é
+    preenchido a partir de ProviderSlot na primeira consulta.
+    """
+    from .models import Provider
+    from .ocupacao import calcular_slots_em_massa
+    from . import cache as cache_disponibilidade
+    
+    data_inicio = timezone.localdate()
+    data_fim = data_inicio + timedelta(days=dias - 1)
+    
+    contador = 0
+    ultimo_id = 0
+    while True:
+        # Percorre os prestadores em lotes ordenados por id
+        providers = list(Provider.objects.filter(
+            active=True,
+            materialize_slots=False,
+            id__gt=ultimo_id
+        ).order_by('id')[:tamanho_lote])
+        if not providers:
+            break
+        ultimo_id = providers[-1].id
+        
+        try:
+            datas = [data_inicio + timedelta(days=i) for i in range(dias)]
+            versoes = cache_disponibilidade.obter_versoes((provider.id, data) for provider in providers for data in datas)
+            for provider_id, slots_por_data in calcular_slots_em_massa(providers, data_inicio, data_fim).items():
+                cache_disponibilidade.salvar_slots(versoes, {(provider_id, data): slots for data, slots in slots_por_data.items()})
+                contador += 1
+        except Exception as e:
+            logger.error(f"Erro ao recalcular disponibilidade do lote até o prestador {ultimo_id}: {str(e)}")
+    
+    return f"Disponibilidade recalculada para {contador} prestadores em {dias} dias."
+
+@shared_task
+@execucao_unica(intervalo_minimo=600)
+def reconciliar_capacidade_diaria(dias=MAX_DIAS_PERIODO):
+    """Regrava os contadores diários de reservas ativas a partir do banco de dados."""
+    from .capacidade import reconciliar
+    
+    # Inclui o dia anterior, cujos contadores ainda não expiraram
+    data_inicio = timezone.localdate() - timedelta(days=1)
+    data_fim = timezone.localdate() + timedelta(days=dias)
+    
+    try:
+        contador = reconciliar(data_inicio, data_fim)
+        return f"Reconciliados {contador} contadores de capacidade diária."
+    except Exception as e:
+        logger.error(f"Erro ao reconciliar capacidade diária: {str(e)}")
+        return f"Erro ao reconciliar capacidade diária: {str(e)}"
+
+# Limite de horários retornados pela busca dos próximos horários
+MAX_HORARIOS_BUSCA = 50
+
+@shared_task
+def buscar_primeiros_horarios_disponiveis(service_name=None, inicio=None, fim=None, limite=5, hora_minima=None, hora_maxima=None):
+    """Busca os primeiros horários livres entre os prestadores ativos de um serviço."""
+    from .models import Provider
+    from .busca import buscar_primeiros_horarios
+    from datetime import datetime
+    
+    try:
+        # Converte os parâmetros se forem strings
+        if isinstance(inicio, str):
+            inicio = datetime.fromisoformat(inicio)
+        if isinstance(fim, str):
+            fim = datetime.fromisoformat(fim)
+        if isinstance(hora_minima, str):
+            hora_minima = datetime.strptime(hora_minima, '%H:%M').time()
+        if isinstance(hora_maxima, str):
+            hora_maxima = datetime.strptime(hora_maxima, '%H:%M').time()
+        
+        inicio = inicio or timezone.now()
+        if timezone.is_naive(inicio):
+            inicio = timezone.make_aware(inicio)
+        fim = fim or inicio + timedelta(days=MAX_DIAS_PERIODO)
+        if timezone.is_naive(fim):
+            fim = timezone.make_aware(fim)
+        fim = min(fim, inicio + timedelta(days=MAX_DIAS_PERIODO))
+        
+        providers = Provider.objects.filter(active=True).select_related('user')
+        if service_name:
+            providers = providers.filter(service_name__icontains=service_name)
+        
+        return buscar_primeiros_horarios(
+            list(providers),
+            inicio,
+            fim,
+            min(limite, MAX_HORARIOS_BUSCA),
+            hora_minima=hora_minima,
+            hora_maxima=hora_maxima
+        )
+    
+    except Exception as e:
+        logger.error(f"Erro ao buscar próximos horários disponíveis: {str(e)}")
+        return f"Erro ao buscar próximos horários disponíveis: {str(e)}"
\ No newline at end of file
@@ -1,3 +1,972 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from admin_dashboard.tasks import gerar_estatisticas_dashboard
+from avaliacoes.models import Review, ReviewResponse
+from core.redis import get_redis_client
+from core.suporte_testes import CACHE_LOCAL, RedisIsoladoMixin
+from notificacoes.models import OutboxMessage
+from .models import (
+    Booking, BookingArchive, Provider, ProviderAvailability, ProviderBreak, ProviderDayLock, ProviderSlot, WaitingList
+)
+from .agendamento import ConflitoReservaError, criar_reserva, reagendar_reserva
+from . import cache as cache_disponibilidade, capacidade, ciclo_vida, materializacao, retencoes, tasks, transicoes
+from .arquivamento import historico_reservas, mover_lote
+from .auditoria import encontrar_conflitos
+from .lista_espera import interpretar_preferencia, ofertar_vagas, preferencia_cobre
+from .busca import buscar_primeiros_horarios
+from .transicoes import transicionar_em_lotes
+from .ocupacao import calcular_slots_em_massa
+from .disponibilidade import (
+    STATUS_OCUPANTES, calcular_slots_periodo, calcular_slots_prestadores, carregar_ocupacoes,
+    janela_do_dia, varrer_slots
+)
+
+User = get_user_model()
+
+class RedisReservasMixin(RedisIsoladoMixin):
+    """Isola no Redis os contadores de capacidade, os prazos e as retenções."""
+
+    modulos_redis = (capacidade, ciclo_vida, retencoes)
+
+def proxima_segunda():
+    """Retorna a próxima segunda-feira (entre 1 e 7 dias à frente)."""
+    hoje = timezone.localdate()
+    return hoje + timedelta(days=7 - hoje.weekday())
+
+def no_dia(data, hora, minuto=0):
+    """Retorna o instante local `hora:minuto` da data."""
+    return timezone.make_aware(datetime.combine(data, time(hora, minuto)))
+
+def criar_prestador(email, dias=range(7), inicio=time(9), fim=time(13), **campos):
+    """Cria um prestador que atende de `inicio` a `fim` nos dias da semana informados."""
+    usuario = User.objects.create_user(email, first_name='Ana', last_name='Souza')
+    campos = {'service_name': 'Corte', 'average_service_time': 30, 'interval_between_bookings': 10, **campos}
+    provider = Provider.objects.create(user=usuario, **campos)
+    ProviderAvailability.objects.bulk_create([
+        ProviderAvailability(provider=provider, day_of_week=dia, start_time=inicio, end_time=fim)
+        for dia in dias
+    ])
+    return provider
+
+def reservar(provider, cliente, inicio, fim, status='confirmed'):
+    """Grava uma reserva sem disparar os sinais de Booking, que dependem do Redis."""
+    return Booking.objects.bulk_create([Booking(
+        user=cliente,
+        provider=provider,
+        start_datetime=inicio,
+        end_datetime=fim,
+        status=status,
+        confirmation_code=get_random_string(8).upper()
+    )])[0]
+
+def slots_por_consulta(provider, data):
+    """Cálculo anterior à varredura, com uma consulta de reservas e uma de pausas por slot."""
+    disponibilidade = ProviderAvailability.objects.filter(
+        provider=provider,
+        day_of_week=data.weekday(),
+        is_available=True
+    ).first()
+    if not disponibilidade:
+        return []
+
+    dt_inicio, dt_fim = janela_do_dia(data, disponibilidade.start_time, disponibilidade.end_time)
+    duracao_slot = timedelta(minutes=provider.average_service_time + provider.interval_between_bookings)
+
+    slots = []
+    slot_inicio = dt_inicio
+    while slot_inicio + duracao_slot <= dt_fim:
+        slot_fim = slot_inicio + timedelta(minutes=provider.average_service_time)
+        conflito = Booking.objects.filter(
+            provider=provider,
+            status__in=STATUS_OCUPANTES,
+            start_datetime__lt=slot_fim,
+            end_datetime__gt=slot_inicio
+        ).exists()
+        pausa = ProviderBreak.objects.filter(
+            provider=provider,
+            start_datetime__lt=slot_fim,
+            end_datetime__gt=slot_inicio
+        ).exists()
+        slots.append({'start_time': slot_inicio, 'end_time': slot_fim, 'is_available': not (conflito or pausa)})
+        slot_inicio += duracao_slot
+    return slots
+
+class VarreduraSlotsTest(TestCase):
+    """Compara a varredura única com o cálculo anterior, que consultava o banco a cada slot."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com')
+        cls.cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+
+        # Slots de 30 minutos a cada 40: 09:00, 09:40, 10:20, 11:00, 11:40 e 12:20
+        reservar(cls.provider, cls.cliente, no_dia(cls.data, 8, 30), no_dia(cls.data, 9))
+        reservar(cls.provider, cls.cliente, no_dia(cls.data, 9, 30), no_dia(cls.data, 9, 40))
+        # Reservas coladas ocupando dois slots
+        reservar(cls.provider, cls.cliente, no_dia(cls.data, 10, 5), no_dia(cls.data, 10, 20))
+        reservar(cls.provider, cls.cliente, no_dia(cls.data, 10, 20), no_dia(cls.data, 10, 35))
+        reservar(cls.provider, cls.cliente, no_dia(cls.data, 12, 20), no_dia(cls.data, 12, 50), status='canceled')
+        ProviderBreak.objects.bulk_create([
+            ProviderBreak(provider=cls.provider, start_datetime=no_dia(cls.data, 11, 30), end_datetime=no_dia(cls.data, 11, 40)),
+            ProviderBreak(provider=cls.provider, start_datetime=no_dia(cls.data, 11, 50), end_datetime=no_dia(cls.data, 12)),
+        ])
+
+    def _varrer(self):
+        dt_inicio, dt_fim = janela_do_dia(self.data, time(9), time(13))
+        return varrer_slots(dt_inicio, dt_fim, 30, 10, carregar_ocupacoes(self.provider, dt_inicio, dt_fim))
+
+    def test_igual_ao_calculo_por_slot(self):
+        self.assertEqual(self._varrer(), slots_por_consulta(self.provider, self.data))
+
+    def test_reservas_coladas_pausas_e_limites(self):
+        slots = self._varrer()
+
+        self.assertEqual(
+            [(timezone.localtime(slot['start_time']).strftime('%H:%M'), slot['is_available']) for slot in slots],
+            [('09:00', True), ('09:40', False), ('10:20', False), ('11:00', True), ('11:40', False), ('12:20', True)]
+        )
+
+    def test_ocupacoes_lidas_em_duas_consultas(self):
+        dt_inicio, dt_fim = janela_do_dia(self.data, time(9), time(13))
+
+        # Uma consulta de reservas e uma de pausas, independente da quantidade de slots
+        with self.assertNumQueries(2):
+            ocupados = carregar_ocupacoes(self.provider, dt_inicio, dt_fim)
+
+        # Intervalos ordenados e mesclados; a reserva que termina no início do
+        # expediente e a cancelada ficam de fora
+        self.assertEqual(len(ocupados), 4)
+        self.assertEqual(ocupados[1], (no_dia(self.data, 10, 5), no_dia(self.data, 10, 35)))
+
+class SlotsPeriodoTest(TestCase):
+    """Testes do cálculo de vários dias de um prestador com uma leitura do período."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.segunda = proxima_segunda()
+        # Atende de segunda a sexta
+        cls.provider = criar_prestador('prestador@exemplo.com', dias=range(5))
+        cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+
+        terca = cls.segunda + timedelta(days=1)
+        quarta = cls.segunda + timedelta(days=2)
+        reservar(cls.provider, cliente, no_dia(terca, 9), no_dia(terca, 9, 30))
+        reservar(cls.provider, cliente, no_dia(terca, 9, 30), no_dia(terca, 10, 30))
+        reservar(cls.provider, cliente, no_dia(quarta, 12), no_dia(quarta, 12, 30), status='canceled')
+        # Pausa que atravessa a noite de quarta para quinta
+        ProviderBreak.objects.create(
+            provider=cls.provider,
+            start_datetime=no_dia(quarta, 12, 30),
+            end_datetime=no_dia(quarta + timedelta(days=1), 9, 50)
+        )
+
+    def test_igual_ao_calculo_de_cada_dia(self):
+        domingo = self.segunda + timedelta(days=6)
+
+        # Disponibilidades, reservas e pausas lidas uma vez para a semana inteira
+        with self.assertNumQueries(3):
+            periodo = calcular_slots_periodo(self.provider, self.segunda, domingo)
+
+        self.assertEqual([data for data, _ in periodo], [self.segunda + timedelta(days=i) for i in range(7)])
+        for data, slots in periodo:
+            self.assertEqual(slots, slots_por_consulta(self.provider, data), data)
+
+        disponiveis = {data: [slot['is_available'] for slot in slots] for data, slots in periodo}
+        self.assertEqual(disponiveis[self.segunda + timedelta(days=1)][:4], [False, False, False, True])
+        # A pausa da noite ocupa o último slot da quarta e os dois primeiros da quinta
+        self.assertEqual(disponiveis[self.segunda + timedelta(days=2)][-2:], [True, False])
+        self.assertEqual(disponiveis[self.segunda + timedelta(days=3)][:3], [False, False, True])
+
+    def test_dias_sem_expediente_vazios(self):
+        sabado = self.segunda + timedelta(days=5)
+
+        with self.assertNumQueries(1):
+            periodo = calcular_slots_periodo(self.provider, sabado, sabado + timedelta(days=1))
+
+        self.assertEqual(periodo, [(sabado, []), (sabado + timedelta(days=1), [])])
+
+class SlotsPrestadoresTest(TestCase):
+    """Testes da grade de vários prestadores em uma data."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.manha = criar_prestador('manha@exemplo.com')
+        cls.tarde = criar_prestador('tarde@exemplo.com', inicio=time(14), fim=time(18), average_service_time=45, interval_between_bookings=0)
+        cls.folga = criar_prestador('folga@exemplo.com', dias=[])
+        cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+
+        reservar(cls.manha, cliente, no_dia(cls.data, 9, 40), no_dia(cls.data, 10, 10))
+        reservar(cls.tarde, cliente, no_dia(cls.data, 14, 30), no_dia(cls.data, 15, 15))
+        ProviderBreak.objects.create(provider=cls.tarde, start_datetime=no_dia(cls.data, 16), end_datetime=no_dia(cls.data, 16, 30))
+
+    def test_igual_ao_calculo_de_cada_prestador(self):
+        providers = [self.manha, self.tarde, self.folga]
+
+        # Disponibilidades, reservas e pausas de todos os prestadores em três consultas
+        with self.assertNumQueries(3):
+            grade = calcular_slots_prestadores(providers, self.data)
+
+        self.assertEqual(set(grade), {provider.id for provider in providers})
+        for provider in providers:
+            self.assertEqual(grade[provider.id], slots_por_consulta(provider, self.data), provider.user.email)
+        self.assertEqual(grade[self.folga.id], [])
+        self.assertEqual(
+            [slot['is_available'] for slot in grade[self.tarde.id]],
+            [False, False, False, False, True]
+        )
+
+    def test_sem_prestadores(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(calcular_slots_prestadores([], self.data), {})
+
+class CacheDisponibilidadeTest(RedisReservasMixin, TestCase):
+    """Testes do cache de disponibilidade por prestador e dia."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com')
+        cls.cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+        cls.dia = (cls.provider.id, cls.data)
+
+    def test_resultado_anterior_a_invalidacao_descartado(self):
+        # Um cálculo lê a versão, uma reserva invalida o dia e o cálculo termina depois
+        versoes = cache_disponibilidade.obter_versoes([self.dia])
+        cache_disponibilidade.invalidar_dias(self.provider.id, [self.data])
+        cache_disponibilidade.salvar_slots(versoes, {self.dia: ['desatualizado']})
+
+        self.assertEqual(cache_disponibilidade.obter_slots(cache_disponibilidade.obter_versoes([self.dia])), {})
+
+    def test_invalidacao_limitada_ao_dia(self):
+        outro_dia = (self.provider.id, self.data + timedelta(days=1))
+        versoes = cache_disponibilidade.obter_versoes([self.dia, outro_dia])
+        cache_disponibilidade.salvar_slots(versoes, {self.dia: ['segunda'], outro_dia: ['terca']})
+
+        cache_disponibilidade.invalidar_dias(self.provider.id, [self.data])
+
+        self.assertEqual(
+            cache_disponibilidade.obter_slots(cache_disponibilidade.obter_versoes([self.dia, outro_dia])),
+            {outro_dia: ['terca']}
+        )
+
+    def test_invalidar_prestador(self):
+        versoes = cache_disponibilidade.obter_versoes([self.dia])
+        cache_disponibilidade.salvar_slots(versoes, {self.dia: ['antigo']})
+
+        cache_disponibilidade.invalidar_prestador(self.provider.id)
+
+        self.assertEqual(cache_disponibilidade.obter_slots(cache_disponibilidade.obter_versoes([self.dia])), {})
+
+    def test_reserva_invalida_o_dia_apos_o_commit(self):
+        self.assertTrue(all(slot['is_available'] for slot in tasks.calcular_horarios_disponiveis(self.provider.id, self.data)))
+        tasks.calcular_horarios_disponiveis(self.provider.id, self.data)
+        self.assertEqual(cache_disponibilidade.estatisticas()['hits'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(
+                user=self.cliente,
+                provider=self.provider,
+                start_datetime=no_dia(self.data, 9),
+                end_datetime=no_dia(self.data, 9, 30)
+            )
+
+        slots = tasks.calcular_horarios_disponiveis(self.provider.id, self.data)
+        self.assertEqual([slot['is_available'] for slot in slots[:2]], [False, True])
+        self.assertEqual(cache_disponibilidade.estatisticas()['misses'], 2)
+
+class MaterializacaoTest(RedisReservasMixin, TestCase):
+    """Testes dos horários materializados mantidos a cada reserva."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com', materialize_slots=True)
+        cls.cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+        reservar(cls.provider, cls.cliente, no_dia(cls.data, 9, 40), no_dia(cls.data, 10, 10))
+        ProviderBreak.objects.create(provider=cls.provider, start_datetime=no_dia(cls.data, 11), end_datetime=no_dia(cls.data, 11, 30))
+
+    def setUp(self):
+        super().setUp()
+        materializacao.rematerializar_prestador(self.provider.id)
+
+    def _estados(self):
+        return list(ProviderSlot.objects.filter(
+            provider=self.provider,
+            start_datetime__date=self.data
+        ).values_list('state', flat=True))
+
+    def test_estados_iguais_a_varredura(self):
+        self.assertEqual(self._estados(), ['free', 'booked', 'free', 'blocked', 'free', 'free'])
+        self.assertEqual(
+            [slot['is_available'] for slot in slots_por_consulta(self.provider, self.data)],
+            [estado == 'free' for estado in self._estados()]
+        )
+
+    def test_disponibilidade_lida_dos_materializados(self):
+        esperados = slots_por_consulta(self.provider, self.data)
+
+        slots = tasks.calcular_horarios_disponiveis(self.provider.id, self.data)
+
+        self.assertEqual(
+            [(slot['start_time'], slot['is_available']) for slot in slots],
+            [(slot['start_time'], slot['is_available']) for slot in esperados]
+        )
+
+    @mock.patch.object(tasks, 'agendar_oferta_vagas')
+    def test_reserva_e_cancelamento_reavaliam_apenas_os_slots_tocados(self, agendar_oferta_vagas):
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva = Booking.objects.create(
+                user=self.cliente,
+                provider=self.provider,
+                start_datetime=no_dia(self.data, 12, 20),
+                end_datetime=no_dia(self.data, 12, 50)
+            )
+        self.assertEqual(self._estados(), ['free', 'booked', 'free', 'blocked', 'free', 'booked'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva.status = 'canceled'
+            reserva.save()
+        self.assertEqual(self._estados(), ['free', 'booked', 'free', 'blocked', 'free', 'free'])
+        agendar_oferta_vagas.assert_called_once()
+
+    def test_leitura_entre_a_reavaliacao_e_a_invalidacao(self):
+        def ler_depois(funcao):
+            def executar(*args, **kwargs):
+                resultado = funcao(*args, **kwargs)
+                tasks.calcular_horarios_disponiveis(self.provider.id, self.data)
+                return resultado
+            return executar
+
+        tasks.calcular_horarios_disponiveis(self.provider.id, self.data)
+
+        # Uma leitura logo após cada etapa não pode deixar no cache o estado anterior à reserva
+        with mock.patch.object(materializacao, 'reavaliar_intervalos', ler_depois(materializacao.reavaliar_intervalos)), \
+                mock.patch.object(cache_disponibilidade, 'invalidar_dias', ler_depois(cache_disponibilidade.invalidar_dias)):
+            with self.captureOnCommitCallbacks(execute=True):
+                Booking.objects.create(
+                    user=self.cliente,
+                    provider=self.provider,
+                    start_datetime=no_dia(self.data, 12, 20),
+                    end_datetime=no_dia(self.data, 12, 50)
+                )
+
+        slots = tasks.calcular_horarios_disponiveis(self.provider.id, self.data)
+        self.assertEqual([slot['is_available'] for slot in slots], [True, False, True, False, True, False])
+
+    def test_dia_que_entra_no_horizonte(self):
+        ultimo = materializacao.horizonte()[1]
+        dia = (self.provider.id, ultimo)
+        ProviderSlot.objects.filter(provider=self.provider, start_datetime__date=ultimo).delete()
+
+        # Ainda sem linhas, o dia é calculado pela varredura em vez de ficar vazio
+        self.assertEqual(
+            [(slot['start_time'], slot['is_available']) for slot in tasks.calcular_horarios_disponiveis(*dia)],
+            [(slot['start_time'], slot['is_available']) for slot in slots_por_consulta(self.provider, ultimo)]
+        )
+        self.assertIn(dia, cache_disponibilidade.obter_slots(cache_disponibilidade.obter_versoes([dia])))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(materializacao.avancar_horizonte(self.provider), 6)
+
+        self.assertEqual(cache_disponibilidade.obter_slots(cache_disponibilidade.obter_versoes([dia])), {})
+
+    def test_prestador_sem_materializacao_nao_consulta(self):
+        with self.assertNumQueries(0):
+            atualizados = materializacao.reavaliar_intervalos(
+                self.provider.id,
+                [(no_dia(self.data, 9), no_dia(self.data, 10))],
+                materializado=False
+            )
+        self.assertEqual(atualizados, 0)
+
+class OcupacaoEmMassaTest(TestCase):
+    """Compara o cálculo de vários prestadores em lote com a varredura de cada um."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.segunda = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com', dias=range(6))
+        cls.livre = criar_prestador('livre@exemplo.com', inicio=time(8, 7), fim=time(17, 3), average_service_time=25, interval_between_bookings=7)
+        cls.folga = criar_prestador('folga@exemplo.com', dias=[])
+        cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+
+        # Horários quebrados, fora de múltiplos de 5 minutos
+        reservar(cls.provider, cliente, no_dia(cls.segunda, 9, 3), no_dia(cls.segunda, 9, 37))
+        reservar(cls.provider, cliente, no_dia(cls.segunda, 10, 51), no_dia(cls.segunda, 10, 58))
+        reservar(cls.provider, cliente, no_dia(cls.segunda, 12, 49), no_dia(cls.segunda, 13, 1))
+        terca = cls.segunda + timedelta(days=1)
+        reservar(cls.provider, cliente, no_dia(terca, 9, 30), no_dia(terca, 11, 2))
+        ProviderBreak.objects.create(
+            provider=cls.provider,
+            start_datetime=no_dia(terca, 12, 44),
+            end_datetime=no_dia(terca + timedelta(days=1), 9, 1)
+        )
+
+    def test_igual_a_varredura(self):
+        domingo = self.segunda + timedelta(days=6)
+        providers = [self.provider, self.livre, self.folga]
+
+        resultado = calcular_slots_em_massa(providers, self.segunda, domingo)
+
+        for provider in providers:
+            self.assertEqual(
+                list(resultado[provider.id].items()),
+                calcular_slots_periodo(provider, self.segunda, domingo),
+                provider.user.email
+            )
+
+    def test_reserva_no_intervalo_entre_slots(self):
+        slots = calcular_slots_em_massa([self.provider], self.segunda, self.segunda)[self.provider.id][self.segunda]
+
+        # A reserva das 10:51 às 10:58 cai no intervalo entre os slots das 10:20 e das 11:00
+        self.assertEqual(
+            [(timezone.localtime(slot['start_time']).strftime('%H:%M'), slot['is_available']) for slot in slots],
+            [('09:00', False), ('09:40', True), ('10:20', True), ('11:00', True), ('11:40', True), ('12:20', False)]
+        )
+
+    def test_tres_consultas_para_o_conjunto(self):
+        with self.assertNumQueries(3):
+            calcular_slots_em_massa([self.provider, self.livre, self.folga], self.segunda, self.segunda + timedelta(days=59))
+
+@override_settings(TIME_ZONE='America/New_York')
+class OcupacaoEmMassaHorarioVeraoTest(TestCase):
+    """Compara os dois cálculos nos dias de mudança do horário de verão."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = criar_prestador('prestador@exemplo.com', inicio=time(0), fim=time(6), average_service_time=50, interval_between_bookings=0)
+        cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+        # Início (10/03/2030) e fim (03/11/2030) do horário de verão
+        for data in (date(2030, 3, 10), date(2030, 11, 3)):
+            reservar(cls.provider, cliente, no_dia(data, 0, 55), no_dia(data, 1, 20))
+            reservar(cls.provider, cliente, no_dia(data, 4, 12), no_dia(data, 4, 18))
+
+    def test_igual_a_varredura(self):
+        for inicio, fim in ((date(2030, 3, 9), date(2030, 3, 11)), (date(2030, 11, 2), date(2030, 11, 4))):
+            resultado = calcular_slots_em_massa([self.provider], inicio, fim)[self.provider.id]
+            self.assertEqual(list(resultado.items()), calcular_slots_periodo(self.provider, inicio, fim))
+
+class BuscaPrimeirosHorariosTest(RedisReservasMixin, TestCase):
+    """Testes da busca dos primeiros horários livres entre vários prestadores."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.calculado = criar_prestador('calculado@exemplo.com')
+        cls.materializado = criar_prestador('materializado@exemplo.com', inicio=time(10), fim=time(12), materialize_slots=True)
+        cls.cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+        reservar(cls.calculado, cls.cliente, no_dia(cls.data, 9), no_dia(cls.data, 9, 30))
+
+    def setUp(self):
+        super().setUp()
+        materializacao.rematerializar_prestador(self.materializado.id)
+
+    def _buscar(self, limite=4, **kwargs):
+        return [
+            (horario['provider_id'], timezone.localtime(horario['start_time']).strftime('%H:%M'))
+            for horario in buscar_primeiros_horarios(
+                [self.calculado, self.materializado],
+                no_dia(self.data, 0),
+                no_dia(self.data, 23),
+                limite,
+                **kwargs
+            )
+        ]
+
+    def test_intercala_calculados_e_materializados(self):
+        self.assertEqual(self._buscar(), [
+            (self.calculado.id, '09:40'),
+            (self.materializado.id, '10:00'),
+            (self.calculado.id, '10:20'),
+            (self.materializado.id, '10:40'),
+        ])
+
+    def test_ignora_dia_lotado_e_horario_retido(self):
+        capacidade.ajustar(self.calculado.id, self.data, self.calculado.max_daily_bookings)
+        retencoes.reter_horario(self.materializado.id, no_dia(self.data, 10), no_dia(self.data, 10, 30), self.cliente.id)
+
+        self.assertEqual(self._buscar(limite=2), [
+            (self.materializado.id, '10:40'),
+            (self.materializado.id, '11:20'),
+        ])
+
+    def test_faixa_de_horas(self):
+        self.assertEqual(self._buscar(limite=3, hora_minima=time(11)), [
+            (self.calculado.id, '11:00'),
+            (self.materializado.id, '11:20'),
+            (self.calculado.id, '11:40'),
+        ])
+
+class CriacaoReservaTest(RedisReservasMixin, TestCase):
+    """Testes da criação e do reagendamento de reservas com o dia do prestador travado."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        # Atende de segunda a sexta
+        cls.provider = criar_prestador('prestador@exemplo.com', dias=range(5))
+        cls.cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+        ProviderBreak.objects.create(provider=cls.provider, start_datetime=no_dia(cls.data, 12), end_datetime=no_dia(cls.data, 13))
+
+    def test_cria_com_o_dia_travado(self):
+        reserva = criar_reserva(self.cliente, self.provider, no_dia(self.data, 9), notes='Primeira vez')
+
+        self.assertEqual(reserva.end_datetime, no_dia(self.data, 9, 30))
+        self.assertEqual(reserva.status, 'pending')
+        self.assertTrue(ProviderDayLock.objects.filter(provider=self.provider, date=self.data).exists())
+
+    def test_recusa_reserva_sobreposta_com_outro_inicio(self):
+        criar_reserva(self.cliente, self.provider, no_dia(self.data, 9))
+
+        with self.assertRaises(ConflitoReservaError):
+            criar_reserva(self.cliente, self.provider, no_dia(self.data, 9, 20))
+        with self.assertRaises(ConflitoReservaError):
+            criar_reserva(self.cliente, self.provider, no_dia(self.data, 8, 45))
+
+        # Colada ao fim da anterior
+        criar_reserva(self.cliente, self.provider, no_dia(self.data, 9, 30))
+        self.assertEqual(Booking.objects.filter(provider=self.provider).count(), 2)
+
+    def test_recusa_fora_do_expediente_e_na_pausa(self):
+        for inicio in (no_dia(self.data, 8, 45), no_dia(self.data, 11, 45), no_dia(self.data + timedelta(days=5), 9)):
+            with self.assertRaises(ConflitoReservaError):
+                criar_reserva(self.cliente, self.provider, inicio)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_reagendamento_ignora_a_propria_reserva(self):
+        reserva = criar_reserva(self.cliente, self.provider, no_dia(self.data, 9))
+        outra = criar_reserva(self.cliente, self.provider, no_dia(self.data, 10))
+
+        reagendar_reserva(reserva, no_dia(self.data, 9, 15))
+        with self.assertRaises(ConflitoReservaError):
+            reagendar_reserva(reserva, no_dia(self.data, 9, 45))
+
+        reserva.refresh_from_db()
+        self.assertEqual(reserva.start_datetime, no_dia(self.data, 9, 15))
+        outra.refresh_from_db()
+        self.assertEqual(outra.start_datetime, no_dia(self.data, 10))
+
+class RetencaoHorarioTest(RedisReservasMixin, TestCase):
+    """Testes das retenções de horário durante o checkout."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com')
+        cls.comprador = User.objects.create_user('comprador@exemplo.com', first_name='Caio', last_name='Lima')
+        cls.outro = User.objects.create_user('outro@exemplo.com', first_name='Bia', last_name='Reis')
+
+    def _reter(self, usuario, hora, minuto=0):
+        inicio = no_dia(self.data, hora, minuto)
+        return retencoes.reter_horario(self.provider.id, inicio, inicio + timedelta(minutes=30), usuario.id)
+
+    def test_retencao_sobreposta_recusada(self):
+        self.assertIsNotNone(self._reter(self.comprador, 9))
+
+        self.assertIsNone(self._reter(self.outro, 9, 20))
+        self.assertIsNotNone(self._reter(self.outro, 9, 30))
+
+    def test_horario_retido_bloqueia_outros_usuarios(self):
+        token, _ = self._reter(self.comprador, 9)
+
+        with self.assertRaises(ConflitoReservaError):
+            criar_reserva(self.outro, self.provider, no_dia(self.data, 9, 15))
+        slots = tasks.calcular_horarios_disponiveis(self.provider.id, self.data)
+        self.assertEqual([slot.get('is_held', False) for slot in slots[:2]], [True, False])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            criar_reserva(self.comprador, self.provider, no_dia(self.data, 9), hold_token=token)
+
+        # A retenção é consumida com a reserva
+        self.assertIsNone(retencoes.obter_retencao(token))
+
+    def test_retencao_expira(self):
+        self._reter(self.comprador, 9)
+        depois = retencoes.time.time() + settings.SLOT_HOLD_SECONDS + 1
+
+        with mock.patch.object(retencoes.time, 'time', return_value=depois):
+            self.assertTrue(retencoes.verificar_retencao(self.provider.id, no_dia(self.data, 9), no_dia(self.data, 9, 30)))
+            self.assertIsNotNone(self._reter(self.outro, 9, 10))
+
+    def test_liberar_exige_o_mesmo_horario(self):
+        token, _ = self._reter(self.comprador, 9)
+
+        self.assertFalse(retencoes.liberar_retencao(self.provider.id, no_dia(self.data, 9, 30), token))
+        self.assertTrue(retencoes.liberar_retencao(self.provider.id, no_dia(self.data, 9), token))
+        self.assertIsNotNone(self._reter(self.outro, 9))
+
+class CapacidadeDiariaTest(RedisReservasMixin, TestCase):
+    """Testes dos contadores diários de reservas ativas por prestador."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com', max_daily_bookings=2)
+        cls.cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+
+    def _contador(self, data=None):
+        data = data or self.data
+        return capacidade.obter([(self.provider.id, data)])[(self.provider.id, data)]
+
+    def test_contador_acompanha_criacao_cancelamento_e_reagendamento(self):
+        reserva = criar_reserva(self.cliente, self.provider, no_dia(self.data, 9))
+        criar_reserva(self.cliente, self.provider, no_dia(self.data, 10))
+        self.assertEqual(self._contador(), 2)
+
+        terca = self.data + timedelta(days=1)
+        reagendar_reserva(reserva, no_dia(terca, 9))
+        self.assertEqual((self._contador(), self._contador(terca)), (1, 1))
+
+        reserva.status = 'canceled'
+        reserva.save()
+        self.assertEqual((self._contador(), self._contador(terca)), (1, 0))
+
+    def test_recusa_reserva_acima_do_limite_diario(self):
+        criar_reserva(self.cliente, self.provider, no_dia(self.data, 9))
+        criar_reserva(self.cliente, self.provider, no_dia(self.data, 10))
+
+        with self.assertRaises(ConflitoReservaError):
+            criar_reserva(self.cliente, self.provider, no_dia(self.data, 11))
+        self.assertTrue(capacidade.dia_lotado(self.provider.id, self.data))
+
+        # Sem o contador do dia seguinte, a reserva é aceita
+        criar_reserva(self.cliente, self.provider, no_dia(self.data + timedelta(days=1), 9))
+
+    def test_reconciliar_regrava_contadores_pelo_banco(self):
+        # Reservas gravadas sem os sinais deixam os contadores desatualizados
+        reservar(self.provider, self.cliente, no_dia(self.data, 9), no_dia(self.data, 9, 30))
+        reservar(self.provider, self.cliente, no_dia(self.data, 10), no_dia(self.data, 10, 30), status='pending')
+        reservar(self.provider, self.cliente, no_dia(self.data, 11), no_dia(self.data, 11, 30), status='canceled')
+        quarta = self.data + timedelta(days=2)
+        capacidade.ajustar(self.provider.id, quarta, 3)
+
+        self.assertEqual(capacidade.reconciliar(self.data, quarta), 1)
+
+        self.assertEqual((self._contador(), self._contador(quarta)), (2, 0))
+        self.assertFalse(get_redis_client().exists(capacidade._chave(self.provider.id, quarta)))
+
+class TransicoesEmLotesTest(RedisReservasMixin, TestCase):
+    """Testes das transições de status em lotes com UPDATE protegido pelo status esperado."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com')
+        cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+        cls.pendentes = [
+            reservar(cls.provider, cliente, no_dia(cls.data, 9 + indice), no_dia(cls.data, 9 + indice, 30), status='pending')
+            for indice in range(4)
+        ]
+        cls.confirmada = reservar(cls.provider, cliente, no_dia(cls.data, 14), no_dia(cls.data, 14, 30))
+        cls.recente = reservar(cls.provider, cliente, no_dia(cls.data, 15), no_dia(cls.data, 15, 30), status='pending')
+
+        cls.limite = timezone.now() - timedelta(hours=12)
+        Booking.objects.exclude(id=cls.recente.id).update(created_at=cls.limite - timedelta(hours=1))
+
+    def _status(self):
+        return dict(Booking.objects.values_list('id', 'status'))
+
+    def test_altera_apenas_as_que_atendem_status_e_filtros(self):
+        capacidade.ajustar(self.provider.id, self.data, 6)
+        todos = [reserva.id for reserva in self.pendentes + [self.confirmada, self.recente]]
+
+        lotes = list(transicionar_em_lotes(['pending'], 'canceled', tamanho_lote=2, id__in=todos, created_at__lt=self.limite))
+
+        self.assertEqual(sorted(sum(lotes, [])), sorted(reserva.id for reserva in self.pendentes))
+        status = self._status()
+        self.assertEqual({status[reserva.id] for reserva in self.pendentes}, {'canceled'})
+        self.assertEqual((status[self.confirmada.id], status[self.recente.id]), ('confirmed', 'pending'))
+        # Os contadores acompanham as reservas canceladas
+        self.assertEqual(capacidade.obter([(self.provider.id, self.data)])[(self.provider.id, self.data)], 2)
+
+    def test_ignora_reserva_alterada_apos_a_selecao_dos_ids(self):
+        alvo = self.pendentes[1]
+        selecionar_para_alterar = Booking.objects.select_for_update
+
+        def confirmar_antes_de_travar(*args, **kwargs):
+            # Outra transação confirma a reserva entre a seleção dos ids e a trava
+            Booking.objects.filter(id=alvo.id).update(status='confirmed')
+            return selecionar_para_alterar(*args, **kwargs)
+
+        with mock.patch.object(Booking.objects, 'select_for_update', side_effect=confirmar_antes_de_travar):
+            alterados = sum(transicionar_em_lotes(['pending'], 'canceled', created_at__lt=self.limite), [])
+
+        self.assertNotIn(alvo.id, alterados)
+        self.assertEqual(len(alterados), 3)
+        self.assertEqual(self._status()[alvo.id], 'confirmed')
+
+    def test_lote_com_falha_desfeito_e_informado(self):
+        falhos = []
+
+        def falhar_primeiro_lote(ids):
+            if not falhos:
+                raise RuntimeError('falha ao gravar efeitos')
+
+        lotes = list(transicionar_em_lotes(
+            ['pending'], 'canceled',
+            tamanho_lote=2,
+            ao_alterar=falhar_primeiro_lote,
+            ao_falhar=falhos.extend,
+            created_at__lt=self.limite
+        ))
+
+        self.assertEqual(len(falhos), 2)
+        self.assertEqual(len(lotes), 1)
+        status = self._status()
+        self.assertEqual({status[booking_id] for booking_id in falhos}, {'pending'})
+        self.assertEqual({status[booking_id] for booking_id in lotes[0]}, {'canceled'})
+
+class CicloVidaTest(RedisReservasMixin, TestCase):
+    """Testes dos prazos agendados de expiração, conclusão e avaliação das reservas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com')
+        cls.cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+        cls.vencida = reservar(cls.provider, cls.cliente, no_dia(cls.data, 9), no_dia(cls.data, 9, 30), status='pending')
+        cls.no_prazo = reservar(cls.provider, cls.cliente, no_dia(cls.data, 10), no_dia(cls.data, 10, 30), status='pending')
+        cls.confirmada = reservar(cls.provider, cls.cliente, no_dia(cls.data, 11), no_dia(cls.data, 11, 30))
+        Booking.objects.filter(id=cls.vencida.id).update(created_at=timezone.now() - timedelta(hours=13))
+
+    def _prazo(self, transicao, reserva):
+        return get_redis_client().zscore(ciclo_vida._chave(transicao), str(reserva.id))
+
+    def test_popular_agenda_reservas_existentes(self):
+        self.assertEqual(ciclo_vida.popular(Booking.objects.all()), 3)
+
+        self.assertIsNotNone(self._prazo(ciclo_vida.EXPIRAR, self.no_prazo))
+        self.assertEqual(self._prazo(ciclo_vida.CONCLUIR, self.confirmada), no_dia(self.data, 11, 30).timestamp())
+
+    def test_registrar_troca_o_prazo_com_o_status(self):
+        reserva = Booking.objects.get(id=self.no_prazo.id)
+        ciclo_vida.registrar(reserva.id, reserva.status, reserva.created_at, reserva.end_datetime)
+
+        ciclo_vida.registrar(reserva.id, 'confirmed', reserva.created_at, reserva.end_datetime)
+
+        self.assertIsNone(self._prazo(ciclo_vida.EXPIRAR, reserva))
+        self.assertIsNotNone(self._prazo(ciclo_vida.CONCLUIR, reserva))
+
+    def test_reivindicar_retira_apenas_as_vencidas(self):
+        ciclo_vida.popular(Booking.objects.filter(status='pending'))
+
+        self.assertEqual(ciclo_vida.reivindicar(ciclo_vida.EXPIRAR, timezone.now(), 10), [str(self.vencida.id)])
+        # Um segundo despachante não recebe a mesma reserva
+        self.assertEqual(ciclo_vida.reivindicar(ciclo_vida.EXPIRAR, timezone.now(), 10), [])
+        self.assertIsNotNone(self._prazo(ciclo_vida.EXPIRAR, self.no_prazo))
+
+    def test_processa_vencidas(self):
+        ciclo_vida.popular(Booking.objects.all())
+
+        tasks.processar_transicoes_vencidas()
+
+        self.assertEqual(
+            dict(Booking.objects.values_list('id', 'status')),
+            {self.vencida.id: 'canceled', self.no_prazo.id: 'pending', self.confirmada.id: 'confirmed'}
+        )
+        self.assertEqual(OutboxMessage.objects.get().args, [[str(self.vencida.id)]])
+
+    def test_lote_com_falha_volta_para_o_prazo(self):
+        ciclo_vida.popular(Booking.objects.all())
+
+        with mock.patch.object(transicoes, 'aplicar_efeitos_transicao', side_effect=RuntimeError('falha')):
+            tasks.processar_transicoes_vencidas()
+
+        self.assertEqual(Booking.objects.get(id=self.vencida.id).status, 'pending')
+        prazo = self._prazo(ciclo_vida.EXPIRAR, self.vencida)
+        esperado = (timezone.now() + ciclo_vida.ATRASO_RETENTATIVA).timestamp()
+        self.assertAlmostEqual(prazo, esperado, delta=5)
+
+        # Reprocessada quando o novo prazo vence
+        with mock.patch.object(tasks.timezone, 'now', return_value=timezone.now() + timedelta(minutes=2)):
+            tasks.processar_transicoes_vencidas()
+        self.assertEqual(Booking.objects.get(id=self.vencida.id).status, 'canceled')
+
+class ArquivamentoTest(TestCase):
+    """Testes da movimentação de reservas antigas para o arquivo e do histórico unificado."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = criar_prestador('prestador@exemplo.com')
+        cls.cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+        antiga = timezone.localdate() - timedelta(days=400)
+        recente = timezone.localdate() - timedelta(days=10)
+
+        cls.concluida = reservar(cls.provider, cls.cliente, no_dia(antiga, 9), no_dia(antiga, 9, 30), status='completed')
+        cls.cancelada = reservar(cls.provider, cls.cliente, no_dia(antiga, 10), no_dia(antiga, 10, 30), status='canceled')
+        # Reservas antigas ainda ativas e reservas recentes ficam na tabela de reservas
+        cls.ativa = reservar(cls.provider, cls.cliente, no_dia(antiga, 11), no_dia(antiga, 11, 30))
+        cls.recente = reservar(cls.provider, cls.cliente, no_dia(recente, 9), no_dia(recente, 9, 30), status='completed')
+
+        review = Review.objects.create(booking=cls.concluida, rating=4, comment='Muito bom')
+        ReviewResponse.objects.create(review=review, text='Obrigada', responded_by=cls.provider.user)
+        Review.objects.create(booking=cls.recente, rating=5)
+
+    def test_move_finalizadas_com_a_avaliacao_e_a_resposta(self):
+        limite = timezone.now() - timedelta(days=365)
+
+        self.assertEqual(mover_lote(limite, tamanho_lote=1), 1)
+        self.assertEqual(mover_lote(limite), 1)
+        self.assertEqual(mover_lote(limite), 0)
+
+        self.assertEqual(
+            set(Booking.objects.values_list('id', flat=True)),
+            {self.ativa.id, self.recente.id}
+        )
+        arquivada = BookingArchive.objects.get(id=self.concluida.id)
+        self.assertEqual(
+            (arquivada.status, arquivada.confirmation_code, arquivada.review_rating, arquivada.review_comment),
+            ('completed', self.concluida.confirmation_code, 4, 'Muito bom')
+        )
+        self.assertEqual(
+            (arquivada.review_response_text, arquivada.review_response_by_id),
+            ('Obrigada', self.provider.user.id)
+        )
+        self.assertIsNotNone(arquivada.review_response_created_at)
+        self.assertIsNone(BookingArchive.objects.get(id=self.cancelada.id).review_rating)
+        self.assertFalse(ReviewResponse.objects.exists())
+        self.assertEqual(Review.objects.get().booking_id, self.recente.id)
+
+    @override_settings(CACHES=CACHE_LOCAL)
+    def test_avaliacoes_arquivadas_nas_estatisticas(self):
+        mover_lote(timezone.now() - timedelta(days=365))
+
+        self.assertEqual(gerar_estatisticas_dashboard()['distribuicao_avaliacoes'], {4: 1, 5: 1})
+
+    def test_historico_une_ativas_e_arquivadas(self):
+        mover_lote(timezone.now() - timedelta(days=365))
+
+        historico = list(historico_reservas(user_id=self.cliente.id))
+
+        self.assertEqual(
+            [(linha['id'], linha['archived'], linha['rating']) for linha in historico],
+            [
+                (self.recente.id, False, 5),
+                (self.ativa.id, False, None),
+                (self.cancelada.id, True, None),
+                (self.concluida.id, True, 4),
+            ]
+        )
+        self.assertEqual({linha['provider_name'] for linha in historico}, {'Ana Souza'})
+        self.assertEqual(list(historico_reservas(user_id=self.provider.user.id)), [])
+
+class AuditoriaConflitosTest(TestCase):
+    """Testes da busca de pares de reservas sobrepostas em uma passada."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com')
+        cls.outro = criar_prestador('outro@exemplo.com')
+        cliente = User.objects.create_user('cliente@exemplo.com', first_name='Caio', last_name='Lima')
+
+        cls.a = reservar(cls.provider, cliente, no_dia(cls.data, 9), no_dia(cls.data, 10))
+        cls.b = reservar(cls.provider, cliente, no_dia(cls.data, 9, 30), no_dia(cls.data, 10, 30))
+        cls.c = reservar(cls.provider, cliente, no_dia(cls.data, 9, 45), no_dia(cls.data, 9, 50), status='pending')
+        # Colada ao fim de B, sem sobreposição
+        cls.d = reservar(cls.provider, cliente, no_dia(cls.data, 10, 30), no_dia(cls.data, 11))
+        reservar(cls.provider, cliente, no_dia(cls.data, 10, 40), no_dia(cls.data, 10, 50), status='canceled')
+        # Mesmo horário em outro prestador
+        reservar(cls.outro, cliente, no_dia(cls.data, 9), no_dia(cls.data, 11))
+
+    def test_pares_sobrepostos_por_prestador(self):
+        linhas = Booking.objects.filter(
+            status__in=STATUS_OCUPANTES
+        ).order_by('provider_id', 'start_datetime').values_list('id', 'provider_id', 'start_datetime', 'end_datetime')
+
+        pares = {(frozenset((id_a, id_b)), inicio, fim) for _, id_a, id_b, inicio, fim in encontrar_conflitos(linhas)}
+
+        self.assertEqual(pares, {
+            (frozenset((self.a.id, self.b.id)), no_dia(self.data, 9, 30), no_dia(self.data, 10)),
+            (frozenset((self.a.id, self.c.id)), no_dia(self.data, 9, 45), no_dia(self.data, 9, 50)),
+            (frozenset((self.b.id, self.c.id)), no_dia(self.data, 9, 45), no_dia(self.data, 9, 50)),
+        })
+
+    def test_sem_linhas(self):
+        self.assertEqual(list(encontrar_conflitos([])), [])
+
+class ListaEsperaTest(TestCase):
+    """Testes da interpretação das preferências e da oferta de vagas em ordem de chegada."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = proxima_segunda()
+        cls.provider = criar_prestador('prestador@exemplo.com', fim=time(18))
+
+        def entrar(email, preferencia='', **campos):
+            usuario = User.objects.create_user(email, first_name='Cliente', last_name='Silva')
+            return WaitingList.objects.create(
+                user=usuario,
+                provider=cls.provider,
+                desired_date=campos.pop('desired_date', cls.data),
+                time_preference=preferencia,
+                **campos
+            )
+
+        cls.tarde = entrar('tarde@exemplo.com', 'Tarde, se possível')
+        cls.qualquer = entrar('qualquer@exemplo.com')
+        cls.manha = entrar('manha@exemplo.com', 'manhã')
+        cls.outro_dia = entrar('outro.dia@exemplo.com', desired_date=cls.data + timedelta(days=1))
+        cls.notificada = entrar('notificada@exemplo.com', is_notified=True)
+
+    def _slot(self, hora, minuto=0):
+        return {'start_time': no_dia(self.data, hora, minuto), 'end_time': no_dia(self.data, hora, minuto + 30)}
+
+    def test_interpretar_preferencia(self):
+        casos = {
+            'manhã': [(time(6), time(12))],
+            '14h-16h': [(time(14), time(16))],
+            '09:00 às 11:30': [(time(9), time(11, 30))],
+            'a partir das 15h': [(time(15), time.max)],
+            'até 12h': [(time.min, time(12))],
+            'Tarde ou 9h30': [(time(12), time(18)), (time(9, 30), time(10, 30))],
+            # Sem preferência, texto não reconhecido ou faixa invertida: qualquer horário
+            '': [],
+            'qualquer horário': [],
+            '16h-14h': [],
+        }
+        for texto, janelas in casos.items():
+            self.assertEqual(interpretar_preferencia(texto), janelas, texto)
+
+    def test_preferencia_cobre(self):
+        janelas = interpretar_preferencia('14h-16h')
+
+        self.assertTrue(preferencia_cobre(janelas, no_dia(self.data, 15), no_dia(self.data, 16)))
+        self.assertFalse(preferencia_cobre(janelas, no_dia(self.data, 15, 45), no_dia(self.data, 16, 15)))
+        self.assertTrue(preferencia_cobre([], no_dia(self.data, 3), no_dia(self.data, 4)))
+
+    def test_oferta_em_ordem_de_chegada_respeitando_preferencias(self):
+        ofertas = ofertar_vagas(self.provider.id, self.data, [self._slot(14), self._slot(9)])
+
+        # O primeiro horário vai para a primeira entrada que o aceita; cada entrada recebe um horário
+        self.assertEqual(
+            [(entrada.id, timezone.localtime(slot['start_time']).hour) for entrada, slot in ofertas],
+            [(self.qualquer.id, 9), (self.tarde.id, 14)]
+        )
+        self.assertEqual(
+            set(WaitingList.objects.filter(is_notified=True).values_list('id', flat=True)),
+            {self.qualquer.id, self.tarde.id, self.notificada.id}
+        )
+
+        # A entrada restante recebe apenas um horário que aceita
+        self.assertEqual(ofertar_vagas(self.provider.id, self.data, [self._slot(15)]), [])
+        self.assertEqual([entrada.id for entrada, _ in ofertar_vagas(self.provider.id, self.data, [self._slot(10)])], [self.manha.id])
+
+    @mock.patch('notificacoes.tasks.criar_notificacoes', side_effect=RuntimeError('falha ao gravar'))
+    @mock.patch.object(tasks, 'calcular_horarios_disponiveis')
+    def test_falha_ao_notificar_desfaz_a_marcacao(self, calcular, criar_notificacoes):
+        calcular.return_value = [dict(self._slot(9), is_available=True)]
+
+        tasks.ofertar_vagas_lista_espera([[self.provider.id, no_dia(self.data, 9).isoformat(), no_dia(self.data, 9, 30).isoformat()]])
+
+        criar_notificacoes.assert_called_once()
+        self.assertFalse(WaitingList.objects.get(id=self.qualquer.id).is_notified)
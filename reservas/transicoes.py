@@ -0,0 +1,115 @@
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+from .models import Booking, Provider
+from .disponibilidade import STATUS_OCUPANTES
+from . import cache as cache_disponibilidade
+from . import capacidade
+from . import materializacao
+
+logger = logging.getLogger(__name__)
+
+# Quantidade de reservas alteradas por UPDATE
+TAMANHO_LOTE = 1000
+
+def aplicar_efeitos_transicao(linhas, status_novo):
+    """
+    Reproduz os efeitos dos sinais de Booking para reservas alteradas via UPDATE em massa.
+
+    `linhas` são tuplas (provider_id, start_datetime, end_datetime, status_anterior).
+    Ajusta os contadores de capacidade e, após o commit, invalida o cache,
+    reavalia os horários materializados dos dias tocados e oferece à lista
+    de espera os horários liberados por cancelamento.
+    """
+    deltas = defaultdict(int)
+    intervalos = defaultdict(list)
+    for provider_id, inicio, fim, status_anterior in linhas:
+        ativa_antes = status_anterior in STATUS_OCUPANTES
+        ativa_depois = status_novo in STATUS_OCUPANTES
+        if ativa_antes == ativa_depois:
+            continue
+        deltas[(provider_id, capacidade.data_local(inicio))] += 1 if ativa_depois else -1
+        intervalos[provider_id].append((inicio, fim))
+
+    try:
+        capacidade.ajustar_em_lote(deltas)
+    except Exception as e:
+        logger.error(f"Erro ao ajustar capacidade diária em lote: {str(e)}")
+
+    def invalidar():
+        # Uma consulta por lote em vez de uma por prestador
+        materializados = set(Provider.objects.filter(
+            id__in=list(intervalos),
+            materialize_slots=True
+        ).values_list('id', flat=True))
+        for provider_id, intervalos_prestador in intervalos.items():
+            datas = set()
+            for inicio, fim in intervalos_prestador:
+                datas.update(cache_disponibilidade.datas_do_intervalo(inicio, fim))
+            # Os horários materializados são atualizados antes de avançar a geração do cache
+            materializacao.reavaliar_intervalos(provider_id, intervalos_prestador, provider_id in materializados)
+            cache_disponibilidade.invalidar_dias(provider_id, datas)
+
+    if intervalos:
+        transaction.on_commit(invalidar)
+
+    # Horários liberados por cancelamento são oferecidos à lista de espera (agrupados por prestador)
+    if intervalos and status_novo == 'canceled':
+        from .tasks import agendar_oferta_vagas
+        vagas = [
+            [provider_id, inicio.isoformat(), fim.isoformat()]
+            for provider_id, intervalos_prestador in intervalos.items()
+            for inicio, fim in intervalos_prestador
+        ]
+        transaction.on_commit(lambda: agendar_oferta_vagas(vagas))
+
+def transicionar_em_lotes(status_anteriores, status_novo, tamanho_lote=TAMANHO_LOTE, ao_alterar=None, ao_falhar=None, **filtros):
+    """
+    Move reservas de `status_anteriores` para `status_novo` em lotes ordenados por id.
+
+    Cada lote seleciona apenas os ids (paginação por chave), trava as linhas
+    que ainda atendem ao status esperado e aos `filtros` (ignorando as já
+    travadas por outra transação) e executa um único UPDATE protegido pelas
+    mesmas condições. `ao_alterar` é chamada com os ids alterados dentro da
+    transação do lote, para gravar efeitos que devem ser confirmados junto
+    com o UPDATE. `ao_falhar` é chamada com os ids de um lote cuja transação
+    falhou. Gera a lista de ids efetivamente alterados de cada lote após o
+    commit.
+    """
+    ultimo_id = None
+    while True:
+        ids = Booking.objects.filter(status__in=status_anteriores, **filtros)
+        if ultimo_id is not None:
+            ids = ids.filter(id__gt=ultimo_id)
+        ids = list(ids.order_by('id').values_list('id', flat=True)[:tamanho_lote])
+        if not ids:
+            break
+        ultimo_id = ids[-1]
+
+        try:
+            with transaction.atomic():
+                # Os filtros podem restringir os próprios ids; por isso vão em um filter() separado
+                linhas = list(Booking.objects.select_for_update(skip_locked=True).filter(
+                    id__in=ids,
+                    status__in=status_anteriores
+                ).filter(**filtros).order_by().values_list('id', 'provider_id', 'start_datetime', 'end_datetime', 'status'))
+                alterados = [linha[0] for linha in linhas]
+                if not alterados:
+                    continue
+
+                Booking.objects.filter(id__in=alterados, status__in=status_anteriores).filter(**filtros).update(
+                    status=status_novo,
+                    updated_at=timezone.now()
+                )
+                aplicar_efeitos_transicao([linha[1:] for linha in linhas], status_novo)
+                if ao_alterar:
+                    ao_alterar(alterados)
+        except Exception as e:
+            logger.error(f"Erro ao alterar lote de reservas até {ultimo_id} para {status_novo}: {str(e)}")
+            if ao_falhar:
+                ao_falhar(ids)
+            continue
+
+        yield alterados